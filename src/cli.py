@@ -0,0 +1,323 @@
+"""
+LiraMic command line
+--------------------
+One entry point for every pipeline step:
+
+    python cli.py dedup      SOURCE OUT_DIR [--max-distance D]       # dedup_map.json + dedup_report.csv
+    python cli.py crop       SOURCE OUTPUT [--fast] [--shard-dir DIR] [--cache FILE] [--dedup-map FILE]
+    python cli.py label      PROCESSED_DIR | --shard-dir DIR
+    python cli.py organize   PROCESSED_DIR
+    python cli.py embed      BY_ANGLE_DIR [--models M1 M2 ...] | --shard-dir DIR
+    python cli.py video      VIDEO_OR_DIR OUT_DIR [--sample-fps F]   # tracked per-frame embeddings
+    python cli.py similarity BY_ANGLE_DIR            # {angle}_pairwise.npz from stored embeddings
+    python cli.py quicklook  BY_ANGLE_DIR [--target-se S] [--pdf P] # sampled preview with standard errors
+    python cli.py cluster    BY_ANGLE_DIR [--k K] [--knn-k K]     # k-means clusters vs. emotion labels
+    python cli.py heatmap    BY_ANGLE_DIR [--gamma G] # PDF from the saved matrices
+    python cli.py report     BY_ANGLE_DIR            # LOSO prototype accuracy, per and across angles
+    python cli.py tune       {embed,detect} IMAGE_DIR              # calibrate workers x threads x batch
+    python cli.py selfcheck                          # import-time budget check
+
+This module and the argument parsing import nothing heavy: torch, cv2, mediapipe, facenet-pytorch,
+matplotlib and the models are only loaded inside the subcommand that needs them, so e.g.
+re-rendering heatmaps never pays for torch start-up.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+if SRC_DIR not in sys.path:
+    sys.path.append(SRC_DIR)
+
+ANGLES = ["front", "left", "right"]
+
+# modules that must not be imported by `import cli` (or any light module)
+HEAVY_MODULES = ("torch", "cv2", "mediapipe", "facenet_pytorch", "matplotlib", "hsemotion", "timm")
+
+
+def _add_path(*parts):
+    path = os.path.join(SRC_DIR, *parts)
+    if path not in sys.path:
+        sys.path.append(path)
+
+
+# ---------------------------------------------------------
+# SUBCOMMANDS
+# ---------------------------------------------------------
+
+def cmd_dedup(args):
+    _add_path("preprocess", "crop")
+    from dedup import build_dedup, save_dedup
+
+    groups, conflicts = build_dedup(args.source, prefix=args.prefix, max_distance=args.max_distance,
+                                    workers=args.workers)
+    save_dedup(groups, args.out_dir, max_distance=args.max_distance, conflicts=conflicts)
+
+
+def cmd_crop(args):
+    _add_path("preprocess")
+    _add_path("preprocess", "crop")
+    from img_preprocess import process_dataset_source, process_dataset_cached
+    from dedup import load_dedup_map
+
+    dim = tuple(args.dim)
+    dedup_map = load_dedup_map(args.dedup_map) if args.dedup_map else None
+    if args.cache:
+        process_dataset_cached(args.source, args.output, args.cache, dim=dim, fast=args.fast,
+                               prefix=args.prefix, workers=args.workers, shard_dir=args.shard_dir,
+                               dedup_map=dedup_map)
+    else:
+        process_dataset_source(args.source, args.output, dim=dim, prefix=args.prefix,
+                               workers=args.workers, shard_dir=args.shard_dir, fast=args.fast,
+                               dedup_map=dedup_map)
+
+
+def cmd_label(args):
+    _add_path("preprocess", "label")
+    if args.shard_dir:
+        from detect_angle import label_angles_in_shard
+        label_angles_in_shard(args.shard_dir)
+    else:
+        from label_dirs import process_emotion_directories
+        process_emotion_directories(args.processed_dir)
+
+
+def cmd_organize(args):
+    _add_path("preprocess", "label")
+    from organize_byAngle import build_kdef_by_angle
+    build_kdef_by_angle(args.processed_dir)
+
+
+def cmd_embed(args):
+    if args.shard_dir:
+        from embeddings.store_embeddings import build_shard_angle_embeddings
+        build_shard_angle_embeddings(args.shard_dir, args.base_dir)
+    else:
+        from embeddings.store_embeddings import build_all_angle_embeddings
+        build_all_angle_embeddings(args.base_dir, flush_every=args.flush_every,
+                                   return_frames=False, models=args.models)
+
+
+def cmd_video(args):
+    from embeddings.video_embeddings import build_video_embeddings
+    build_video_embeddings(args.source, args.out_dir, models=args.models, sample_fps=args.sample_fps,
+                           keyframe_every=args.keyframe_every, batch_size=args.batch_size)
+
+
+def cmd_similarity(args):
+    from pipelines.orchestrator import pairwise_stage
+    for angle in args.angles:
+        parquet = os.path.join(args.base_dir, f"{angle}_embeddings.parquet")
+        out_path = os.path.join(args.base_dir, f"{angle}_pairwise.npz")
+        pairwise_stage(parquet, out_path)
+        print(f"[INFO] Saved {out_path}")
+
+
+def cmd_quicklook(args):
+    from pipelines.quick_look import quick_look, print_report
+
+    results, errors, info = quick_look(args.base_dir, args.angles, target_se=args.target_se,
+                                       max_fraction=args.max_fraction, seed=args.seed)
+    print_report(results, errors, info)
+    if args.pdf:
+        from heatmap.format_heatmap import save_all_heatmaps_to_pdf
+        save_all_heatmaps_to_pdf(results, args.pdf)
+        print(f"[INFO] Saved {args.pdf}")
+
+
+def cmd_cluster(args):
+    from similarity.cluster import cluster_angles
+    cluster_angles(args.base_dir, args.angles, k=args.k, knn_k=args.knn_k, column=args.column, seed=args.seed)
+
+
+def cmd_heatmap(args):
+    from pipelines.orchestrator import heatmap_stage
+    matrix_paths = {a: os.path.join(args.base_dir, f"{a}_pairwise.npz") for a in args.angles}
+    pdf_path = args.pdf or os.path.join(args.base_dir, "emotion_similarity_pairwise.pdf")
+    heatmap_stage(matrix_paths, pdf_path, args.gamma)
+
+
+def cmd_report(args):
+    from similarity.prototype_eval import cross_angle_table
+
+    acc, _ = cross_angle_table(args.base_dir, args.angles, column=args.column, model=args.model)
+    print("\n[LOSO PROTOTYPE ACCURACY] rows = train angle, columns = test angle")
+    print("        " + "".join(f"{a:>8}" for a in args.angles))
+    for i, train in enumerate(args.angles):
+        print(f"{train:>8}" + "".join(f"{acc[i, j]:8.3f}" for j in range(len(args.angles))))
+
+
+def cmd_tune(args):
+    from model.autotune import calibrate
+    from preprocess.crop.archive_reader import IMAGE_EXTENSIONS
+
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(args.image_dir):
+        dirnames.sort()
+        paths.extend(os.path.join(dirpath, f) for f in sorted(filenames) if f.lower().endswith(IMAGE_EXTENSIONS))
+    if not paths:
+        sys.exit(f"[FAIL] No images under {args.image_dir}")
+    calibrate(args.stage, paths[:args.sample], model_name=args.model)
+
+
+# ---------------------------------------------------------
+# IMPORT-TIME BUDGET
+# ---------------------------------------------------------
+
+def check_import_budget(modules=("cli", "model.hsem", "similarity.utils", "similarity.prototype_eval",
+                                 "pipelines.orchestrator"), budget_ms=500):
+    """
+    Imports each module in a fresh interpreter with -X importtime and checks that
+    no HEAVY_MODULES get loaded and the cumulative import time stays under budget_ms.
+    Returns a list of problems (empty = OK).
+    """
+    problems = []
+    env = dict(os.environ, PYTHONPATH=SRC_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+
+    for module in modules:
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              cwd=SRC_DIR, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            problems.append(f"{module}: import failed\n{proc.stderr.strip().splitlines()[-1]}")
+            continue
+
+        total_us = 0
+        loaded = set()
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            fields = [f.strip() for f in line[len("import time:"):].split("|")]
+            if not fields[1].isdigit():
+                continue                          # header line
+            name = fields[2]
+            loaded.add(name.split(".")[0])
+            if name == module:
+                total_us = int(fields[1])
+
+        heavy = sorted(loaded & set(HEAVY_MODULES))
+        ms = total_us / 1000
+        status = "OK"
+        if heavy:
+            problems.append(f"{module}: imports heavy modules {heavy}")
+            status = "HEAVY"
+        if ms > budget_ms:
+            problems.append(f"{module}: {ms:.0f} ms import time exceeds budget of {budget_ms} ms")
+            status = "SLOW"
+        print(f"  {module:<28} {ms:8.1f} ms  {status}")
+
+    return problems
+
+
+def cmd_selfcheck(args):
+    problems = check_import_budget(budget_ms=args.budget_ms)
+    for p in problems:
+        print(f"[FAIL] {p}")
+    if problems:
+        sys.exit(1)
+    print("[OK] Import-time budget respected")
+
+
+# ---------------------------------------------------------
+# ARGUMENTS
+# ---------------------------------------------------------
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="liramic", description="LiraMic pipeline commands")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("crop", help="detect + crop faces")
+    p.add_argument("source", help="zip archive or directory of original images")
+    p.add_argument("output", help="output root for cropped JPEGs")
+    p.add_argument("--dim", type=int, nargs=2, default=[224, 224], metavar=("W", "H"))
+    p.add_argument("--fast", action="store_true", help="detect on a reduced-resolution decode")
+    p.add_argument("--shard-dir", help="pack crops into a shard instead of JPEG files")
+    p.add_argument("--cache", help="detection cache file (.npz)")
+    p.add_argument("--prefix", default="", help="only archive members under this prefix")
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--dedup-map", help="dedup_map.json from the dedup command; duplicates are skipped")
+    p.set_defaults(func=cmd_crop)
+
+    p = sub.add_parser("dedup", help="group near-duplicate images by perceptual hash")
+    p.add_argument("source", help="zip archive or directory of original images")
+    p.add_argument("out_dir", help="where dedup_map.json and dedup_report.csv are written")
+    p.add_argument("--max-distance", type=int, default=6, help="max Hamming distance between 64-bit hashes")
+    p.add_argument("--prefix", default="")
+    p.add_argument("--workers", type=int, default=8)
+    p.set_defaults(func=cmd_dedup)
+
+    p = sub.add_parser("label", help="label face angles with FaceMesh")
+    p.add_argument("processed_dir", nargs="?")
+    p.add_argument("--shard-dir")
+    p.set_defaults(func=cmd_label)
+
+    p = sub.add_parser("organize", help="copy labelled crops into kdef_by_angle/")
+    p.add_argument("processed_dir")
+    p.set_defaults(func=cmd_organize)
+
+    p = sub.add_parser("embed", help="compute per-angle embedding parquet files")
+    p.add_argument("base_dir", help="kdef_by_angle directory (output directory with --shard-dir)")
+    p.add_argument("--models", nargs="*", help="registered model names (default: MODEL_NAME)")
+    p.add_argument("--flush-every", type=int, default=256)
+    p.add_argument("--shard-dir", help="embed crops from a labelled shard")
+    p.set_defaults(func=cmd_embed)
+
+    p = sub.add_parser("video", help="per-frame embeddings from videos (keyframe detection + tracking)")
+    p.add_argument("source", help="video file or directory of videos")
+    p.add_argument("out_dir")
+    p.add_argument("--models", nargs="*")
+    p.add_argument("--sample-fps", type=float, help="embed this many frames per second (default: all)")
+    p.add_argument("--keyframe-every", type=int, default=15)
+    p.add_argument("--batch-size", type=int, help="default: autotuned for this host")
+    p.set_defaults(func=cmd_video)
+
+    for name, func, help_text in (("similarity", cmd_similarity, "7x7 pairwise matrices from stored embeddings"),
+                                  ("quicklook", cmd_quicklook, "sampled 7x7 matrices with per-cell standard errors"),
+                                  ("cluster", cmd_cluster, "mini-batch k-means + k-NN graph vs. emotion labels"),
+                                  ("heatmap", cmd_heatmap, "render saved matrices to a PDF"),
+                                  ("report", cmd_report, "LOSO prototype accuracy report")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("base_dir")
+        p.add_argument("--angles", nargs="*", default=ANGLES)
+        p.set_defaults(func=func)
+        if name == "heatmap":
+            p.add_argument("--gamma", type=float, default=2.0)
+            p.add_argument("--pdf", help="output PDF path")
+        if name == "quicklook":
+            p.add_argument("--target-se", type=float, default=0.01)
+            p.add_argument("--max-fraction", type=float, default=1.0, help="never embed more than this share per cell")
+            p.add_argument("--seed", type=int, default=0)
+            p.add_argument("--pdf", help="also render the sampled matrices to this PDF")
+        if name == "cluster":
+            p.add_argument("--k", type=int, default=7)
+            p.add_argument("--knn-k", type=int, default=10)
+            p.add_argument("--column", default="embedding")
+            p.add_argument("--seed", type=int, default=0)
+        if name == "report":
+            p.add_argument("--column", default="embedding")
+            p.add_argument("--model", help="per-model embedding column to use")
+
+    p = sub.add_parser("tune", help="calibrate workers x threads x batch size for this host")
+    p.add_argument("stage", choices=["embed", "detect"])
+    p.add_argument("image_dir", help="directory of sample images (searched recursively)")
+    p.add_argument("--model", help="registered model name (embed stage)")
+    p.add_argument("--sample", type=int, default=128, help="number of images to time")
+    p.set_defaults(func=cmd_tune)
+
+    p = sub.add_parser("selfcheck", help="verify lazy imports keep start-up fast")
+    p.add_argument("--budget-ms", type=float, default=500)
+    p.set_defaults(func=cmd_selfcheck)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "label" and not (args.processed_dir or args.shard_dir):
+        build_parser().error("label needs PROCESSED_DIR or --shard-dir")
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""Resumable, bounded-memory Parquet output for long embedding jobs.
+
+CheckpointedParquetWriter buffers at most `flush_every` rows. Every flush writes one part file
+(one row group) into {out_path}.parts/ and atomically rewrites a checkpoint recording how many
+input items are committed. After a crash or preemption a new writer for the same output and the
+same manifest resumes from the last committed part (`writer.done` tells the caller how many
+items to skip). commit() streams the parts, one at a time, into the final file and publishes it
+with an atomic rename, so readers never see a partial {out_path}.
+
+Part files (and the checkpoint that follows each of them) are written by a background thread
+(preprocess/async_writers.BackgroundWriter), in order, while the caller keeps embedding; a write
+error surfaces in the caller on the next flush() or commit().
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from preprocess.async_writers import BackgroundWriter
+
+# schema of the per-angle embedding files written by store_embeddings
+EMBEDDING_SCHEMA = pa.schema([
+    ("subject_id", pa.int64()),
+    ("emotion", pa.string()),
+    ("angle", pa.string()),
+    ("image_path", pa.string()),
+    ("embedding", pa.list_(pa.float64())),
+])
+
+
+def embedding_schema(extra_columns=()):
+    """EMBEDDING_SCHEMA plus additional float32 list columns (e.g. one per model)."""
+    schema = EMBEDDING_SCHEMA
+    for name in extra_columns:
+        schema = schema.append(pa.field(name, pa.list_(pa.float32())))
+    return schema
+
+
+def manifest_hash(items, salt=""):
+    """Fingerprint of the ordered work list; a checkpoint is only reused for the same manifest."""
+    h = hashlib.sha1(salt.encode())
+    for item in items:
+        h.update(str(item).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _write_json_atomic(path, obj):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class CheckpointedParquetWriter:
+    """
+    writer = CheckpointedParquetWriter(out_path, manifest, flush_every=256)
+    for item in manifest[writer.done:]:
+        writer.append(row_or_None)      # one call per manifest item (None = item skipped)
+    writer.commit()
+    """
+
+    def __init__(self, out_path, manifest, flush_every=256, schema=EMBEDDING_SCHEMA):
+        self.out_path = out_path
+        self.parts_dir = out_path + ".parts"
+        self.checkpoint_path = os.path.join(self.parts_dir, "checkpoint.json")
+        self.flush_every = flush_every
+        self.schema = schema
+        # the output schema is part of the fingerprint: different columns never resume each other
+        self.manifest_hash = manifest_hash(manifest, salt=str(schema))
+        self.total = len(manifest)
+
+        self._rows = []
+        self._pending_items = 0
+        self._state = self._load_or_reset()
+        self._done = self._state["done"]
+        self._parts = len(self._state["parts"])
+        self._background = None
+
+    # ---------------------------------------------------------
+    # CHECKPOINT STATE
+    # ---------------------------------------------------------
+
+    def _load_or_reset(self):
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                state = json.load(f)
+            if state.get("manifest_hash") == self.manifest_hash:
+                if state["done"] > 0:
+                    print(f"[INFO] Resuming {self.out_path}: {state['done']}/{self.total} items already committed")
+                return state
+            print(f"[WARN] Input changed since last checkpoint; restarting {self.out_path}")
+
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+        os.makedirs(self.parts_dir, exist_ok=True)
+        state = {"manifest_hash": self.manifest_hash, "done": 0, "rows": 0, "parts": []}
+        _write_json_atomic(self.checkpoint_path, state)
+        return state
+
+    @property
+    def done(self):
+        """Number of manifest items already handed to the writer (skip these when resuming)."""
+        return self._done
+
+    # ---------------------------------------------------------
+    # WRITE
+    # ---------------------------------------------------------
+
+    def append(self, row):
+        """Record the result of the next manifest item; row=None means it produced no output."""
+        if row is not None:
+            self._rows.append(row)
+        self._pending_items += 1
+
+        if self._pending_items >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Hand buffered rows to the background thread as one part file + checkpoint update."""
+        if self._pending_items == 0:
+            return
+
+        table = None
+        part_name = None
+        if self._rows:
+            table = pa.Table.from_pylist(self._rows, schema=self.schema)
+            part_name = f"part-{self._parts:05d}.parquet"
+            self._parts += 1
+
+        if self._background is None:
+            self._background = BackgroundWriter(self._write_part, max_pending=2, name="checkpoint writer")
+        self._background.submit((table, part_name, self._pending_items, len(self._rows)))
+
+        self._done += self._pending_items
+        self._rows = []
+        self._pending_items = 0
+
+    def _write_part(self, item):
+        # background thread: part file first, then the checkpoint that references it
+        table, part_name, n_items, n_rows = item
+        if table is not None:
+            part_path = os.path.join(self.parts_dir, part_name)
+            pq.write_table(table, part_path + ".tmp")
+            os.replace(part_path + ".tmp", part_path)
+            self._state["parts"].append(part_name)
+
+        self._state["done"] += n_items
+        self._state["rows"] += n_rows
+        _write_json_atomic(self.checkpoint_path, self._state)
+
+    def commit(self):
+        """Merge committed parts into out_path (atomic rename) and remove the checkpoint."""
+        self.flush()
+        if self._background is not None:
+            self._background.close()
+            self._background = None
+
+        tmp_path = self.out_path + ".tmp"
+        with pq.ParquetWriter(tmp_path, self.schema) as writer:
+            for part_name in self._state["parts"]:
+                writer.write_table(pq.read_table(os.path.join(self.parts_dir, part_name), schema=self.schema))
+        os.replace(tmp_path, self.out_path)
+
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+        return self._state["rows"]
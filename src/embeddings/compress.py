@@ -0,0 +1,366 @@
+"""Compressed embedding representations stored next to the full-precision column.
+
+Two families of compression:
+    - dimensionality reduction: PCA or Gaussian random projection to a target dimension
+      (column "embedding_pca{dim}" / "embedding_rp{dim}", list of float32)
+    - product quantization (PQ): each embedding becomes M uint8 codes, one per subspace
+      (column "embedding_pq{M}x{K}", list of uint8)
+
+Fitted models are saved as {column}.npz next to the parquet files so any stage can decode them
+(similarity.utils.load_parquet_embeddings(path, column=...) does this automatically). Decoded PQ
+vectors have the full dimension again, so that path saves storage only; similarity computed in the
+compressed domain (fewer FLOPs, no decode) is pq_similarity_matrix / adc_similarity.
+
+compress_all_angles(base_dir, angles) fits one model over all angles (so angles stay comparable),
+rewrites each {angle}_embeddings.parquet with the new column, and prints a similarity-error report.
+"""
+
+import os
+import sys
+import numpy as np
+
+# Make src importable
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from similarity.kmeans import kmeans, assign
+
+
+# ---------------------------------------------------------
+# DIMENSIONALITY REDUCTION: PCA + RANDOM PROJECTION
+# ---------------------------------------------------------
+
+def fit_pca(E, dim):
+    """
+    E: (N, D) embeddings
+    Returns model dict with mean (D,) and components (D, dim).
+
+    The data is not centered: the projection E @ components must preserve the angles between the
+    original vectors (cosine is what downstream code compares), and subtracting the large shared
+    mean of non-negative features would change them. mean is kept (all zeros) so project() and
+    saved models share one format.
+    """
+    E = np.asarray(E, dtype=np.float64)
+    dim = min(dim, E.shape[0], E.shape[1])
+
+    # economy SVD of the raw data; rows of Vt are the axes of largest second moment
+    _, S, Vt = np.linalg.svd(E, full_matrices=False)
+    explained = (S ** 2) / max((S ** 2).sum(), 1e-12)
+
+    return {
+        "kind": np.array("pca"),
+        "mean": np.zeros(E.shape[1], dtype=np.float32),
+        "components": Vt[:dim].T.astype(np.float32),
+        "explained_variance_ratio": explained[:dim].astype(np.float32),
+    }
+
+
+def fit_random_projection(input_dim, dim, seed=0):
+    """
+    Gaussian random projection (Johnson-Lindenstrauss); needs no training data.
+    """
+    rng = np.random.default_rng(seed)
+    R = rng.standard_normal((input_dim, dim)) / np.sqrt(dim)
+    return {
+        "kind": np.array("rp"),
+        "mean": np.zeros(input_dim, dtype=np.float32),
+        "components": R.astype(np.float32),
+    }
+
+
+def project(model, E):
+    """
+    Applies a PCA / random-projection model. Returns (N, dim) float32.
+    """
+    E = np.asarray(E, dtype=np.float32)
+    return (E - model["mean"]) @ model["components"]
+
+
+# ---------------------------------------------------------
+# PRODUCT QUANTIZATION
+# ---------------------------------------------------------
+
+def fit_pq(E, n_subspaces=32, n_centroids=256, n_iter=20, seed=0):
+    """
+    Trains one k-means codebook per contiguous subspace.
+    E should already be normalized (cosine similarity is what downstream code uses).
+
+    Returns model dict with codebooks (M, K, D/M).
+    """
+    E = np.asarray(E, dtype=np.float32)
+    D = E.shape[1]
+    if D % n_subspaces != 0:
+        raise ValueError(f"Embedding dim {D} is not divisible by n_subspaces={n_subspaces}")
+    if n_centroids > 256:
+        raise ValueError("n_centroids must be <= 256 so codes fit in uint8")
+
+    d_sub = D // n_subspaces
+    k = min(n_centroids, E.shape[0])
+    codebooks = np.zeros((n_subspaces, n_centroids, d_sub), dtype=np.float32)
+
+    for j in range(n_subspaces):
+        C, _ = kmeans(E[:, j * d_sub:(j + 1) * d_sub], k, n_iter=n_iter, seed=seed + j)
+        codebooks[j, :k] = C
+
+    return {"kind": np.array("pq"), "codebooks": codebooks, "n_used": np.array(k)}
+
+
+def pq_encode(model, E):
+    """
+    Returns (N, M) uint8 codes.
+    """
+    E = np.asarray(E, dtype=np.float32)
+    codebooks = model["codebooks"][:, :int(model["n_used"])]
+    M, _, d_sub = codebooks.shape
+
+    codes = np.empty((E.shape[0], M), dtype=np.uint8)
+    for j in range(M):
+        codes[:, j], _ = assign(E[:, j * d_sub:(j + 1) * d_sub], codebooks[j])
+    return codes
+
+
+def pq_decode(model, codes):
+    """
+    Reconstructs (N, D) float32 vectors from (N, M) codes.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    codebooks = model["codebooks"]
+    M = codebooks.shape[0]
+    # codebooks[j, codes[:, j]] for all j at once -> (N, M, d_sub)
+    parts = codebooks[np.arange(M)[None, :], codes]
+    return parts.reshape(codes.shape[0], -1)
+
+
+def pq_code_norms(model, codes):
+    """
+    ||decoded||: subspaces are disjoint, so squared norms add up per code.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    sub_sq = np.einsum("mkd,mkd->mk", model["codebooks"], model["codebooks"])   # (M, K)
+    M = sub_sq.shape[0]
+    return np.sqrt(sub_sq[np.arange(M)[None, :], codes].sum(axis=1))
+
+
+def adc_similarity(model, Q, codes, code_norms=None):
+    """
+    Asymmetric distance computation: exact (uncompressed) queries against PQ codes.
+
+    Q: (nQ, D) queries, codes: (N, M)
+    Returns (nQ, N) cosine similarities between normalized queries and the decoded database vectors.
+    Cost is one (nQ, M, K) lookup table plus M gathers, instead of a (nQ, D) x (D, N) matmul.
+    """
+    Q = np.asarray(Q, dtype=np.float32)
+    Q = Q / np.maximum(np.linalg.norm(Q, axis=1, keepdims=True), 1e-8)
+    codebooks = model["codebooks"]
+    M, _, d_sub = codebooks.shape
+
+    # lut[q, j, k] = <q_j, codebook_j[k]>
+    lut = np.einsum("qmd,mkd->qmk", Q.reshape(Q.shape[0], M, d_sub), codebooks)
+
+    codes = np.asarray(codes, dtype=np.int64)
+    sims = np.zeros((Q.shape[0], codes.shape[0]), dtype=np.float32)
+    for j in range(M):
+        sims += lut[:, j, codes[:, j]]
+
+    if code_norms is None:
+        code_norms = pq_code_norms(model, codes)
+    return sims / np.maximum(code_norms[None, :], 1e-8)
+
+
+def pq_similarity_matrix(model, codes):
+    """
+    NxN cosine similarity computed directly in the compressed domain (symmetric distance):
+    every pairwise inner product is a sum of M lookups into per-subspace codebook Gram tables.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    codebooks = model["codebooks"]
+    M = codebooks.shape[0]
+    gram = np.einsum("mkd,mld->mkl", codebooks, codebooks)   # (M, K, K)
+
+    sims = np.zeros((codes.shape[0], codes.shape[0]), dtype=np.float32)
+    for j in range(M):
+        sims += gram[j][codes[:, j][:, None], codes[:, j][None, :]]
+
+    norms = np.sqrt(np.maximum(np.diag(sims), 1e-16))
+    return sims / norms[:, None] / norms[None, :]
+
+
+# ---------------------------------------------------------
+# MODEL PERSISTENCE + COLUMN NAMING
+# ---------------------------------------------------------
+
+def column_name(method, dim=None, n_subspaces=None, n_centroids=256):
+    if method == "pq":
+        return f"embedding_pq{n_subspaces}x{n_centroids}"
+    return f"embedding_{method}{dim}"
+
+
+def model_path_for(parquet_path, column):
+    return os.path.join(os.path.dirname(os.path.abspath(parquet_path)), f"{column}.npz")
+
+
+def save_compression_model(model, path):
+    np.savez(path, **model)
+
+
+def load_compression_model(path):
+    with np.load(path) as data:
+        return {k: data[k] for k in data.files}
+
+
+def column_decoder(parquet_path, column):
+    """
+    Returns a function mapping one stored cell to a float vector, or None if the column
+    already holds float vectors (PCA / random projection).
+    """
+    if not column.startswith("embedding_pq"):
+        return None
+
+    model = load_compression_model(model_path_for(parquet_path, column))
+
+    def decode(cell):
+        return pq_decode(model, np.asarray(cell)[None, :])[0]
+
+    return decode
+
+
+# ---------------------------------------------------------
+# ERROR REPORT VS FULL PRECISION
+# ---------------------------------------------------------
+
+def _cosine(E):
+    E = np.asarray(E, dtype=np.float32)
+    E = E / np.maximum(np.linalg.norm(E, axis=1, keepdims=True), 1e-8)
+    return E @ E.T
+
+
+def similarity_error_report(E_full, sim_approx, emotions=None):
+    """
+    Compares an approximate NxN cosine matrix with the full-precision one.
+
+    Returns dict with max/mean absolute error over pairs and, when emotions are given,
+    the max absolute error of the collapsed emotion x emotion matrix.
+    """
+    from similarity.utils import collapse_emotion_matrix
+
+    sim_full = _cosine(E_full)
+    err = np.abs(sim_full - sim_approx)
+    report = {
+        "pair_max_abs_err": float(err.max()),
+        "pair_mean_abs_err": float(err.mean()),
+    }
+
+    if emotions is not None:
+        m_full, _ = collapse_emotion_matrix(sim_full, emotions)
+        m_approx, _ = collapse_emotion_matrix(sim_approx, emotions)
+        report["emotion_matrix_max_abs_err"] = float(np.abs(m_full - m_approx).max())
+
+    return report
+
+
+# ---------------------------------------------------------
+# COMPRESS THE EMBEDDING STORE
+# ---------------------------------------------------------
+
+def _valid_rows(df):
+    from similarity.utils import clean_embedding
+
+    vectors, index = [], []
+    for i, vec in enumerate(df["embedding"]):
+        emb = clean_embedding(vec)
+        if emb is not None:
+            vectors.append(emb)
+            index.append(i)
+    return np.vstack(vectors), np.array(index, dtype=np.int64)
+
+
+def _stored_bytes(list_type, dim):
+    """Bytes per vector of a list<numeric> parquet column of length dim."""
+    return dim * list_type.value_type.bit_width // 8
+
+
+def compress_all_angles(base_dir, angles, method="pca", dim=128, n_subspaces=32, n_centroids=256, seed=0):
+    """
+    Fits one compression model over every {angle}_embeddings.parquet under base_dir,
+    adds the compressed column to each file (rewritten atomically) and saves the model
+    as {column}.npz in base_dir.
+
+    method: "pca" | "rp" | "pq"
+    The column is stored as list<uint8> (PQ codes) or list<float32> (PCA / RP), and the reported
+    ratio compares the stored value types, not the in-memory arrays.
+    Returns: (column name, {angle: error report})
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from similarity.utils import normalize_embeddings
+
+    paths = {a: os.path.join(base_dir, f"{a}_embeddings.parquet") for a in angles}
+    tables, frames, valid = {}, {}, {}
+    for angle, path in paths.items():
+        tables[angle] = pq.read_table(path)
+        frames[angle] = tables[angle].select(["emotion", "embedding"]).to_pandas()
+        valid[angle] = _valid_rows(frames[angle])
+
+    E_all = np.vstack([E for E, _ in valid.values()])
+
+    if method == "pca":
+        model = fit_pca(E_all, dim)
+    elif method == "rp":
+        model = fit_random_projection(E_all.shape[1], dim, seed=seed)
+    elif method == "pq":
+        model = fit_pq(normalize_embeddings(E_all), n_subspaces, n_centroids, seed=seed)
+    else:
+        raise ValueError(f"Unknown compression method: {method}")
+
+    column = column_name(method, dim, n_subspaces, n_centroids)
+    cell_type = pa.list_(pa.uint8()) if method == "pq" else pa.list_(pa.float32())
+    save_compression_model(model, os.path.join(base_dir, f"{column}.npz"))
+    print(f"[INFO] Saved {column} model to {base_dir}")
+
+    reports = {}
+    for angle, df in frames.items():
+        E, index = valid[angle]
+
+        if method == "pq":
+            compressed = pq_encode(model, normalize_embeddings(E))
+            sim_approx = pq_similarity_matrix(model, compressed)
+        else:
+            compressed = project(model, E)
+            sim_approx = _cosine(compressed)
+
+        cells = [None] * len(df)
+        for i, row in zip(index, compressed):
+            cells[i] = row.tolist()
+
+        table = tables[angle]
+        if column in table.column_names:
+            table = table.drop([column])
+        table = table.append_column(pa.field(column, cell_type), pa.array(cells, type=cell_type))
+
+        tmp_path = paths[angle] + ".tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, paths[angle])
+
+        emotions = df["emotion"].to_numpy()[index].tolist()
+        report = similarity_error_report(E, sim_approx, emotions)
+        report["bytes_full"] = _stored_bytes(table.schema.field("embedding").type, E.shape[1])
+        report["bytes_compressed"] = _stored_bytes(cell_type, compressed.shape[1])
+        report["ratio"] = report["bytes_full"] / report["bytes_compressed"]
+        reports[angle] = report
+
+        print(f"[INFO] {angle:>5}: {column} | {report['ratio']:.0f}x smaller | "
+              f"pair err max {report['pair_max_abs_err']:.4f} mean {report['pair_mean_abs_err']:.4f} | "
+              f"7x7 err max {report['emotion_matrix_max_abs_err']:.4f}")
+
+    return column, reports
+
+
+# ---------------------------------------------------------
+# MAIN
+# ---------------------------------------------------------
+
+if __name__ == "__main__":
+    BASE_DIR = "/Users/bencarmel/Documents/TAU/LiraMic/src/dataset/kdef_by_angle"
+    ANGLES = ["front", "left", "right"]
+
+    compress_all_angles(BASE_DIR, ANGLES, method="pca", dim=128)
+    compress_all_angles(BASE_DIR, ANGLES, method="pq", n_subspaces=32)
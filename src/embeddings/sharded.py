@@ -0,0 +1,303 @@
+"""Sharded embedding runs: N independent workers, deterministic partitioning, validated merge.
+
+Every image under kdef_by_angle/{angle}/{emotion}/ belongs to exactly one of N shards, chosen by a stable
+hash of its path relative to base_dir, so any process or node sharing the filesystem can compute its own
+work list without coordination:
+
+    python sharded.py worker --base BASE --out OUT --shard 3 --num-shards 8     # one per process / node
+    python sharded.py status --out OUT --num-shards 8                          # progress + stragglers
+    python sharded.py launch --base BASE --out OUT --num-shards 8 [--shards 3 5] # local multi-process run
+    python sharded.py merge  --base BASE --out OUT --num-shards 8              # -> {angle}_embeddings.parquet
+
+Workers write OUT/shard-{i}-of-{N}.parquet through the checkpointed writer (so a re-run resumes) and keep
+OUT/shard-{i}-of-{N}.status.json up to date as a heartbeat. merge refuses to run until every shard is done,
+checks the union against the manifest, drops duplicate image paths and writes the per-angle files atomically:
+if any manifest image is missing, none of the previous per-angle files is replaced.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+# Make src importable
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ANGLES = ["front", "left", "right"]
+
+
+# ---------------------------------------------------------
+# MANIFEST + PARTITIONING
+# ---------------------------------------------------------
+
+def build_manifest(base_dir, angles=ANGLES):
+    """
+    All images of all angles: [(angle, emotion, fname, img_path), ...] in a deterministic order.
+    """
+    from embeddings.store_embeddings import list_angle_images
+
+    manifest = []
+    for angle in angles:
+        angle_dir = os.path.join(base_dir, angle)
+        if not os.path.isdir(angle_dir):
+            print(f"[WARN] Angle folder missing: {angle_dir}")
+            continue
+        manifest.extend((angle, emotion, fname, path) for emotion, fname, path in list_angle_images(angle_dir))
+    return manifest
+
+
+def relative_key(base_dir, img_path):
+    """Path relative to the dataset root, '/'-separated: identifies an image across mounts and hosts."""
+    return os.path.relpath(img_path, base_dir).replace(os.sep, "/")
+
+
+def shard_of(base_dir, img_path, num_shards):
+    """Stable shard index from the path relative to base_dir (independent of mount point and host)."""
+    return int(hashlib.sha1(relative_key(base_dir, img_path).encode()).hexdigest()[:8], 16) % num_shards
+
+
+def shard_items(base_dir, shard_index, num_shards, angles=ANGLES):
+    return [item for item in build_manifest(base_dir, angles)
+            if shard_of(base_dir, item[3], num_shards) == shard_index]
+
+
+def _shard_name(shard_index, num_shards):
+    return f"shard-{shard_index:03d}-of-{num_shards:03d}"
+
+
+def shard_paths(out_dir, shard_index, num_shards):
+    stem = os.path.join(out_dir, _shard_name(shard_index, num_shards))
+    return stem + ".parquet", stem + ".status.json"
+
+
+def _write_status(path, **status):
+    status["updated"] = time.time()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(status, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+# ---------------------------------------------------------
+# WORKER
+# ---------------------------------------------------------
+
+def run_worker(base_dir, out_dir, shard_index, num_shards, flush_every=64, angles=ANGLES):
+    """
+    Embeds this worker's partition into OUT/shard-i-of-N.parquet (resumable) and reports progress.
+    """
+    from embeddings.checkpoint import CheckpointedParquetWriter
+    from embeddings.store_embeddings import embed_row
+
+    os.makedirs(out_dir, exist_ok=True)
+    parquet_path, status_path = shard_paths(out_dir, shard_index, num_shards)
+    items = shard_items(base_dir, shard_index, num_shards, angles)
+
+    writer = CheckpointedParquetWriter(parquet_path, items, flush_every=flush_every)
+    info = {"shard": shard_index, "num_shards": num_shards, "host": socket.gethostname(),
+            "pid": os.getpid(), "total": len(items), "base_dir": os.path.abspath(base_dir)}
+    _write_status(status_path, state="running", done=writer.done, **info)
+
+    print(f"[INFO] Shard {shard_index}/{num_shards}: {len(items)} images ({writer.done} already done)")
+
+    done = writer.done
+    for angle, emotion, fname, img_path in items[writer.done:]:
+        writer.append(embed_row(emotion, fname, img_path, angle))
+        done += 1
+        if done % flush_every == 0:
+            _write_status(status_path, state="running", done=done, **info)
+
+    rows = writer.commit()
+    _write_status(status_path, state="done", done=len(items), rows=rows, **info)
+    print(f"[INFO] Shard {shard_index}/{num_shards} finished: {rows} rows -> {parquet_path}")
+    return rows
+
+
+# ---------------------------------------------------------
+# STATUS + STRAGGLERS
+# ---------------------------------------------------------
+
+def shard_status(out_dir, num_shards):
+    """{shard_index: status dict or None if the worker never started}"""
+    statuses = {}
+    for i in range(num_shards):
+        _, status_path = shard_paths(out_dir, i, num_shards)
+        if os.path.exists(status_path):
+            with open(status_path) as f:
+                statuses[i] = json.load(f)
+        else:
+            statuses[i] = None
+    return statuses
+
+
+def find_stragglers(out_dir, num_shards, stale_after=600):
+    """
+    Shards that need (re-)running: never started, or running without a heartbeat for stale_after seconds.
+    """
+    now = time.time()
+    stragglers = []
+    for i, status in shard_status(out_dir, num_shards).items():
+        if status is None:
+            stragglers.append(i)
+        elif status["state"] != "done" and now - status["updated"] > stale_after:
+            stragglers.append(i)
+    return stragglers
+
+
+def print_status(out_dir, num_shards, stale_after=600):
+    stragglers = set(find_stragglers(out_dir, num_shards, stale_after))
+    for i, status in shard_status(out_dir, num_shards).items():
+        if status is None:
+            print(f"  shard {i:>3}: not started")
+            continue
+        age = time.time() - status["updated"]
+        flag = "  <-- straggler" if i in stragglers else ""
+        print(f"  shard {i:>3}: {status['state']:>7} {status['done']}/{status['total']} "
+              f"on {status['host']} (pid {status['pid']}), last update {age:.0f}s ago{flag}")
+    return sorted(stragglers)
+
+
+# ---------------------------------------------------------
+# MERGE / COMPACTION
+# ---------------------------------------------------------
+
+def merge_shards(base_dir, out_dir, num_shards, angles=ANGLES):
+    """
+    Validates that every shard finished and every manifest image is present, removes duplicate
+    image paths (e.g. a shard that was re-run on two nodes) and writes {angle}_embeddings.parquet.
+    Returns {angle: row count}.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    from embeddings.checkpoint import EMBEDDING_SCHEMA
+
+    statuses = shard_status(out_dir, num_shards)
+    unfinished = [i for i, s in statuses.items() if s is None or s["state"] != "done"]
+    if unfinished:
+        raise RuntimeError(f"Shards not finished: {unfinished}")
+
+    # images are compared by their path relative to the dataset root (what shard_of hashes), so a
+    # root that moved or is mounted elsewhere than where the workers ran still validates
+    manifest = build_manifest(base_dir, angles)
+    expected = {relative_key(base_dir, item[3]) for item in manifest}
+    present = {item[0] for item in manifest}
+    shard_files = [shard_paths(out_dir, i, num_shards)[0] for i in range(num_shards)]
+    worker_roots = [statuses[i].get("base_dir", base_dir) for i in range(num_shards)]
+
+    # one streaming pass per angle, one shard at a time; nothing is published until all angles validate
+    seen = set()
+    counts = {}
+    outputs = {}        # angle -> (out_path, tmp_path)
+    duplicates = 0
+    try:
+        for angle in [a for a in angles if a in present]:
+            out_path = os.path.join(base_dir, f"{angle}_embeddings.parquet")
+            outputs[angle] = (out_path, out_path + ".tmp")
+            n = 0
+            with pq.ParquetWriter(outputs[angle][1], EMBEDDING_SCHEMA) as writer:
+                for path, root in zip(shard_files, worker_roots):
+                    table = pq.read_table(path, schema=EMBEDDING_SCHEMA)
+                    table = table.filter(pc.equal(table["angle"], angle))
+
+                    keep = []
+                    for p in table["image_path"].to_pylist():
+                        key = relative_key(root, p)
+                        keep.append(key not in seen)
+                        if key in seen:
+                            duplicates += 1
+                        seen.add(key)
+                    table = table.filter(pa.array(keep, type=pa.bool_()))
+
+                    writer.write_table(table)
+                    n += table.num_rows
+            counts[angle] = n
+
+        missing = expected - seen
+        if missing:
+            raise RuntimeError(f"{len(missing)} manifest images missing from the shards, e.g. {sorted(missing)[:5]}")
+    except BaseException:
+        # keep the previous per-angle files untouched
+        for _, tmp_path in outputs.values():
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        raise
+
+    for angle, (out_path, tmp_path) in outputs.items():
+        os.replace(tmp_path, out_path)
+        print(f"[INFO] Merged {out_path} with {counts[angle]} samples")
+
+    unexpected = seen - expected
+    if duplicates:
+        print(f"[INFO] Removed {duplicates} duplicate rows")
+    if unexpected:
+        print(f"[WARN] {len(unexpected)} rows are not in the current manifest")
+
+    return counts
+
+
+# ---------------------------------------------------------
+# LOCAL MULTI-PROCESS LAUNCH
+# ---------------------------------------------------------
+
+def launch_local(base_dir, out_dir, num_shards, shards=None, flush_every=64):
+    """
+    Starts one worker process per shard (all shards by default, or only `shards`, e.g. stragglers)
+    and waits for them. Returns {shard_index: exit code}.
+    """
+    shards = list(range(num_shards)) if shards is None else list(shards)
+    procs = {}
+    for i in shards:
+        cmd = [sys.executable, os.path.abspath(__file__), "worker",
+               "--base", base_dir, "--out", out_dir,
+               "--shard", str(i), "--num-shards", str(num_shards),
+               "--flush-every", str(flush_every)]
+        procs[i] = subprocess.Popen(cmd)
+
+    codes = {i: p.wait() for i, p in procs.items()}
+    failed = [i for i, c in codes.items() if c != 0]
+    if failed:
+        print(f"[WARN] Workers failed for shards {failed}; re-run them with --shards")
+    return codes
+
+
+# ---------------------------------------------------------
+# MAIN
+# ---------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded embedding runs")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    for name in ("worker", "launch", "merge", "status"):
+        p = sub.add_parser(name)
+        p.add_argument("--out", required=True, help="directory for shard outputs")
+        p.add_argument("--num-shards", type=int, required=True)
+        if name != "status":
+            p.add_argument("--base", required=True, help="kdef_by_angle directory")
+        if name in ("worker", "launch"):
+            p.add_argument("--flush-every", type=int, default=64)
+        if name == "worker":
+            p.add_argument("--shard", type=int, required=True)
+        if name == "launch":
+            p.add_argument("--shards", type=int, nargs="*", help="only these shards (default: all)")
+        if name == "status":
+            p.add_argument("--stale-after", type=float, default=600)
+
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        run_worker(args.base, args.out, args.shard, args.num_shards, flush_every=args.flush_every)
+    elif args.command == "launch":
+        codes = launch_local(args.base, args.out, args.num_shards, args.shards, flush_every=args.flush_every)
+        sys.exit(1 if any(codes.values()) else 0)
+    elif args.command == "merge":
+        merge_shards(args.base, args.out, args.num_shards)
+    elif args.command == "status":
+        stragglers = print_status(args.out, args.num_shards, args.stale_after)
+        if stragglers:
+            print(f"[INFO] Re-run with: launch --shards {' '.join(map(str, stragglers))}")
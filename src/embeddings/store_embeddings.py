@@ -1,14 +1,69 @@
 """Compute and save face embeddings per angle.
 
-build_angle_dataframe(angle_dir, label) returns a DataFrame with subject_id, emotion, angle, image_path, embedding. build_all_angle_embeddings(base_dir) generates parquet files for front/left/right and returns DataFrames. Requires model.hsem.get_embedding.
+build_angle_dataframe(angle_dir, label) returns a DataFrame with subject_id, emotion, angle, image_path, embedding. build_all_angle_embeddings(base_dir) generates parquet files for front/left/right (checkpointed every K images, resumable after interruption) and returns DataFrames. build_shard_angle_embeddings(shard_dir, out_dir) does the same from a packed crop shard labelled by detect_angle.label_angles_in_shard. Requires model.hsem.get_embedding.
 """
 
 import os
 import pandas as pd
 import numpy as np
-from model.hsem import get_embedding
+import cv2
+from model.hsem import (MODEL_NAME, get_embedding, get_embedding_from_array, get_embeddings_batch, embedding_column,
+                        model_dim)
+from preprocess.shards import open_shard
+from embeddings.checkpoint import CheckpointedParquetWriter, embedding_schema, EMBEDDING_SCHEMA
+from preprocess.async_writers import AsyncParquetWriter
+from model.autotune import tuned_batch_size
 from tqdm import tqdm
 
+# angle_label values written by preprocess/label/detect_angle.py
+ANGLE_NAMES = {0: "front", 1: "right", 2: "left"}
+
+# ------------------------------
+# LIST + EMBED IMAGES OF ONE ANGLE
+# ------------------------------
+
+def list_angle_images(angle_dir):
+    """
+    Deterministic work list for one angle: [(emotion, fname, img_path), ...]
+    """
+    items = []
+    for emotion in sorted(os.listdir(angle_dir)):
+        emotion_dir = os.path.join(angle_dir, emotion)
+        if not os.path.isdir(emotion_dir):
+            continue
+
+        for fname in sorted(os.listdir(emotion_dir)):
+            if not fname.lower().endswith((".jpg", ".jpeg", ".png")):
+                continue
+            items.append((emotion, fname, os.path.join(emotion_dir, fname)))
+    return items
+
+
+def _subject_id(fname):
+    # subject ID = the prefix before underscore
+    try:
+        return int(fname.split("_")[0])
+    except:
+        return None
+
+
+def embed_row(emotion, fname, img_path, angle_label):
+    """
+    Embeds one image and returns its row dict.
+    """
+    subject_id = _subject_id(fname)
+
+    emb = np.array(get_embedding(img_path)).squeeze()
+
+    return {
+        "subject_id": subject_id,
+        "emotion": emotion,
+        "angle": angle_label,
+        "image_path": img_path,
+        "embedding": emb.tolist()        # <-- CRITICAL FIX
+    }
+
+
 # ------------------------------
 # BUILD DATAFRAME FOR ONE ANGLE
 # ------------------------------
@@ -20,42 +75,108 @@ def build_angle_dataframe(angle_dir, angle_label):
     """
     rows = []
 
-    for emotion in sorted(os.listdir(angle_dir)):
-        emotion_dir = os.path.join(angle_dir, emotion)
-        if not os.path.isdir(emotion_dir):
-            continue
+    for emotion, fname, img_path in tqdm(list_angle_images(angle_dir), desc=f"Processing {angle_label}"):
+        rows.append(embed_row(emotion, fname, img_path, angle_label))
 
-        for fname in tqdm(sorted(os.listdir(emotion_dir)), desc=f"Processing {angle_label}/{emotion}"):
+    return pd.DataFrame(rows)
 
-            if not fname.lower().endswith((".jpg", ".jpeg", ".png")):
-                continue
 
-            img_path = os.path.join(emotion_dir, fname)
+# ------------------------------
+# RESUMABLE PARQUET FOR ONE ANGLE
+# ------------------------------
 
-            # subject ID = the prefix before underscore
-            try:
-                subject_id = int(fname.split("_")[0])
-            except:
-                subject_id = None
+def build_angle_parquet(angle_dir, angle_label, out_path, flush_every=256, batch_size=None):
+    """
+    Same output as build_angle_dataframe(...).to_parquet(out_path), but rows are flushed as
+    Parquet row groups every `flush_every` images with a progress checkpoint, so memory stays
+    constant and an interrupted run resumes from the last committed row group.
+    Images are embedded `batch_size` at a time in one forward pass (None = the autotuned batch
+    size of MODEL_NAME on this host, see model/autotune.py).
 
-            emb = np.array(get_embedding(img_path)).squeeze()
+    Returns the number of rows written.
+    """
+    batch_size = batch_size or tuned_batch_size("embed", MODEL_NAME)
+    items = list_angle_images(angle_dir)
+    writer = CheckpointedParquetWriter(out_path, items, flush_every=flush_every)
 
-            rows.append({
-                "subject_id": subject_id,
+    todo = items[writer.done:]
+    with tqdm(desc=f"Processing {angle_label}", initial=writer.done, total=len(items)) as progress:
+        for start in range(0, len(todo), batch_size):
+            batch = todo[start:start + batch_size]
+            images = []
+            for _, _, img_path in batch:
+                image = cv2.imread(img_path)
+                if image is None:
+                    raise ValueError(f"Cannot read: {img_path}")
+                images.append(image)
+
+            feats = get_embeddings_batch(images, [MODEL_NAME])[MODEL_NAME]
+            for (emotion, fname, img_path), emb in zip(batch, feats):
+                writer.append({
+                    "subject_id": _subject_id(fname),
+                    "emotion": emotion,
+                    "angle": angle_label,
+                    "image_path": img_path,
+                    "embedding": emb.astype(np.float64).tolist()
+                })
+            progress.update(len(batch))
+
+    return writer.commit()
+
+
+# ------------------------------
+# SEVERAL MODELS, ONE DECODE PASS
+# ------------------------------
+
+def build_angle_parquet_multi(angle_dir, angle_label, out_path, models, flush_every=256, batch_size=None):
+    """
+    Like build_angle_parquet, but every decoded batch goes through all `models`.
+    batch_size=None uses the autotuned batch size of the first model (model/autotune.py).
+    Each model gets its own column embedding__{model}__{dim} (see model.hsem.embedding_column);
+    the plain "embedding" column holds the first model's output so existing readers keep working.
+
+    Returns the number of rows written.
+    """
+    batch_size = batch_size or tuned_batch_size("embed", models[0])
+    columns = {name: embedding_column(name, model_dim(name)) for name in models}
+    items = list_angle_images(angle_dir)
+    writer = CheckpointedParquetWriter(out_path, items, flush_every=flush_every,
+                                       schema=embedding_schema(columns.values()))
+
+    todo = items[writer.done:]
+    for start in tqdm(range(0, len(todo), batch_size), desc=f"Processing {angle_label} x {len(models)} models"):
+        batch = todo[start:start + batch_size]
+        images = [cv2.imread(img_path) for _, _, img_path in batch]
+
+        ok = [i for i, img in enumerate(images) if img is not None]
+        feats = get_embeddings_batch([images[i] for i in ok], models) if ok else {}
+        pos = {i: k for k, i in enumerate(ok)}
+
+        for i, (emotion, fname, img_path) in enumerate(batch):
+            if i not in pos:
+                print(f"[WARN] Cannot read: {img_path}")
+                writer.append(None)
+                continue
+
+            row = {
+                "subject_id": _subject_id(fname),
                 "emotion": emotion,
                 "angle": angle_label,
                 "image_path": img_path,
-                "embedding": emb.tolist()        # <-- CRITICAL FIX
-            })
+                "embedding": feats[models[0]][pos[i]].astype(np.float64).tolist(),
+            }
+            for name, column in columns.items():
+                row[column] = feats[name][pos[i]].tolist()
+            writer.append(row)
 
-    return pd.DataFrame(rows)
+    return writer.commit()
 
 
 # ------------------------------
 # BUILD ALL ANGLE DATAFRAMES
 # ------------------------------
 
-def build_all_angle_embeddings(base_dir):
+def build_all_angle_embeddings(base_dir, flush_every=256, return_frames=True, models=None):
     """
     Expected folder structure:
 
@@ -68,6 +189,11 @@ def build_all_angle_embeddings(base_dir):
         front_embeddings.parquet
         left_embeddings.parquet
         right_embeddings.parquet
+
+    Each file is built with build_angle_parquet (checkpointed + resumable). With
+    return_frames=False nothing is loaded back into memory and {angle: row count} is returned.
+    models: list of registered model names to embed with in one decode pass
+    (build_angle_parquet_multi); default is the single MODEL_NAME model.
     """
 
     angles = ["front", "left", "right"]
@@ -81,12 +207,58 @@ def build_all_angle_embeddings(base_dir):
 
         print(f"[INFO] Processing angle: {angle}")
 
-        df = build_angle_dataframe(angle_dir, angle)
-        embeddings_by_angle[angle] = df
-
         out_path = os.path.join(base_dir, f"{angle}_embeddings.parquet")
-        df.to_parquet(out_path)
-        print(f"[INFO] Saved {out_path} with {len(df)} samples")
+        if models:
+            n_rows = build_angle_parquet_multi(angle_dir, angle, out_path, models, flush_every=flush_every)
+        else:
+            n_rows = build_angle_parquet(angle_dir, angle, out_path, flush_every=flush_every)
+        print(f"[INFO] Saved {out_path} with {n_rows} samples")
+
+        embeddings_by_angle[angle] = pd.read_parquet(out_path) if return_frames else n_rows
+
+    return embeddings_by_angle
+
+
+# ------------------------------
+# BUILD FROM A PACKED CROP SHARD
+# ------------------------------
+
+def build_shard_angle_embeddings(shard_dir, out_dir):
+    """
+    Reads crops zero-copy from a shard (see preprocess/shards.py) whose metadata has an
+    angle_label column, embeds them and saves {angle}_embeddings.parquet into out_dir.
+    image_path is the original source path of each crop.
+    """
+    images, meta = open_shard(shard_dir)
+    if "angle_label" not in meta.columns:
+        raise ValueError(f"Shard has no angle labels yet: {shard_dir}")
+
+    os.makedirs(out_dir, exist_ok=True)
+    embeddings_by_angle = {}
+
+    for label, angle in ANGLE_NAMES.items():
+        idx = np.flatnonzero((meta["angle_label"] == label).fillna(False).to_numpy())
+        print(f"[INFO] Processing angle: {angle} ({len(idx)} crops)")
+
+        # row groups are written in the background while the next crops are embedded
+        out_path = os.path.join(out_dir, f"{angle}_embeddings.parquet")
+        rows = []
+        with AsyncParquetWriter(out_path, EMBEDDING_SCHEMA) as writer:
+            for i in tqdm(idx, desc=f"Processing {angle}"):
+                emb = np.array(get_embedding_from_array(images[i])).squeeze()
+                subject_id = meta["subject_id"].iat[i]
+                rows.append({
+                    "subject_id": None if pd.isna(subject_id) else int(subject_id),
+                    "emotion": meta["emotion"].iat[i],
+                    "angle": angle,
+                    "image_path": meta["source_path"].iat[i],
+                    "embedding": emb.tolist()
+                })
+                writer.append(rows[-1])
+
+        embeddings_by_angle[angle] = pd.DataFrame(rows, columns=["subject_id", "emotion", "angle", "image_path",
+                                                                 "embedding"])
+        print(f"[INFO] Saved {out_path} with {len(rows)} samples")
 
     return embeddings_by_angle
 
@@ -97,4 +269,4 @@ def build_all_angle_embeddings(base_dir):
 
 if __name__ == "__main__":
     BASE_DIR = "/Users/bencarmel/Documents/TAU/LiraMic/src/dataset/kdef_by_angle"
-    build_all_angle_embeddings(BASE_DIR)
+    build_all_angle_embeddings(BASE_DIR, return_frames=False)
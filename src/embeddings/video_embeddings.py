@@ -0,0 +1,278 @@
+"""Per-frame emotion embeddings from recorded video sessions.
+
+Frames are decoded as a stream (cv2.VideoCapture, one frame in memory at a time). MTCNN only runs on
+keyframes (every `keyframe_every` sampled frames) or when tracking is lost; in between the face box is
+followed by normalized template matching in a small search window on a downscaled grayscale frame,
+which costs well under a millisecond per frame. Tracked crops are embedded in batches through
+model.hsem.get_embeddings_batch, and one row per frame with a face is written to
+{video}_embeddings.parquet:
+
+    video_path, frame_index, timestamp_s, box, detected, track_score, embedding [, embedding__{model}__{dim} ...]
+
+Frames that are not sampled (sample_fps) are skipped with grab(), without being decoded.
+"""
+
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+import pyarrow as pa
+
+# Make src/ and the crop helpers importable
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(SRC_DIR)
+sys.path.append(os.path.join(SRC_DIR, "preprocess"))
+sys.path.append(os.path.join(SRC_DIR, "preprocess", "crop"))
+
+from model.hsem import MODEL_NAME, get_embeddings_batch, embedding_column, model_dim
+from model.autotune import tuned_batch_size
+from preprocess.async_writers import AsyncParquetWriter
+from img_preprocess import detect_face, reduce_for_detection, crop_from_detection, _clip_box
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".webm")
+
+
+def video_schema(extra_columns=()):
+    schema = pa.schema([
+        ("video_path", pa.string()),
+        ("frame_index", pa.int64()),
+        ("timestamp_s", pa.float64()),
+        ("box", pa.list_(pa.int32())),
+        ("detected", pa.bool_()),
+        ("track_score", pa.float32()),
+        ("embedding", pa.list_(pa.float64())),
+    ])
+    for name in extra_columns:
+        schema = schema.append(pa.field(name, pa.list_(pa.float32())))
+    return schema
+
+
+# ---------------------------------------------------------
+# FRAME STREAM
+# ---------------------------------------------------------
+
+def iter_frames(video_path, sample_fps=None):
+    """
+    Yields (frame_index, timestamp_s, frame_bgr) for the sampled frames of a video.
+    sample_fps=None keeps every frame; otherwise frames in between are grabbed but not decoded.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Cannot open video: {video_path}")
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    step = max(1, int(round(fps / sample_fps))) if sample_fps else 1
+
+    index = 0
+    try:
+        while True:
+            if index % step == 0:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                yield index, index / fps, frame
+            elif not cap.grab():
+                break
+            index += 1
+    finally:
+        cap.release()
+
+
+def video_info(video_path):
+    """(fps, frame_count, duration_s) from the container header."""
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    n = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return fps, n, n / fps
+
+
+# ---------------------------------------------------------
+# FACE TRACKER
+# ---------------------------------------------------------
+
+class FaceTracker:
+    """
+    Keyframe detection + template-matching tracking.
+
+    update(frame_bgr) returns (box, detected, score):
+        box      : int (x1, y1, x2, y2) in frame coordinates, or None if no face
+        detected : True if MTCNN ran on this frame
+        score    : detection probability, or template-match correlation when tracked
+
+    MTCNN runs when the last detection is `keyframe_every` frames old, when the match score
+    drops below `min_score`, or when there is no face to track.
+    """
+
+    def __init__(self, keyframe_every=15, min_score=0.6, search_margin=0.5):
+        self.keyframe_every = keyframe_every
+        self.min_score = min_score
+        self.search_margin = search_margin
+
+        self.box = None           # in small-frame coordinates (float), clipped to the frame
+        self.template = None
+        self.scale = 1.0
+        self.since_detection = 0
+        self.detections = 0
+        self.tracked = 0
+
+    def _detect(self, frame_bgr, small, gray):
+        # MTCNN sees the downscaled copy; detect_face rescales to frame coordinates
+        box, prob, _ = detect_face(frame_bgr, cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+        self.detections += 1
+        self.since_detection = 0
+
+        if box is None:
+            self.box, self.template = None, None
+            return None, True, 0.0
+
+        # keep the clipped box: it must be exactly the region the template is cut from, or a face
+        # at the frame edge drifts by the clipped amount on every tracked frame
+        x1, y1, x2, y2 = _clip_box(np.asarray(box, dtype=np.float64) / self.scale, gray.shape)
+        self.box = np.array([x1, y1, x2, y2], dtype=np.float64)
+        self.template = gray[y1:y2, x1:x2].copy() if x2 > x1 and y2 > y1 else None
+        return _clip_box(box, frame_bgr.shape), True, prob
+
+    def _track(self, gray):
+        x1, y1, x2, y2 = self.box
+        bw, bh = x2 - x1, y2 - y1
+        th, tw = self.template.shape
+
+        # search window around the previous box
+        sx1, sy1, sx2, sy2 = _clip_box((x1 - bw * self.search_margin, y1 - bh * self.search_margin,
+                                        x2 + bw * self.search_margin, y2 + bh * self.search_margin), gray.shape)
+        window = gray[sy1:sy2, sx1:sx2]
+        if window.shape[0] < th or window.shape[1] < tw:
+            return None, 0.0
+
+        result = cv2.matchTemplate(window, self.template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (mx, my) = cv2.minMaxLoc(result)
+
+        dx, dy = sx1 + mx - x1, sy1 + my - y1
+        self.box = self.box + np.array([dx, dy, dx, dy])
+        return self.box, float(score)
+
+    def update(self, frame_bgr):
+        small = reduce_for_detection(frame_bgr)
+        self.scale = frame_bgr.shape[1] / small.shape[1]
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        self.since_detection += 1
+
+        if self.template is None or self.since_detection >= self.keyframe_every:
+            return self._detect(frame_bgr, small, gray)
+
+        box, score = self._track(gray)
+        if box is None or score < self.min_score:
+            return self._detect(frame_bgr, small, gray)
+
+        self.tracked += 1
+        return _clip_box(box * self.scale, frame_bgr.shape), False, score
+
+
+# ---------------------------------------------------------
+# VIDEO -> PARQUET
+# ---------------------------------------------------------
+
+def build_video_parquet(video_path, out_path, models=None, sample_fps=None, keyframe_every=15,
+                        min_score=0.6, batch_size=None, dim=(224, 224)):
+    """
+    Streams one video, tracks the face, embeds the crops in batches and writes one row per
+    frame with a face (row groups of `batch_size` rows, published with an atomic rename).
+    Returns a stats dict (frames, rows, detections, seconds, realtime_factor).
+    """
+    models = list(models or [MODEL_NAME])
+    batch_size = batch_size or tuned_batch_size("embed", models[0])
+    extra = {name: embedding_column(name, model_dim(name)) for name in models} if len(models) > 1 else {}
+    schema = video_schema(extra.values())
+
+    tracker = FaceTracker(keyframe_every=keyframe_every, min_score=min_score)
+    fps, _, duration = video_info(video_path)
+    start = time.perf_counter()
+
+    pending = []        # (frame_index, timestamp, box, detected, score, crop_bgr)
+    frames = rows = 0
+
+    def flush(writer):
+        feats = get_embeddings_batch([p[5] for p in pending], models)
+        table = {
+            "video_path": [video_path] * len(pending),
+            "frame_index": [p[0] for p in pending],
+            "timestamp_s": [p[1] for p in pending],
+            "box": [[int(v) for v in p[2]] for p in pending],
+            "detected": [p[3] for p in pending],
+            "track_score": [p[4] for p in pending],
+            "embedding": [f.astype(np.float64).tolist() for f in feats[models[0]]],
+        }
+        for name, column in extra.items():
+            table[column] = [f.tolist() for f in feats[name]]
+        writer.write_table(pa.Table.from_pydict(table, schema=schema))
+        n = len(pending)
+        pending.clear()
+        return n
+
+    # decoding/tracking/embedding continue while finished row groups are written in the background
+    with AsyncParquetWriter(out_path, schema) as writer:
+        for index, timestamp, frame in iter_frames(video_path, sample_fps):
+            frames += 1
+            box, detected, score = tracker.update(frame)
+            if box is None:
+                continue
+
+            crop = crop_from_detection(frame, box, dim=dim)
+            if crop is None:
+                continue
+            pending.append((index, timestamp, box, detected, score, crop))
+
+            if len(pending) >= batch_size:
+                rows += flush(writer)
+
+        if pending:
+            rows += flush(writer)
+
+    seconds = time.perf_counter() - start
+    stats = {
+        "frames": frames,
+        "rows": rows,
+        "detections": tracker.detections,
+        "tracked": tracker.tracked,
+        "seconds": seconds,
+        "realtime_factor": duration / seconds if seconds > 0 else float("inf"),
+    }
+    print(f"[INFO] {os.path.basename(video_path)}: {frames} frames, {rows} with a face, "
+          f"{tracker.detections} detections, {tracker.tracked} tracked, "
+          f"{seconds:.1f}s ({stats['realtime_factor']:.1f}x real time at {fps:.0f} fps)")
+    return stats
+
+
+def list_videos(video_dir):
+    return sorted(os.path.join(video_dir, f) for f in os.listdir(video_dir)
+                  if f.lower().endswith(VIDEO_EXTENSIONS))
+
+
+def build_video_embeddings(source, out_dir, **kwargs):
+    """
+    source: one video file or a directory of videos.
+    Saves {video_name}_embeddings.parquet per video into out_dir; returns {video_path: stats}.
+    """
+    videos = [source] if os.path.isfile(source) else list_videos(source)
+    os.makedirs(out_dir, exist_ok=True)
+
+    results = {}
+    for video_path in videos:
+        stem = os.path.splitext(os.path.basename(video_path))[0]
+        out_path = os.path.join(out_dir, f"{stem}_embeddings.parquet")
+        results[video_path] = build_video_parquet(video_path, out_path, **kwargs)
+        print(f"[INFO] Saved {out_path}")
+    return results
+
+
+# ---------------------------------------------------------
+# MAIN
+# ---------------------------------------------------------
+
+if __name__ == "__main__":
+    VIDEO_DIR = "/Users/bencarmel/Documents/TAU/LiraMic/src/dataset/videos"
+    OUT_DIR = "/Users/bencarmel/Documents/TAU/LiraMic/src/dataset/video_embeddings"
+    build_video_embeddings(VIDEO_DIR, OUT_DIR)
@@ -89,7 +89,7 @@ def save_heatmap_png(matrix, labels, title, out_path):
 # Save all angles to a multi-page PDF
 # ---------------------------------------------------------
 
-def save_all_heatmaps_to_pdf(results_dict, pdf_path):
+def save_all_heatmaps_to_pdf(results_dict, pdf_path, gamma=2.0):
     """
     results_dict = {
         "front":  (matrix, labels),
@@ -104,7 +104,8 @@ def save_all_heatmaps_to_pdf(results_dict, pdf_path):
                 ax,
                 matrix,
                 labels,
-                title=f"{angle.capitalize()} – Emotion Similarity Matrix"
+                title=f"{angle.capitalize()} – Emotion Similarity Matrix",
+                gamma=gamma
             )
             fig.colorbar(im)
             plt.tight_layout()
@@ -2,4 +2,4 @@ from kaggle import api
 
 dataset_path = 'chenrich/kdef-database'
 download_path = '../dataset/orig_kdef/'
-api.dataset_download_files(dataset_path, path=download_path, unzip=True)
\ No newline at end of file
+api.dataset_download_files(dataset_path, path=download_path, unzip=False)  # keep the zip; preprocess reads it directly
\ No newline at end of file
@@ -0,0 +1,163 @@
+"""Per-host autotuning of (workers x torch threads x batch size) for the inference stages.
+
+calibrate(stage, image_paths) runs a short timed benchmark of every configuration that does not
+oversubscribe the machine (workers * threads <= CPU cores) on a SharedModelPool and stores the
+fastest one in ~/.cache/liramic/autotune.json (override with LIRAMIC_AUTOTUNE), keyed by host,
+stage ("embed" / "detect") and model:
+
+    {"pool":   {"workers", "threads", "batch_size", "images_per_s"},
+     "single": {"threads", "batch_size", "images_per_s"},      # best with one process
+     "cpu_count", "tuned_at"}
+
+Later runs pick it up automatically: load_model() and the MTCNN detector set torch's thread
+count from "single", SharedModelPool(workers=None) uses "pool", and batch_size=None in the
+embedding builders uses the tuned batch size. Nothing here imports torch at module level.
+"""
+
+import functools
+import itertools
+import json
+import multiprocessing as mp
+import os
+import socket
+import time
+
+TUNE_PATH = os.environ.get("LIRAMIC_AUTOTUNE", os.path.join(os.path.expanduser("~"), ".cache", "liramic",
+                                                             "autotune.json"))
+DEFAULT_BATCH_SIZE = 32
+
+
+def _key(stage, model_name):
+    return f"{socket.gethostname()}|{stage}|{model_name}"
+
+
+# ---------------------------------------------------------
+# PERSISTED CONFIGURATIONS
+# ---------------------------------------------------------
+
+def _load_all(path=TUNE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_config(stage, model_name, config, path=TUNE_PATH):
+    configs = _load_all(path)
+    configs[_key(stage, model_name)] = config
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(configs, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def tuned_config(stage, model_name, path=TUNE_PATH):
+    """The stored configuration for this host, or None (also None if the core count changed)."""
+    config = _load_all(path).get(_key(stage, model_name))
+    if config is None or config.get("cpu_count") != os.cpu_count():
+        return None
+    return config
+
+
+def tuned_batch_size(stage, model_name, default=DEFAULT_BATCH_SIZE):
+    config = tuned_config(stage, model_name)
+    return config["single"]["batch_size"] if config else default
+
+
+def tuned_pool(stage, model_name, default_workers=4, default_threads=1):
+    """(workers, threads_per_worker) for a worker pool."""
+    config = tuned_config(stage, model_name)
+    if config is None:
+        return default_workers, default_threads
+    return config["pool"]["workers"], config["pool"]["threads"]
+
+
+def apply_tuned_threads(stage, model_name):
+    """Set torch's intra-op threads of this (single) process from the tuned configuration.
+
+    No-op inside pool workers, whose thread count is set by the pool.
+    """
+    config = tuned_config(stage, model_name)
+    if config is None or mp.parent_process() is not None:
+        return None
+    import torch
+    torch.set_num_threads(config["single"]["threads"])
+    return config["single"]["threads"]
+
+
+# ---------------------------------------------------------
+# CALIBRATION
+# ---------------------------------------------------------
+
+def candidate_grid(cpu_count=None, batch_sizes=(8, 16, 32, 64)):
+    """All (workers, threads, batch) with workers * threads <= cores, powers of two (plus the core count)."""
+    cores = cpu_count or os.cpu_count() or 1
+    counts = sorted({2 ** i for i in range(cores.bit_length()) if 2 ** i <= cores} | {cores})
+    return [(w, t, b) for w, t, b in itertools.product(counts, counts, batch_sizes) if w * t <= cores]
+
+
+def calibrate(stage, image_paths, model_name=None, batch_sizes=None, repeats=1, path=TUNE_PATH):
+    """
+    stage: "embed" (batched hsem model) or "detect" (MTCNN, one image per call)
+    image_paths: a small sample (~64-256 images) representative of the dataset
+    Runs every candidate configuration, saves the best pool and single-process settings and returns them.
+    """
+    from model import hsem
+    from model.shared_pool import SharedModelPool, embed_batch, detect_batch
+
+    if stage == "embed":
+        model_name = model_name or hsem.MODEL_NAME
+        task = functools.partial(embed_batch, model_name=model_name)
+        batch_sizes = batch_sizes or (8, 16, 32, 64)
+    elif stage == "detect":
+        model_name = model_name or "mtcnn"
+        task = detect_batch
+        batch_sizes = batch_sizes or (1,)      # MTCNN gets images of different sizes; no batching
+    else:
+        raise ValueError(f"Unknown stage: {stage}")
+
+    grid = candidate_grid(batch_sizes=batch_sizes)
+    print(f"[INFO] Calibrating {stage}/{model_name}: {len(grid)} configurations on {len(image_paths)} images")
+
+    results = []
+    for (workers, threads), group in itertools.groupby(grid, key=lambda c: c[:2]):
+        models = [model_name] if stage == "embed" else []
+        with SharedModelPool(models, detector=stage == "detect", workers=workers, threads_per_worker=threads) as pool:
+            pool.map(task, [image_paths[:1]] * workers, chunksize=1)       # warm-up
+            for _, _, batch in group:
+                batches = [image_paths[i:i + batch] for i in range(0, len(image_paths), batch)]
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    pool.map(task, batches, chunksize=1)
+                rate = repeats * len(image_paths) / (time.perf_counter() - start)
+                results.append({"workers": workers, "threads": threads, "batch_size": batch, "images_per_s": rate})
+                print(f"  workers={workers:<2} threads={threads:<2} batch={batch:<3} {rate:8.1f} images/s")
+
+    best = max(results, key=lambda r: r["images_per_s"])
+    single = max((r for r in results if r["workers"] == 1), key=lambda r: r["images_per_s"])
+    config = {
+        "pool": best,
+        "single": {k: single[k] for k in ("threads", "batch_size", "images_per_s")},
+        "cpu_count": os.cpu_count(),
+        "tuned_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    save_config(stage, model_name, config, path)
+    print(f"[INFO] Best {stage}/{model_name}: {best['workers']} workers x {best['threads']} threads, "
+          f"batch {best['batch_size']} ({best['images_per_s']:.1f} images/s); saved to {path}")
+    return config
+
+
+# ---------------------------------------------------------
+# MAIN
+# ---------------------------------------------------------
+
+if __name__ == "__main__":
+    import sys
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from embeddings.store_embeddings import list_angle_images
+
+    ANGLE_DIR = "/Users/bencarmel/Documents/TAU/LiraMic/src/dataset/kdef_by_angle/front"
+    sample = [p for _, _, p in list_angle_images(ANGLE_DIR)][:128]
+    calibrate("embed", sample)
+    calibrate("detect", sample[:64])
@@ -1,10 +1,11 @@
 """Compatibility wrapper for HSEmotionRecognizer.
 
 Provides load_model() and get_embedding(image_path) which load the model on CPU and return facial-emotion embeddings. Applies timm compatibility shims and patches EfficientNet attributes; overrides torch.load for CPU-safe loading.
+
+torch, cv2, timm and hsemotion are imported lazily (on the first model load / embedding call), so importing this module -- e.g. for the column helpers -- stays cheap.
 """
 
-import torch
-import cv2
+import numpy as np
 import sys
 from types import ModuleType
 
@@ -17,51 +18,145 @@ compatibility_mappings = {
     'timm.models._hub': 'timm.models.hub',
 }
 
-for old_module, new_module in compatibility_mappings.items():
-    try:
-        parts = new_module.split('.')
-        module = __import__(new_module, fromlist=[parts[-1]])
-        sys.modules[old_module] = module
-    except ImportError:
-        sys.modules[old_module] = ModuleType(old_module)
+_runtime_ready = False
+
+def _install_compat():
+    """Apply the timm shims and the CPU-only torch.load patch (once, before the first model load)."""
+    global _runtime_ready
+    if _runtime_ready:
+        return
+
+    for old_module, new_module in compatibility_mappings.items():
+        try:
+            parts = new_module.split('.')
+            module = __import__(new_module, fromlist=[parts[-1]])
+            sys.modules[old_module] = module
+        except ImportError:
+            sys.modules[old_module] = ModuleType(old_module)
+
+    import torch
+    _original_load = torch.load
+
+    def cpu_only_load(*args, **kwargs):
+        kwargs["map_location"] = torch.device("cpu")
+        kwargs["weights_only"] = False
+        result = _original_load(*args, **kwargs)
 
-from hsemotion.facial_emotions import HSEmotionRecognizer
-import torch.nn as nn
+        if hasattr(result, '__class__') and 'EfficientNet' in result.__class__.__name__:
+            result = patch_efficientnet(result)
+
+        return result
+
+    torch.load = cpu_only_load
+    _runtime_ready = True
 
 # Monkey-patch to add missing attributes
 def patch_efficientnet(model):
     """Add missing attributes for backward compatibility"""
+    import torch.nn as nn
     if hasattr(model, 'conv_stem') and not hasattr(model, 'act1'):
         model.act1 = nn.Identity()
     return model
 
-_original_load = torch.load
-def cpu_only_load(*args, **kwargs):
-    kwargs["map_location"] = torch.device("cpu")
-    kwargs["weights_only"] = False
-    result = _original_load(*args, **kwargs)
-    
-    if hasattr(result, '__class__') and 'EfficientNet' in result.__class__.__name__:
-        result = patch_efficientnet(result)
-    
-    return result
-
-torch.load = cpu_only_load
-
 MODEL_NAME = "enet_b0_8_best_afew"   
 _model = None
 
-def load_model():
+# ------------------------------
+# MODEL REGISTRY
+# ------------------------------
+
+# name -> zero-argument loader returning an object with extract_features(img) / extract_multi_features(imgs)
+MODEL_LOADERS = {}
+_models = {}
+
+def register_model(name, loader):
+    """Make a backbone available to load_model / get_embeddings under `name`."""
+    MODEL_LOADERS[name] = loader
+
+def _load_hsemotion(name):
+    _install_compat()
+    from hsemotion.facial_emotions import HSEmotionRecognizer
+    model = HSEmotionRecognizer(model_name=name, device="cpu")
+    if hasattr(model, 'model'):
+        model.model = patch_efficientnet(model.model)
+    return model
+
+for _name in ("enet_b0_8_best_afew", "enet_b0_8_best_vgaf", "enet_b0_8_va_mtl", "enet_b2_8", "enet_b2_7"):
+    register_model(_name, lambda _name=_name: _load_hsemotion(_name))
+
+class TimmFeatureExtractor:
+    """Any timm backbone behind the HSEmotionRecognizer feature interface (pooled features)."""
+
+    def __init__(self, timm_name, img_size=224):
+        _install_compat()
+        import timm
+        import torch
+        self.model = timm.create_model(timm_name, pretrained=True, num_classes=0).eval()
+        self.img_size = img_size
+        self.mean = torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1)
+        self.std = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
+
+    def _to_tensor(self, imgs):
+        """BGR uint8 images (as decoded by cv2) -> normalized RGB batch (ImageNet mean/std are RGB)."""
+        import cv2
+        import torch
+        batch = [cv2.cvtColor(cv2.resize(img, (self.img_size, self.img_size)), cv2.COLOR_BGR2RGB) for img in imgs]
+        x = torch.from_numpy(np.stack(batch)).permute(0, 3, 1, 2).float() / 255.0
+        return (x - self.mean) / self.std
+
+    def extract_multi_features(self, imgs):
+        import torch
+        with torch.no_grad():
+            return self.model(self._to_tensor(imgs)).numpy()
+
+    def extract_features(self, img):
+        return self.extract_multi_features([img])[0]
+
+def register_timm_model(name, timm_name=None, img_size=224):
+    register_model(name, lambda: TimmFeatureExtractor(timm_name or name, img_size))
+
+def load_model(model_name=None):
+    """Load (once per process) and return a registered model; default MODEL_NAME."""
     global _model
-    if _model is None:
-        _model = HSEmotionRecognizer(model_name=MODEL_NAME, device="cpu")
-        
-        if hasattr(_model, 'model'):
-            _model.model = patch_efficientnet(_model.model)
-    return _model
+    name = model_name or MODEL_NAME
+    if name not in _models:
+        if name not in MODEL_LOADERS:
+            raise KeyError(f"Unknown model: {name} (registered: {sorted(MODEL_LOADERS)})")
+        _models[name] = MODEL_LOADERS[name]()
+        from model.autotune import apply_tuned_threads
+        apply_tuned_threads("embed", name)
+    if name == MODEL_NAME:
+        _model = _models[name]
+    return _models[name]
+
+# ------------------------------
+# EMBEDDING COLUMNS PER MODEL
+# ------------------------------
+
+def embedding_column(model_name, dim):
+    """Parquet column holding one model's embeddings, tagged with model name and dimension."""
+    return f"embedding__{model_name}__{dim}"
+
+def find_embedding_column(columns, model_name):
+    """Pick the embedding column written for model_name from a list of column names."""
+    prefix = f"embedding__{model_name}__"
+    matches = [c for c in columns if c.startswith(prefix)]
+    if not matches:
+        raise KeyError(f"No embedding column for model {model_name} in {list(columns)}")
+    return matches[0]
+
+def model_dim(model_name):
+    """Embedding dimension of a registered model (one forward pass on a blank image)."""
+    blank = np.zeros((224, 224, 3), dtype=np.uint8)
+    return int(np.asarray(load_model(model_name).extract_features(blank)).size)
+
+# ------------------------------
+# SINGLE-MODEL EMBEDDING
+# ------------------------------
 
 def get_embedding(image_path):
     """Extract 1280-D facial emotion embedding from an image"""
+    import cv2
     model = load_model()
     image = cv2.imread(image_path)
 
@@ -70,3 +165,42 @@ def get_embedding(image_path):
 
     features = model.extract_features(image)
     return features
+
+def get_embedding_from_array(image_rgb):
+    """Same as get_embedding for an already decoded RGB uint8 crop (e.g. from a shard).
+
+    Converted to BGR so the model sees exactly what get_embedding feeds it via cv2.imread.
+    """
+    import cv2
+    model = load_model()
+    image = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR)
+    return model.extract_features(image)
+
+# ------------------------------
+# MULTI-MODEL EMBEDDING (ONE DECODE)
+# ------------------------------
+
+def get_embeddings_batch(images_bgr, model_names):
+    """
+    Runs every model on the same already-decoded batch of BGR images.
+    Returns {model_name: ndarray (B, D_model)}.
+    """
+    results = {}
+    for name in model_names:
+        model = load_model(name)
+        if hasattr(model, 'extract_multi_features'):
+            feats = model.extract_multi_features(list(images_bgr))
+        else:
+            feats = [model.extract_features(img) for img in images_bgr]
+        results[name] = np.asarray(feats).reshape(len(images_bgr), -1)
+    return results
+
+def get_embeddings(image_path, model_names):
+    """Decode image_path once and return {model_name: 1-D embedding} for every model."""
+    import cv2
+    image = cv2.imread(image_path)
+
+    if image is None:
+        raise ValueError(f"Cannot read: {image_path}")
+
+    return {name: feats[0] for name, feats in get_embeddings_batch([image], model_names).items()}
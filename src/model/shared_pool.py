@@ -0,0 +1,302 @@
+"""Worker pool whose processes share one read-only copy of the model weights.
+
+The parent loads the requested models (model.hsem registry) and, optionally, the MTCNN detector
+once, moves every torch parameter and buffer into shared memory with nn.Module.share_memory(),
+and only then forks the workers. Workers inherit hsem._models / img_preprocess.mtcnn and run
+inference directly against the shared tensors: the weight pages are a shared mapping, so Python
+refcount traffic in a child never copies them, and per-worker RSS is just the interpreter plus
+activations. Each worker is limited to `threads_per_worker` torch threads.
+
+FaceMesh (mediapipe) holds no torch weights and is not fork-safe; label workers keep creating
+their own instance. Without fork (Windows) the pool falls back to spawn and every worker loads
+its own copy.
+
+    with SharedModelPool(workers=4) as pool:
+        embeddings = pool.map(embed_path, image_paths)
+        pool.memory_report()
+"""
+
+import multiprocessing as mp
+import os
+import queue
+import sys
+import time
+import traceback
+
+import numpy as np
+
+# Make src importable
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(SRC_DIR)
+
+from model import hsem
+
+
+# ---------------------------------------------------------
+# SHARED WEIGHTS
+# ---------------------------------------------------------
+
+def _torch_modules(obj):
+    """obj itself if it is an nn.Module, else its nn.Module attributes (e.g. HSEmotionRecognizer.model)."""
+    try:
+        import torch.nn as nn
+    except ImportError:
+        return []
+    if isinstance(obj, nn.Module):
+        return [obj]
+    return [v for v in vars(obj).values() if isinstance(v, nn.Module)]
+
+
+def share_weights(obj):
+    """Move the weights of obj into shared memory (eval mode). Returns the number of shared bytes."""
+    n_bytes = 0
+    for module in _torch_modules(obj):
+        module.eval()
+        module.share_memory()
+        n_bytes += sum(t.numel() * t.element_size() for t in list(module.parameters()) + list(module.buffers()))
+    return n_bytes
+
+
+# ---------------------------------------------------------
+# MEMORY ACCOUNTING
+# ---------------------------------------------------------
+
+def process_memory(pid=None):
+    """
+    {"rss_mb", "private_mb", "shared_mb"} of a process.
+    private = pages only this process maps (its real per-process cost); Linux only, else None.
+    """
+    pid = pid or os.getpid()
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1]) / 1024
+    except OSError:
+        import resource
+        # ru_maxrss: peak RSS of this process, KB on Linux, bytes on macOS
+        scale = 1 / 1024 ** 2 if sys.platform == "darwin" else 1 / 1024
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale if pid == os.getpid() else None
+        return {"rss_mb": rss, "private_mb": None, "shared_mb": None}
+
+    private = fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    return {
+        "rss_mb": fields.get("Rss"),
+        "private_mb": private,
+        "shared_mb": fields.get("Rss", 0) - private,
+    }
+
+
+# ---------------------------------------------------------
+# WORKERS
+# ---------------------------------------------------------
+
+def _limit_threads(threads):
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def _worker_loop(tasks, results, threads):
+    _limit_threads(threads)
+    while True:
+        msg = tasks.get()
+        if msg is None:
+            break
+        index, fn, chunk = msg
+        try:
+            results.put((index, True, [fn(item) for item in chunk]))
+        except Exception:
+            results.put((index, False, traceback.format_exc()))
+
+
+def _crop_module():
+    sys.path.append(os.path.join(SRC_DIR, "preprocess"))
+    sys.path.append(os.path.join(SRC_DIR, "preprocess", "crop"))
+    import img_preprocess
+    return img_preprocess
+
+
+class SharedModelPool:
+    """
+    model_names: registered hsem models to load once and share (default: MODEL_NAME)
+    detector: also share the MTCNN detector of img_preprocess
+    workers / threads_per_worker: process count and torch threads per process
+    (None = the autotuned values for this host, see model/autotune.py)
+    """
+
+    def __init__(self, model_names=None, detector=False, workers=None, threads_per_worker=None):
+        if workers is None or threads_per_worker is None:
+            from model.autotune import tuned_pool
+            stage, name = ("detect", "mtcnn") if detector and not model_names else ("embed", (model_names or [hsem.MODEL_NAME])[0])
+            tuned_workers, tuned_threads = tuned_pool(stage, name)
+            workers = workers or tuned_workers
+            threads_per_worker = threads_per_worker or tuned_threads
+
+        self.workers = workers
+        self.shared_bytes = 0
+        start = time.perf_counter()
+
+        for name in model_names or [hsem.MODEL_NAME]:
+            self.shared_bytes += share_weights(hsem.load_model(name))
+        if detector:
+            self.shared_bytes += share_weights(_crop_module().get_detector())
+        self.load_seconds = time.perf_counter() - start
+
+        if "fork" in mp.get_all_start_methods():
+            ctx = mp.get_context("fork")
+        else:
+            print("[WARN] fork is unavailable; every worker loads its own copy of the weights")
+            ctx = mp.get_context("spawn")
+
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        self._procs = [ctx.Process(target=_worker_loop, args=(self._tasks, self._results, threads_per_worker),
+                                   daemon=True) for _ in range(workers)]
+        for p in self._procs:
+            p.start()
+
+        print(f"[INFO] Shared {self.shared_bytes / 1024 ** 2:.1f} MB of weights with {workers} workers "
+              f"(loaded in {self.load_seconds:.1f}s)")
+
+    @property
+    def pids(self):
+        return [p.pid for p in self._procs]
+
+    def map(self, fn, items, chunksize=8):
+        """[fn(item) for item in items] across the workers (order kept). fn must be a module-level function."""
+        items = list(items)
+        chunks = [items[i:i + chunksize] for i in range(0, len(items), chunksize)]
+        for index, chunk in enumerate(chunks):
+            self._tasks.put((index, fn, chunk))
+
+        out = [None] * len(chunks)
+        error = None
+        # collect every chunk, even after a failure, so no stale results leak into the next map()
+        for _ in range(len(chunks)):
+            while True:
+                try:
+                    index, ok, value = self._results.get(timeout=5)
+                    break
+                except queue.Empty:
+                    dead = [p.pid for p in self._procs if not p.is_alive()]
+                    if dead:
+                        raise RuntimeError(f"Worker processes died: {dead}")
+            if not ok:
+                error = error or value
+            out[index] = value
+
+        if error is not None:
+            raise RuntimeError(f"Worker task failed:\n{error}")
+        return [r for chunk in out for r in chunk]
+
+    def memory_report(self):
+        """Prints and returns {"parent": mem, "workers": [mem, ...]} (see process_memory)."""
+        report = {"parent": process_memory(), "workers": [process_memory(pid) for pid in self.pids]}
+
+        def fmt(v):
+            return "   n/a" if v is None else f"{v:6.0f}"
+
+        print(f"  {'process':<10} {'RSS MB':>8} {'private MB':>11} {'shared MB':>10}")
+        for label, mem in [("parent", report["parent"])] + [(f"worker {i}", m) for i, m in enumerate(report["workers"])]:
+            print(f"  {label:<10} {fmt(mem['rss_mb']):>8} {fmt(mem['private_mb']):>11} {fmt(mem['shared_mb']):>10}")
+        return report
+
+    def close(self):
+        for _ in self._procs:
+            self._tasks.put(None)
+        for p in self._procs:
+            p.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ---------------------------------------------------------
+# READY-MADE TASKS
+# ---------------------------------------------------------
+
+def embed_path(image_path):
+    """Default-model embedding of one image (runs in a worker)."""
+    return np.array(hsem.get_embedding(image_path)).squeeze()
+
+
+def detect_path(image_path):
+    """Bounds-checked face box of one image, or None (runs in a worker)."""
+    img_preprocess = _crop_module()
+    image = img_preprocess.load_image(image_path)
+    return None if image is None else img_preprocess.detect_face_box(image)
+
+
+def embed_batch(image_paths, model_name=None):
+    """Embeddings of a batch of images in one forward pass (runs in a worker; default model MODEL_NAME).
+
+    Row i belongs to image_paths[i]; an unreadable image raises instead of shifting the rows.
+    """
+    import cv2
+    name = model_name or hsem.MODEL_NAME
+    images = []
+    for path in image_paths:
+        image = cv2.imread(path)
+        if image is None:
+            raise ValueError(f"Cannot read: {path}")
+        images.append(image)
+    return hsem.get_embeddings_batch(images, [name])[name]
+
+
+def detect_batch(image_paths):
+    return [detect_path(p) for p in image_paths]
+
+
+# ---------------------------------------------------------
+# BENCHMARK
+# ---------------------------------------------------------
+
+def benchmark(image_paths, worker_counts=(1, 2, 4), threads_per_worker=1, task=embed_path):
+    """
+    Throughput and memory per worker count. The per-worker overhead is the private memory of
+    each worker; a pool without shared weights would add the full model size per worker instead.
+    Returns {workers: {"images_per_s", "worker_private_mb", "parent_rss_mb"}}.
+    """
+    results = {}
+    for n in worker_counts:
+        with SharedModelPool(workers=n, threads_per_worker=threads_per_worker,
+                             detector=task is detect_path) as pool:
+            pool.map(task, image_paths[:n])           # warm-up: first forward pass per worker
+            start = time.perf_counter()
+            pool.map(task, image_paths)
+            seconds = time.perf_counter() - start
+
+            print(f"\n[BENCH] {n} workers x {threads_per_worker} threads: "
+                  f"{len(image_paths) / seconds:.1f} images/s")
+            mem = pool.memory_report()
+
+        private = [m["private_mb"] for m in mem["workers"] if m["private_mb"] is not None]
+        results[n] = {
+            "images_per_s": len(image_paths) / seconds,
+            "worker_private_mb": float(np.mean(private)) if private else None,
+            "parent_rss_mb": mem["parent"]["rss_mb"],
+        }
+        if private:
+            print(f"[BENCH] per-worker overhead {results[n]['worker_private_mb']:.0f} MB "
+                  f"(weights shared: {pool.shared_bytes / 1024 ** 2:.0f} MB once)")
+    return results
+
+
+# ---------------------------------------------------------
+# MAIN
+# ---------------------------------------------------------
+
+if __name__ == "__main__":
+    from embeddings.store_embeddings import list_angle_images
+
+    ANGLE_DIR = "/Users/bencarmel/Documents/TAU/LiraMic/src/dataset/kdef_by_angle/front"
+    paths = [p for _, _, p in list_angle_images(ANGLE_DIR)][:256]
+    benchmark(paths, worker_counts=(1, 2, 4))
@@ -0,0 +1,306 @@
+"""
+Pipeline Orchestrator
+---------------------
+A small DAG runner for the LiraMic workflow:
+
+    crop -> label -> organize -> embed_{angle} -> pairwise_{angle} -> heatmap
+
+Each stage declares its inputs, outputs and parameters. Before a stage runs, a fingerprint of
+(stage code, parameters, input file sizes/mtimes, upstream fingerprints) is compared with the one
+recorded in <data_root>/.pipeline_state.json; if it matches and all outputs exist the stage is
+skipped. Stages whose dependencies are satisfied run concurrently (all angles at once), and a run
+summary is printed at the end.
+
+Changing only the heatmap gamma therefore re-runs only the rendering stage.
+
+    python orchestrator.py --data-root /path/to/src/dataset [--gamma 2.5] [--workers 3] [--force STAGE ...]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# Make src importable
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(SRC_DIR)
+
+ANGLES = ["front", "left", "right"]
+STATE_FILE = ".pipeline_state.json"
+
+
+# ---------------------------------------------------------
+# STAGE + FINGERPRINTS
+# ---------------------------------------------------------
+
+class Stage:
+    """
+    name:    unique stage name
+    fn:      callable(**params) doing the work
+    inputs:  files/directories read by the stage
+    outputs: files/directories produced by the stage
+    params:  keyword arguments for fn (part of the fingerprint)
+    deps:    names of stages that must finish first
+    """
+
+    def __init__(self, name, fn, inputs=(), outputs=(), params=None, deps=()):
+        self.name = name
+        self.fn = fn
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.deps = list(deps)
+
+
+def _path_signature(path):
+    """(relative path, size, mtime) of a file, or of every file under a directory."""
+    if os.path.isfile(path):
+        st = os.stat(path)
+        return [(path, st.st_size, st.st_mtime_ns)]
+    if not os.path.isdir(path):
+        return [(path, None, None)]
+
+    sig = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for fname in sorted(filenames):
+            full = os.path.join(dirpath, fname)
+            st = os.stat(full)
+            sig.append((os.path.relpath(full, path), st.st_size, st.st_mtime_ns))
+    return sig
+
+
+def fingerprint(stage, upstream):
+    h = hashlib.sha1()
+    h.update(f"{stage.fn.__module__}.{stage.fn.__qualname__}".encode())
+    h.update(json.dumps(stage.params, sort_keys=True, default=str).encode())
+    for dep in stage.deps:
+        h.update(upstream[dep].encode())
+    for path in stage.inputs:
+        h.update(json.dumps(_path_signature(path)).encode())
+    return h.hexdigest()
+
+
+# ---------------------------------------------------------
+# RUNNER
+# ---------------------------------------------------------
+
+def _load_state(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def _save_state(path, state):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def run_pipeline(stages, state_path, workers=4, force=()):
+    """
+    Runs the DAG. Returns {stage name: (status, seconds)} with status in
+    ran / up-to-date / failed / blocked.
+    """
+    by_name = {s.name: s for s in stages}
+    for s in stages:
+        for dep in s.deps:
+            if dep not in by_name:
+                raise ValueError(f"Stage {s.name} depends on unknown stage {dep}")
+
+    state = _load_state(state_path)
+    fingerprints = {}
+    summary = {}
+    pending = {s.name for s in stages}
+    running = {}
+
+    def run_one(stage, fp):
+        start = time.perf_counter()
+        stage.fn(**stage.params)
+        return fp, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            # stages blocked by a failed dependency never run; repeat until the whole chain is marked
+            changed = True
+            while changed:
+                changed = False
+                for name in sorted(pending):
+                    if any(summary.get(d, ("",))[0] in ("failed", "blocked") for d in by_name[name].deps):
+                        summary[name] = ("blocked", 0.0)
+                        pending.discard(name)
+                        changed = True
+
+            ready = [n for n in sorted(pending) if all(d in fingerprints for d in by_name[n].deps)]
+            for name in ready:
+                stage = by_name[name]
+                pending.discard(name)
+                fp = fingerprint(stage, fingerprints)
+                outputs_exist = all(os.path.exists(p) for p in stage.outputs)
+
+                if name not in force and state.get(name) == fp and outputs_exist:
+                    fingerprints[name] = fp
+                    summary[name] = ("up-to-date", 0.0)
+                    print(f"[SKIP] {name} (up to date)")
+                    continue
+
+                print(f"[RUN ] {name}")
+                running[pool.submit(run_one, stage, fp)] = name
+
+            if not running:
+                if pending and not ready:
+                    raise ValueError(f"Dependency cycle among stages: {sorted(pending)}")
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    fp, seconds = future.result()
+                except Exception as e:
+                    summary[name] = ("failed", 0.0)
+                    state.pop(name, None)
+                    print(f"[FAIL] {name}: {e!r}")
+                else:
+                    # outputs may have been rewritten, so dependants see a new fingerprint
+                    fingerprints[name] = fp
+                    state[name] = fp
+                    summary[name] = ("ran", seconds)
+                    print(f"[DONE] {name} ({seconds:.1f}s)")
+                _save_state(state_path, state)
+
+    print_summary(summary)
+    return summary
+
+
+def print_summary(summary):
+    print("\n[RUN SUMMARY]")
+    for name, (status, seconds) in summary.items():
+        print(f"  {name:<20} {status:<11} {seconds:8.1f}s")
+    total = sum(seconds for _, seconds in summary.values())
+    ran = sum(1 for status, _ in summary.values() if status == "ran")
+    print(f"  {ran}/{len(summary)} stages ran, {total:.1f}s of stage time")
+
+
+# ---------------------------------------------------------
+# LIRAMIC STAGE FUNCTIONS (heavy imports stay inside)
+# ---------------------------------------------------------
+
+def _add_path(*parts):
+    path = os.path.join(SRC_DIR, *parts)
+    if path not in sys.path:
+        sys.path.append(path)
+
+
+def crop_stage(source, output_root, dim):
+    _add_path("preprocess")
+    _add_path("preprocess", "crop")
+    from img_preprocess import process_dataset_source
+    if process_dataset_source(source, output_root, dim=tuple(dim)) == 0:
+        raise RuntimeError(f"Crop stage produced no crops from {source}")
+
+
+def label_stage(processed_dir):
+    _add_path("preprocess", "label")
+    from label_dirs import process_emotion_directories
+    process_emotion_directories(processed_dir)
+
+
+def organize_stage(processed_dir):
+    _add_path("preprocess", "label")
+    from organize_byAngle import build_kdef_by_angle
+    build_kdef_by_angle(processed_dir)
+
+
+def embed_stage(angle_dir, angle, out_path, flush_every):
+    from embeddings.store_embeddings import build_angle_parquet
+    build_angle_parquet(angle_dir, angle, out_path, flush_every=flush_every)
+
+
+def pairwise_stage(parquet_path, out_path):
+    import numpy as np
+    from similarity.utils import load_parquet_embeddings, similarity_matrix, collapse_emotion_matrix
+
+    E, emotions, _ = load_parquet_embeddings(parquet_path)
+    mat, labels = collapse_emotion_matrix(similarity_matrix(E), emotions)
+    np.savez(out_path, matrix=mat, labels=np.array(labels))
+
+
+def heatmap_stage(matrix_paths, pdf_path, gamma):
+    import numpy as np
+    from heatmap.format_heatmap import save_all_heatmaps_to_pdf
+
+    results = {}
+    for angle, path in matrix_paths.items():
+        with np.load(path) as data:
+            results[angle] = (data["matrix"], data["labels"].tolist())
+    save_all_heatmaps_to_pdf(results, pdf_path, gamma=gamma)
+
+
+# ---------------------------------------------------------
+# LIRAMIC DAG
+# ---------------------------------------------------------
+
+def build_liramic_stages(data_root, source=None, angles=ANGLES, dim=(224, 224), gamma=2.0, flush_every=256):
+    """
+    data_root: dataset directory (holds orig_kdef/, processed_kdef/, kdef_by_angle/)
+    source: zip archive or directory of originals (default: data_root/orig_kdef, which may hold
+            just the downloaded zip; see archive_reader.resolve_source)
+    """
+    source = source or os.path.join(data_root, "orig_kdef")
+    processed = os.path.join(data_root, "processed_kdef")
+    by_angle = os.path.join(data_root, "kdef_by_angle")
+
+    stages = [
+        Stage("crop", crop_stage, inputs=[source], outputs=[processed],
+              params={"source": source, "output_root": processed, "dim": list(dim)}),
+        Stage("label", label_stage, outputs=[processed],
+              params={"processed_dir": processed}, deps=["crop"]),
+        Stage("organize", organize_stage, outputs=[by_angle],
+              params={"processed_dir": processed}, deps=["label"]),
+    ]
+
+    matrix_paths = {}
+    for angle in angles:
+        angle_dir = os.path.join(by_angle, angle)
+        parquet = os.path.join(by_angle, f"{angle}_embeddings.parquet")
+        matrix = os.path.join(by_angle, f"{angle}_pairwise.npz")
+        matrix_paths[angle] = matrix
+
+        stages.append(Stage(f"embed_{angle}", embed_stage, inputs=[angle_dir], outputs=[parquet],
+                            params={"angle_dir": angle_dir, "angle": angle, "out_path": parquet,
+                                    "flush_every": flush_every},
+                            deps=["organize"]))
+        stages.append(Stage(f"pairwise_{angle}", pairwise_stage, inputs=[parquet], outputs=[matrix],
+                            params={"parquet_path": parquet, "out_path": matrix},
+                            deps=[f"embed_{angle}"]))
+
+    pdf_path = os.path.join(by_angle, "emotion_similarity_pairwise.pdf")
+    stages.append(Stage("heatmap", heatmap_stage, inputs=list(matrix_paths.values()), outputs=[pdf_path],
+                        params={"matrix_paths": matrix_paths, "pdf_path": pdf_path, "gamma": gamma},
+                        deps=[f"pairwise_{a}" for a in angles]))
+    return stages
+
+
+# ---------------------------------------------------------
+# EXECUTABLE SCRIPT
+# ---------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the LiraMic pipeline, skipping up-to-date stages")
+    parser.add_argument("--data-root", default=os.environ.get("LIRAMIC_DATA", os.path.join(SRC_DIR, "dataset")))
+    parser.add_argument("--source", default=None, help="zip archive or directory of original images")
+    parser.add_argument("--gamma", type=float, default=2.0)
+    parser.add_argument("--workers", type=int, default=len(ANGLES))
+    parser.add_argument("--force", nargs="*", default=[], help="stage names to re-run regardless")
+    args = parser.parse_args()
+
+    stages = build_liramic_stages(args.data_root, source=args.source, gamma=args.gamma)
+    summary = run_pipeline(stages, os.path.join(args.data_root, STATE_FILE), workers=args.workers,
+                           force=set(args.force))
+    sys.exit(1 if any(status == "failed" for status, _ in summary.values()) else 0)
@@ -11,6 +11,7 @@ For each angle (front/left/right):
 6. Save all 7×7 matrices into a 3-page PDF
 
 Uses shared utilities from similarity/utils.py
+For a fast sampled preview with per-cell standard errors see pipelines/quick_look.py.
 """
 
 import os
@@ -0,0 +1,242 @@
+"""
+Quick-Look Similarity Pipeline
+------------------------------
+A sampled preview of run_pairwise_pipeline (pipelines/pairwise_similarity.py) with error bounds.
+
+For each angle, every (emotion) cell is sampled stratified by subject: each subject's images are
+shuffled and the cell's images are interleaved round-robin across shuffled subjects, so a sample of
+n images per cell covers n different subjects before any subject contributes a second image. Only
+the sampled images are embedded (and each image only once across rounds).
+
+Cell estimates match what the full pipeline computes: off-diagonal cells are the mean cross-emotion
+cosine similarity; diagonal cells include the self-pairs exactly as collapse_emotion_matrix does
+(1/N_i + (1 - 1/N_i) * mean off-diagonal pair similarity, with N_i the full cell size).
+
+Per-cell standard errors come from a subject-level bootstrap (images of one subject are correlated),
+scaled by a finite-population correction so a fully sampled cell has zero error. The per-cell sample
+doubles each round until the largest standard error across all angles is <= target_se.
+"""
+
+import os
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+
+# Make src importable
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from similarity.utils import clean_embedding, normalize_embeddings
+
+
+# ---------------------------------------------------------
+# STRATIFIED ORDERING
+# ---------------------------------------------------------
+
+def _subject_of(fname):
+    # subject ID = the prefix before underscore
+    return fname.split("_")[0]
+
+
+def list_strata(angle_dir):
+    """{emotion: {subject: [image paths]}} for one angle folder."""
+    strata = defaultdict(lambda: defaultdict(list))
+    for emotion in sorted(os.listdir(angle_dir)):
+        emotion_dir = os.path.join(angle_dir, emotion)
+        if not os.path.isdir(emotion_dir):
+            continue
+        for fname in sorted(os.listdir(emotion_dir)):
+            if fname.lower().endswith((".jpg", ".jpeg", ".png")):
+                strata[emotion][_subject_of(fname)].append(os.path.join(emotion_dir, fname))
+    return strata
+
+
+def stratified_order(by_subject, rng):
+    """
+    [(subject, path), ...] of one cell: subjects in random order, one image per subject per pass,
+    so every prefix of the list is a subject-stratified sample.
+    """
+    subjects = list(by_subject)
+    rng.shuffle(subjects)
+    shuffled = {s: list(rng.permutation(by_subject[s])) for s in subjects}
+
+    order = []
+    depth = max((len(p) for p in shuffled.values()), default=0)
+    for k in range(depth):
+        order.extend((s, shuffled[s][k]) for s in subjects if k < len(shuffled[s]))
+    return order
+
+
+# ---------------------------------------------------------
+# ESTIMATES + BOOTSTRAP STANDARD ERRORS
+# ---------------------------------------------------------
+
+def _cell_means(S, emo_idx, weights, full_sizes):
+    """
+    Weighted 7x7 estimate from the sample similarity matrix S.
+    weights: (B, n) image weights (bootstrap multiplicities; 1 = plain sample)
+    Returns (B, C, C).
+    """
+    C = len(emo_idx)
+    B = weights.shape[0]
+    out = np.zeros((B, C, C))
+    for i, a in enumerate(emo_idx):
+        wa = weights[:, a]
+        for j, b in enumerate(emo_idx):
+            wb = weights[:, b]
+            S_ab = S[np.ix_(a, b)]
+            total = np.einsum("ba,ac,bc->b", wa, S_ab, wb)
+            norm = wa.sum(1) * wb.sum(1)
+            if i == j:
+                # drop self-pairs, then add them back with the full population's weight
+                total = total - np.einsum("ba,a->b", wa ** 2, np.diag(S_ab))
+                norm = norm - (wa ** 2).sum(1)
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    off = np.where(norm > 0, total / norm, np.nan)
+                out[:, i, j] = 1.0 / full_sizes[i] + (1.0 - 1.0 / full_sizes[i]) * off
+            else:
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    out[:, i, j] = np.where(norm > 0, total / norm, np.nan)
+    return out
+
+
+def estimate_with_se(E, emotions, subjects, labels, full_sizes, n_boot=200, seed=0):
+    """
+    E: (n, D) embeddings of the sampled images of one angle.
+    Returns (mat (C, C), se (C, C)).
+    """
+    E = normalize_embeddings(E)
+    S = E @ E.T
+
+    emotions = np.asarray(emotions)
+    emo_idx = [np.flatnonzero(emotions == e) for e in labels]
+    full_sizes = np.asarray(full_sizes, dtype=np.float64)
+
+    mat = _cell_means(S, emo_idx, np.ones((1, len(E))), full_sizes)[0]
+
+    # subject bootstrap: resample subjects, each image weighted by its subject's multiplicity
+    subject_ids, subject_of_image = np.unique(np.asarray(subjects), return_inverse=True)
+    rng = np.random.default_rng(seed)
+    draws = rng.integers(0, len(subject_ids), size=(n_boot, len(subject_ids)))
+    counts = np.stack([np.bincount(d, minlength=len(subject_ids)) for d in draws])
+    boot = _cell_means(S, emo_idx, counts[:, subject_of_image].astype(np.float64), full_sizes)
+    se = np.nanstd(boot, axis=0, ddof=1)
+
+    # finite population correction: a fully sampled cell pair has no sampling error
+    sampled = np.array([len(a) for a in emo_idx], dtype=np.float64)
+    frac = sampled / full_sizes
+    se = se * np.sqrt(np.clip(1.0 - np.outer(frac, frac), 0.0, 1.0))
+    return mat, np.nan_to_num(se, nan=np.inf)
+
+
+# ---------------------------------------------------------
+# PROGRESSIVE SAMPLING
+# ---------------------------------------------------------
+
+def quick_look(base_path, angles, target_se=0.01, initial_per_cell=4, max_fraction=1.0,
+               n_boot=200, seed=0, embed_fn=None):
+    """
+    Returns:
+        results : {angle: (mat, labels)}     (same shape as run_pairwise_pipeline, for the PDF)
+        errors  : {angle: se matrix}
+        info    : {"rounds", "embedded", "total", "seconds", "max_se"}
+    embed_fn(path) -> raw embedding (default model.hsem.get_embedding).
+    """
+    if embed_fn is None:
+        from model.hsem import get_embedding as embed_fn
+
+    rng = np.random.default_rng(seed)
+    cells = {}          # angle -> {emotion: [(subject, path), ...] in sampling order}
+    for angle in angles:
+        angle_dir = os.path.join(base_path, angle)
+        if not os.path.isdir(angle_dir):
+            raise FileNotFoundError(f"Angle folder does not exist: {angle_dir}")
+        strata = list_strata(angle_dir)
+        cells[angle] = {e: stratified_order(strata[e], rng) for e in sorted(strata)}
+
+    total = sum(len(order) for c in cells.values() for order in c.values())
+    largest = max(len(order) for c in cells.values() for order in c.values())
+    cache = {}
+    start = time.perf_counter()
+
+    per_cell = initial_per_cell
+    rounds = 0
+    while True:
+        rounds += 1
+        results, errors = {}, {}
+        for angle, by_emotion in cells.items():
+            E, emotions, subjects = [], [], []
+            full_sizes = []
+            labels = []
+            for emotion, order in by_emotion.items():
+                limit = min(len(order), max(per_cell, 1), int(np.ceil(max_fraction * len(order))))
+                kept = 0
+                for subject, path in order[:limit]:
+                    if path not in cache:
+                        try:
+                            cache[path] = clean_embedding(embed_fn(path))
+                        except Exception:
+                            cache[path] = None
+                    if cache[path] is None:
+                        continue
+                    E.append(cache[path])
+                    emotions.append(emotion)
+                    subjects.append(subject)
+                    kept += 1
+                if kept:
+                    labels.append(emotion)
+                    full_sizes.append(len(order))
+
+            mat, se = estimate_with_se(np.vstack(E), emotions, subjects, labels, full_sizes, n_boot, seed)
+            results[angle] = (mat, labels)
+            errors[angle] = se
+
+        max_se = max(float(se.max()) for se in errors.values())
+        print(f"[INFO] Round {rounds}: <= {per_cell} images per cell, {len(cache)}/{total} embedded, "
+              f"max SE = {max_se:.4f}")
+
+        if max_se <= target_se or per_cell >= largest * max_fraction:
+            break
+        per_cell *= 2
+
+    info = {
+        "rounds": rounds,
+        "embedded": len(cache),
+        "total": total,
+        "seconds": time.perf_counter() - start,
+        "max_se": max_se,
+    }
+    if max_se > target_se:
+        print(f"[WARN] Target SE {target_se} not reached (max SE {max_se:.4f}) with the allowed sample")
+    return results, errors, info
+
+
+def print_report(results, errors, info):
+    for angle, (mat, labels) in results.items():
+        se = errors[angle]
+        print(f"\n[QUICK LOOK] {angle} (mean ± SE)")
+        print("          " + " ".join(f"{l[:13]:>15}" for l in labels))
+        for i, label in enumerate(labels):
+            print(f"{label[:9]:>9} " + " ".join(f"{mat[i, j]:7.3f} ± {se[i, j]:.3f}" for j in range(len(labels))))
+    print(f"\n[INFO] Embedded {info['embedded']}/{info['total']} images "
+          f"({info['embedded'] / max(info['total'], 1):.0%}) in {info['rounds']} rounds, "
+          f"{info['seconds']:.1f}s; max SE = {info['max_se']:.4f}")
+
+
+# ---------------------------------------------------------
+# EXECUTABLE SCRIPT
+# ---------------------------------------------------------
+
+if __name__ == "__main__":
+    from heatmap.format_heatmap import save_all_heatmaps_to_pdf
+
+    BASE = "/Users/bencarmel/Documents/TAU/LiraMic/src/dataset/kdef_by_angle"
+    ANGLES = ["front", "left", "right"]
+
+    results, errors, info = quick_look(BASE, ANGLES, target_se=0.01)
+    print_report(results, errors, info)
+
+    pdf_path = f"{BASE}/emotion_similarity_quicklook.pdf"
+    save_all_heatmaps_to_pdf(results, pdf_path)
+    print("[DONE] PDF saved at:", pdf_path)
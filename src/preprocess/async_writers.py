@@ -0,0 +1,194 @@
+"""Background writers with bounded queues, so compute never waits on disk (and disk never idles).
+
+BackgroundWriter runs write_fn(item) on worker threads fed by a bounded queue: submit() only blocks
+when max_pending items are already waiting (back-pressure instead of unbounded memory). The first
+exception raised by a worker is kept and re-raised in the producer on the next submit(), flush() or
+close(); after a failure remaining items are discarded so the producer cannot deadlock.
+
+    AsyncImageWriter   encodes (cv2.imencode) + writes crops on several threads
+    AsyncParquetWriter buffers rows into row groups and writes them on one thread; the file is
+                       written to {path}.tmp and published with an atomic rename on close()
+
+All of them are context managers; leaving the block flushes everything and propagates errors.
+"""
+import os
+import queue
+import threading
+import traceback
+
+_STOP = object()
+
+
+class BackgroundWriter:
+    """
+    writer = BackgroundWriter(write_fn, max_pending=64, workers=1)
+    writer.submit(item)     # returns immediately unless the queue is full
+    writer.flush()          # wait until everything submitted so far is written
+    writer.close()          # flush + stop the threads
+
+    With workers=1 items are written in submission order.
+    """
+
+    def __init__(self, write_fn, max_pending=64, workers=1, name="writer"):
+        self.write_fn = write_fn
+        self.name = name
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._error_lock = threading.Lock()
+        self._closed = False
+        self._threads = [threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True) for i in range(workers)]
+        for t in self._threads:
+            t.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                if self._error is None:
+                    self.write_fn(item)
+            except Exception as e:
+                with self._error_lock:
+                    if self._error is None:
+                        self._error = (e, traceback.format_exc())
+            finally:
+                self._queue.task_done()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            exc, tb = self._error
+            raise RuntimeError(f"Background {self.name} failed:\n{tb}") from exc
+
+    def submit(self, item):
+        if self._closed:
+            raise RuntimeError(f"{self.name} is closed")
+        self._raise_if_failed()
+        self._queue.put(item)
+
+    def flush(self):
+        self._queue.join()
+        self._raise_if_failed()
+
+    def close(self):
+        if self._closed:
+            self._raise_if_failed()
+            return
+        self._closed = True
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for t in self._threads:
+            t.join()
+        self._raise_if_failed()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # the body already failed: stop the threads, but don't mask the original exception
+            try:
+                self.close()
+            except RuntimeError as e:
+                print(f"[WARN] {e}")
+
+
+# ---------------------------------------------------------
+# CROPS
+# ---------------------------------------------------------
+
+class AsyncImageWriter(BackgroundWriter):
+    """write(path, image_rgb): RGB uint8 -> BGR -> encoded by extension -> path (directories created)."""
+
+    def __init__(self, max_pending=64, workers=2):
+        super().__init__(self._write, max_pending=max_pending, workers=workers, name="image writer")
+
+    @staticmethod
+    def _write(item):
+        import cv2
+        path, image_rgb = item
+        ok, buf = cv2.imencode(os.path.splitext(path)[1] or ".jpg", cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR))
+        if not ok:
+            raise ValueError(f"Cannot encode {path}")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(buf.tobytes())
+
+    def write(self, path, image_rgb):
+        self.submit((path, image_rgb))
+
+
+# ---------------------------------------------------------
+# PARQUET ROW GROUPS
+# ---------------------------------------------------------
+
+class AsyncParquetWriter(BackgroundWriter):
+    """
+    append(row_dict) buffers rows and hands every `rows_per_group` rows to the writer thread as one
+    row group; write_table(table) submits a ready table. close() writes the rest and renames
+    {path}.tmp -> path, so readers never see a partial file.
+    """
+
+    def __init__(self, path, schema, rows_per_group=256, max_pending=4):
+        import pyarrow.parquet as pq
+
+        self.path = path
+        self.schema = schema
+        self.rows_per_group = rows_per_group
+        self.rows = 0
+        self._rows = []
+        self._tmp_path = path + ".tmp"
+        self._writer = pq.ParquetWriter(self._tmp_path, schema)
+        super().__init__(self._writer.write_table, max_pending=max_pending, workers=1, name="parquet writer")
+
+    def append(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= self.rows_per_group:
+            self._submit_rows()
+
+    def _submit_rows(self):
+        import pyarrow as pa
+        if self._rows:
+            self.write_table(pa.Table.from_pylist(self._rows, schema=self.schema))
+            self._rows = []
+
+    def write_table(self, table):
+        self.rows += table.num_rows
+        self.submit(table)
+
+    def close(self):
+        if self._closed:
+            return super().close()
+        try:
+            try:
+                self._submit_rows()
+            finally:
+                super().close()     # always stop the thread
+        except BaseException:
+            self._discard()
+            raise
+        self._writer.close()
+        os.replace(self._tmp_path, self.path)
+
+    def _discard(self):
+        """Drop the partial file; the previous output at path (if any) stays untouched."""
+        try:
+            self._writer.close()
+        except Exception:
+            pass
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+            return
+        # failed body: stop the thread without writing the buffered rows, then drop the partial file
+        self._closed = True
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for t in self._threads:
+            t.join()
+        self._discard()
@@ -0,0 +1,157 @@
+# archive_reader.py
+"""Read dataset images straight out of a zip archive.
+
+iter_archive_images(zip_path) yields (member_path, RGB uint8 image) for every image member, decoding in memory
+with cv2.imdecode and reading members on a small thread pool, so the Kaggle download never has to be extracted
+into thousands of small files. iter_images(source) accepts either a zip file or a directory and yields the same
+(relative_path, image) pairs, so any image-consuming stage can take both. A directory that holds no images but
+a single zip (orig_kdef/ after a download with unzip=False) is read as that zip.
+"""
+import os
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def resolve_source(source):
+    """source itself, or the only zip archive inside a directory that contains no images."""
+    if not os.path.isdir(source):
+        return source
+
+    archives = []
+    for dirpath, dirnames, filenames in os.walk(source):
+        for fname in filenames:
+            if fname.lower().endswith(IMAGE_EXTENSIONS):
+                return source
+            if fname.lower().endswith(".zip"):
+                archives.append(os.path.join(dirpath, fname))
+
+    if len(archives) > 1:
+        raise ValueError(f"{source} holds no images but several zip archives {sorted(archives)}; pass one of them")
+    return archives[0] if archives else source
+
+
+def decode_image_bytes(data):
+    """Decode encoded image bytes to RGB uint8 (None if undecodable)."""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    img = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def list_archive_images(zip_path, prefix=""):
+    """Sorted image member names under prefix (directories and macOS metadata skipped)."""
+    with zipfile.ZipFile(zip_path) as zf:
+        names = [
+            info.filename for info in zf.infolist()
+            if not info.is_dir()
+            and info.filename.startswith(prefix)
+            and info.filename.lower().endswith(IMAGE_EXTENSIONS)
+            and "__MACOSX/" not in info.filename
+        ]
+    return sorted(names)
+
+
+def iter_archive_images(zip_path, prefix="", workers=4, chunk=64):
+    """Yield (member_path relative to prefix, RGB image or None) in sorted member order.
+
+    Each worker thread keeps its own ZipFile handle, so member reads and decodes run in
+    parallel; at most `chunk` decoded images are held in memory at a time.
+    """
+    names = list_archive_images(zip_path, prefix)
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def read(name):
+        zf = getattr(local, "zf", None)
+        if zf is None:
+            zf = local.zf = zipfile.ZipFile(zip_path)
+            with handles_lock:
+                handles.append(zf)
+        return decode_image_bytes(zf.read(name))
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for start in range(0, len(names), chunk):
+                batch = names[start:start + chunk]
+                for name, image in zip(batch, pool.map(read, batch)):
+                    yield name[len(prefix):].lstrip("/"), image
+    finally:
+        for zf in handles:
+            zf.close()
+
+
+def iter_directory_images(root):
+    """Yield (path relative to root, RGB image or None) for every image under root."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for fname in sorted(filenames):
+            if not fname.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            path = os.path.join(dirpath, fname)
+            img = cv2.imread(path)
+            image = None if img is None else cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            yield os.path.relpath(path, root), image
+
+
+def map_image_bytes(source, fn, prefix="", workers=4, chunk=256):
+    """Yield (relative_path, fn(encoded bytes), encoded size) for every image of a zip or directory.
+
+    fn runs on a thread pool (cv2 decoding releases the GIL), so cheap per-image work such as
+    hashing a reduced decode scales with `workers` without ever holding full-size images.
+    """
+    source = resolve_source(source)
+    is_zip = os.path.isfile(source) and zipfile.is_zipfile(source)
+    if is_zip:
+        names = list_archive_images(source, prefix)
+        rels = [name[len(prefix):].lstrip("/") for name in names]
+    else:
+        root = os.path.join(source, prefix) if prefix else source
+        names = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            names.extend(os.path.join(dirpath, f) for f in sorted(filenames) if f.lower().endswith(IMAGE_EXTENSIONS))
+        rels = [os.path.relpath(name, root) for name in names]
+
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def read(name):
+        if is_zip:
+            zf = getattr(local, "zf", None)
+            if zf is None:
+                zf = local.zf = zipfile.ZipFile(source)
+                with handles_lock:
+                    handles.append(zf)
+            data = zf.read(name)
+        else:
+            with open(name, "rb") as f:
+                data = f.read()
+        return fn(data), len(data)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for start in range(0, len(names), chunk):
+                batch = names[start:start + chunk]
+                for rel, (result, size) in zip(rels[start:start + chunk], pool.map(read, batch)):
+                    yield rel, result, size
+    finally:
+        for zf in handles:
+            zf.close()
+
+
+def iter_images(source, prefix="", workers=4):
+    """Yield (relative_path, RGB image) from a zip archive or a directory tree (see resolve_source)."""
+    source = resolve_source(source)
+    if os.path.isfile(source) and zipfile.is_zipfile(source):
+        yield from iter_archive_images(source, prefix=prefix, workers=workers)
+    else:
+        yield from iter_directory_images(os.path.join(source, prefix) if prefix else source)
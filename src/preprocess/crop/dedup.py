@@ -0,0 +1,292 @@
+# dedup.py
+"""Perceptual-hash deduplication of a dataset source (zip archive or directory).
+
+Every image gets a 64-bit DCT perceptual hash computed from a 1/4-scale grayscale decode on a
+thread pool. Images whose hashes differ in at most `max_distance` bits are near-duplicates
+(re-exported copies, the same frame at another JPEG quality). Candidate pairs come from a
+multi-index: the hash is split into max_distance + 1 bands, and by the pigeonhole principle two
+hashes within max_distance bits agree exactly on at least one band, so only images sharing a
+band value are compared. Within each label folder (emotion / class directory) pairs are merged
+with union-find into candidate components.
+
+Each group keeps one representative (the largest encoded file, i.e. the highest quality copy)
+and only members within max_distance bits of that representative; images only linked through a
+chain of neighbours start a new group. The crop stage skips the members (see img_preprocess,
+dedup_map=), so MTCNN, FaceMesh and the embedding model run once per group and duplicates no
+longer weigh on the emotion means.
+
+Near-duplicates filed under different labels are a labelling conflict, not a duplicate: they
+are reported separately (dedup_conflicts.csv) and never merged into one group. A conflict does
+not protect an image that is also a non-representative member of a same-label group; that image
+is still skipped as a duplicate.
+
+    build_dedup(source) -> (groups, conflicts)
+    save_dedup(groups, out_dir, conflicts=conflicts)
+        -> dedup_map.json + dedup_report.csv (+ dedup_conflicts.csv)
+    load_dedup_map(path) -> {duplicate rel path: representative rel path}
+"""
+import csv
+import json
+import os
+
+import cv2
+import numpy as np
+
+from archive_reader import map_image_bytes
+
+HASH_SIZE = 32      # DCT input size
+DEFAULT_MAX_DISTANCE = 6
+
+
+# ---------------------------------------------------------
+# PERCEPTUAL HASH
+# ---------------------------------------------------------
+
+def phash(gray):
+    """64-bit DCT hash of a grayscale image (uint64)."""
+    small = cv2.resize(gray, (HASH_SIZE, HASH_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return np.uint64(int.from_bytes(np.packbits(bits).tobytes(), "big"))
+
+
+def phash_bytes(data):
+    """phash of encoded image bytes, decoded at 1/4 scale (None if undecodable)."""
+    gray = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if gray is None:
+        return None
+    return phash(gray)
+
+
+def hash_source(source, prefix="", workers=8):
+    """
+    Returns (paths, hashes uint64 (N,), sizes int (N,)) for every decodable image of the source.
+    paths are relative, exactly as iter_images yields them.
+    """
+    paths, hashes, sizes = [], [], []
+    for rel, h, size in map_image_bytes(source, phash_bytes, prefix=prefix, workers=workers):
+        if h is None:
+            print(f"[WARN] Cannot decode {rel}")
+            continue
+        paths.append(rel)
+        hashes.append(h)
+        sizes.append(size)
+    return paths, np.array(hashes, dtype=np.uint64), np.array(sizes, dtype=np.int64)
+
+
+# ---------------------------------------------------------
+# HAMMING INDEX
+# ---------------------------------------------------------
+
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def hamming(a, b):
+    """Bitwise Hamming distance between uint64 arrays (broadcasting)."""
+    x = np.bitwise_xor(a, b)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x).astype(np.int64)
+    x = np.ascontiguousarray(x)
+    return _POPCOUNT8[x.view(np.uint8).reshape(*x.shape, 8)].sum(axis=-1).astype(np.int64)
+
+
+def _band_masks(n_bands):
+    """(shift, mask) for n_bands contiguous bit ranges covering all 64 bits."""
+    edges = np.linspace(0, 64, n_bands + 1).astype(int)
+    return [(int(lo), (1 << int(hi - lo)) - 1) for lo, hi in zip(edges[:-1], edges[1:])]
+
+
+def near_duplicate_pairs(hashes, max_distance=DEFAULT_MAX_DISTANCE):
+    """
+    All pairs (i, j), i < j, of distinct hashes within max_distance bits, plus their distances.
+    hashes must be unique (identical hashes are grouped before).
+    """
+    pairs = set()
+    for shift, mask in _band_masks(max_distance + 1):
+        keys = (hashes >> np.uint64(shift)) & np.uint64(mask)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        bounds = np.flatnonzero(np.diff(sorted_keys)) + 1
+        for run in np.split(order, bounds):
+            if len(run) < 2:
+                continue
+            a, b = np.triu_indices(len(run), k=1)
+            i, j = np.minimum(run[a], run[b]), np.maximum(run[a], run[b])
+            close = hamming(hashes[i], hashes[j]) <= max_distance
+            pairs.update(zip(i[close].tolist(), j[close].tolist()))
+
+    if not pairs:
+        return np.zeros((0, 2), dtype=np.int64), np.zeros(0, dtype=np.int64)
+    pairs = np.array(sorted(pairs), dtype=np.int64)
+    return pairs, hamming(hashes[pairs[:, 0]], hashes[pairs[:, 1]])
+
+
+# ---------------------------------------------------------
+# GROUPING
+# ---------------------------------------------------------
+
+def _union_find(n, pairs):
+    parent = np.arange(n)
+
+    def find(x):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    for i, j in pairs:
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)
+
+    return np.array([find(i) for i in range(n)])
+
+
+def label_of(path):
+    """Label folder of a relative path (the emotion / class directory the image was filed under)."""
+    return os.path.dirname(path)
+
+
+def _representative_groups(idx, paths, hashes, sizes, max_distance):
+    """
+    Splits one same-label component into groups whose members are all within max_distance of
+    the group representative (largest file first; ties: path order).
+    """
+    remaining = sorted(idx, key=lambda i: (-sizes[i], paths[i]))
+    groups = []
+    while len(remaining) > 1:
+        rep, rest = remaining[0], remaining[1:]
+        distances = hamming(hashes[rep], hashes[np.array(rest)])
+        members = [(paths[i], int(d)) for i, d in zip(rest, distances) if d <= max_distance]
+        if members:
+            groups.append({"representative": paths[rep], "members": members})
+        remaining = [i for i, d in zip(rest, distances) if d > max_distance]
+    return groups
+
+
+def _label_groups(idx, paths, hashes, sizes, max_distance):
+    """Union-find components among the images idx (one label), split by _representative_groups."""
+    unique, inverse = np.unique(hashes[idx], return_inverse=True)
+    pairs, _ = near_duplicate_pairs(unique, max_distance)
+    group_of = _union_find(len(unique), pairs)[inverse.reshape(-1)]
+
+    groups = []
+    for g in np.unique(group_of):
+        members = idx[group_of == g]
+        if len(members) > 1:
+            groups.extend(_representative_groups(members, paths, hashes, sizes, max_distance))
+    return groups
+
+
+def cross_label_pairs(paths, hashes, labels, max_distance=DEFAULT_MAX_DISTANCE):
+    """[{"paths": [a, b], "labels": [label a, label b], "distance": d}] for near-duplicates filed under different labels."""
+    unique, inverse = np.unique(hashes, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    by_hash = [[] for _ in range(len(unique))]
+    for i, u in enumerate(inverse):
+        by_hash[u].append(i)
+
+    pairs, distances = near_duplicate_pairs(unique, max_distance)
+    candidates = [(u, u, 0) for u in range(len(unique)) if len(by_hash[u]) > 1]
+    candidates += [(int(u), int(v), int(d)) for (u, v), d in zip(pairs, distances)]
+
+    conflicts = []
+    for u, v, d in candidates:
+        for i in by_hash[u]:
+            for j in by_hash[v]:
+                if (u != v or i < j) and labels[i] != labels[j]:
+                    a, b = sorted((i, j), key=lambda k: paths[k])
+                    conflicts.append({"paths": [paths[a], paths[b]], "labels": [labels[a], labels[b]], "distance": d})
+    return sorted(conflicts, key=lambda c: c["paths"])
+
+
+def group_duplicates(paths, hashes, sizes, max_distance=DEFAULT_MAX_DISTANCE, label_fn=label_of):
+    """
+    Returns (groups, conflicts):
+        groups:    [{"representative": path, "members": [(path, distance to representative), ...]}]
+                   built within each label only; members excludes the representative and are all
+                   within max_distance of it
+        conflicts: near-duplicate pairs filed under different labels (see cross_label_pairs);
+                   reported only; a pair never joins a group (either image may still be a
+                   member of a same-label group)
+    """
+    labels = [label_fn(p) for p in paths]
+    label_array = np.array(labels)
+
+    groups = []
+    for label in sorted(set(labels)):
+        idx = np.flatnonzero(label_array == label)
+        groups.extend(_label_groups(idx, paths, hashes, sizes, max_distance))
+
+    groups = sorted(groups, key=lambda g: g["representative"])
+    return groups, cross_label_pairs(paths, hashes, labels, max_distance)
+
+
+def build_dedup(source, prefix="", max_distance=DEFAULT_MAX_DISTANCE, workers=8):
+    """Hash a source and group its near-duplicates. Returns (groups, conflicts), see group_duplicates."""
+    paths, hashes, sizes = hash_source(source, prefix=prefix, workers=workers)
+    groups, conflicts = group_duplicates(paths, hashes, sizes, max_distance)
+    n_dup = sum(len(g["members"]) for g in groups)
+    print(f"[INFO] {len(paths)} images, {len(groups)} duplicate groups, {n_dup} duplicates to skip")
+    if conflicts:
+        print(f"[WARN] {len(conflicts)} near-duplicate pairs are filed under different labels; check their labels")
+    return groups, conflicts
+
+
+# ---------------------------------------------------------
+# MAP + REPORT
+# ---------------------------------------------------------
+
+def dedup_map(groups):
+    """{duplicate path: representative path}"""
+    return {path: g["representative"] for g in groups for path, _ in g["members"]}
+
+
+def save_dedup(groups, out_dir, max_distance=DEFAULT_MAX_DISTANCE, conflicts=()):
+    """
+    Writes dedup_map.json (read back by load_dedup_map) and dedup_report.csv, plus
+    dedup_conflicts.csv when there are cross-label groups; returns the map and report paths.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    map_path = os.path.join(out_dir, "dedup_map.json")
+    report_path = os.path.join(out_dir, "dedup_report.csv")
+
+    with open(map_path, "w") as f:
+        json.dump({"max_distance": max_distance, "groups": groups, "conflicts": list(conflicts)}, f, indent=2)
+
+    with open(report_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["group", "representative", "duplicate", "hamming_distance"])
+        for k, g in enumerate(groups):
+            for path, distance in g["members"]:
+                writer.writerow([k, g["representative"], path, distance])
+
+    if conflicts:
+        conflicts_path = os.path.join(out_dir, "dedup_conflicts.csv")
+        with open(conflicts_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["path_a", "label_a", "path_b", "label_b", "hamming_distance"])
+            for c in conflicts:
+                writer.writerow([c["paths"][0], c["labels"][0], c["paths"][1], c["labels"][1], c["distance"]])
+        print(f"[INFO] Saved {conflicts_path}")
+
+    print(f"[INFO] Saved {map_path} and {report_path}")
+    return map_path, report_path
+
+
+def load_dedup_map(path):
+    with open(path) as f:
+        return dedup_map(json.load(f)["groups"])
+
+
+# ---------------------------------------------------------
+# MAIN
+# ---------------------------------------------------------
+
+if __name__ == "__main__":
+    SOURCE = "/Users/bencarmel/Documents/TAU/LiraMic/src/dataset/orig_kdef"
+    OUT_DIR = "/Users/bencarmel/Documents/TAU/LiraMic/src/dataset"
+    groups, conflicts = build_dedup(SOURCE)
+    save_dedup(groups, OUT_DIR, conflicts=conflicts)
@@ -0,0 +1,113 @@
+# detection_cache.py
+"""Persistent cache of face detections, independent of the crop output.
+
+Every detection (box, probability, five-point landmarks) is stored in a compact .npz table keyed
+by the SHA-1 of the encoded image file, so a lookup needs no decode. Crops at any size, margin or alignment can then be
+regenerated from the cached boxes without running MTCNN again.
+
+The table also records a fingerprint of the detector configuration; when the configuration
+changes (different detector, threshold, reduced-resolution setting, ...) the cache is discarded
+and rebuilt.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+# part of the fingerprint: caches keyed another way are discarded instead of silently missing
+KEY_SCHEME = "sha1(encoded bytes)"
+
+
+def source_key(data):
+    """SHA-1 hex digest of an image's encoded bytes (file or zip member content)."""
+    return hashlib.sha1(data).hexdigest()
+
+
+def config_fingerprint(config):
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+class DetectionCache:
+    """Dictionary-like cache: key -> (box (4,), prob, landmarks (5, 2)); box None = no face."""
+
+    def __init__(self, path, config):
+        self.path = path
+        self.config = config
+        self.fingerprint = config_fingerprint({**config, "key": KEY_SCHEME})
+        self._records = {}
+        self._dirty = False
+
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with np.load(self.path) as data:
+            if str(data["fingerprint"]) != self.fingerprint:
+                print(f"[WARN] Detector configuration changed; discarding detection cache {self.path}")
+                self._dirty = True
+                return
+
+            for key, box, prob, lms in zip(data["keys"], data["boxes"], data["probs"], data["landmarks"]):
+                if np.isnan(prob):
+                    self._records[str(key)] = (None, None, None)
+                else:
+                    self._records[str(key)] = (box, float(prob), lms)
+
+        print(f"[INFO] Loaded {len(self._records)} cached detections from {self.path}")
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, key):
+        return key in self._records
+
+    def get(self, key):
+        return self._records.get(key)
+
+    def put(self, key, box, prob, landmarks):
+        if box is None:
+            self._records[key] = (None, None, None)
+        else:
+            self._records[key] = (
+                np.asarray(box, dtype=np.float32),
+                float(prob),
+                np.asarray(landmarks, dtype=np.float32).reshape(5, 2),
+            )
+        self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+
+        n = len(self._records)
+        keys = np.array(list(self._records.keys()), dtype="U40")
+        boxes = np.full((n, 4), np.nan, dtype=np.float32)
+        probs = np.full(n, np.nan, dtype=np.float32)
+        landmarks = np.full((n, 5, 2), np.nan, dtype=np.float32)
+
+        for i, (box, prob, lms) in enumerate(self._records.values()):
+            if box is not None:
+                boxes[i], probs[i], landmarks[i] = box, prob, lms
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            keys=keys,
+            boxes=boxes,
+            probs=probs,
+            landmarks=landmarks,
+            fingerprint=np.array(self.fingerprint),
+            config=np.array(json.dumps(self.config, sort_keys=True)),
+        )
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+        print(f"[INFO] Saved {n} detections to {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.save()
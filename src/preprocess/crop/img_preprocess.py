@@ -1,12 +1,43 @@
 # img_preprocess.py
 import os
-from facenet_pytorch import MTCNN
+import sys
 import cv2
 from PIL import Image
 import numpy as np
+from archive_reader import iter_images, map_image_bytes, decode_image_bytes
+from shards import ShardWriter, parse_subject_emotion
+from detection_cache import DetectionCache, source_key
+from async_writers import AsyncImageWriter
 
-# global detector instance
-mtcnn = MTCNN(keep_all=False, device='cpu')
+# global detector instance, created on first use (importing this module stays cheap)
+mtcnn = None
+
+def _apply_tuned_threads():
+    """Torch thread count from the autotuner (src/model/autotune.py), if this host was calibrated."""
+    src_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    if src_dir not in sys.path:
+        sys.path.append(src_dir)
+    from model.autotune import apply_tuned_threads
+    apply_tuned_threads("detect", "mtcnn")
+
+def get_detector():
+    """Return the shared MTCNN detector, loading facenet-pytorch on first call."""
+    global mtcnn
+    if mtcnn is None:
+        from facenet_pytorch import MTCNN
+        mtcnn = MTCNN(keep_all=False, device='cpu')
+        _apply_tuned_threads()
+    return mtcnn
+
+# fast path: detect on a copy whose shorter side is still >= this many pixels
+DETECT_MIN_SIDE = 160
+
+# JPEG DCT-domain reduced decoding (1/2, 1/4, 1/8 of the full resolution)
+_REDUCED_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+}
 
 def load_image(image_path):
     """Load image as RGB uint8."""
@@ -15,32 +46,122 @@ def load_image(image_path):
         return None
     return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
 
-def detect_and_crop_face(image):
-    """Detect the largest face and return the cropped region as RGB uint8."""
-    if isinstance(image, str):
-        image = load_image(image)
-        if image is None:
-            return None
+def _reduction_factor(h, w, min_side=DETECT_MIN_SIDE):
+    """Largest of 8/4/2 that keeps the shorter side >= min_side (1 = no reduction)."""
+    for factor in (8, 4, 2):
+        if min(h, w) // factor >= min_side:
+            return factor
+    return 1
 
+def load_image_for_detection(image_path, min_side=DETECT_MIN_SIDE):
+    """Load (full_rgb, reduced_rgb) from one read of the file.
+
+    The reduced copy is decoded directly at 1/2, 1/4 or 1/8 scale (JPEG DCT scaling),
+    so it costs a fraction of a full decode. Returns (None, None) if unreadable.
+    """
     try:
-        pil_img = Image.fromarray(image)
-        boxes, probs = mtcnn.detect(pil_img)
+        with open(image_path, "rb") as f:
+            buf = np.frombuffer(f.read(), dtype=np.uint8)
+    except OSError:
+        return None, None
+
+    full = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+    if full is None:
+        return None, None
+
+    factor = _reduction_factor(*full.shape[:2], min_side=min_side)
+    reduced = full if factor == 1 else cv2.imdecode(buf, _REDUCED_FLAGS[factor])
+    return cv2.cvtColor(full, cv2.COLOR_BGR2RGB), cv2.cvtColor(reduced, cv2.COLOR_BGR2RGB)
+
+def reduce_for_detection(image, min_side=DETECT_MIN_SIDE):
+    """Downscaled copy of an already decoded RGB image for the detector."""
+    h, w = image.shape[:2]
+    factor = _reduction_factor(h, w, min_side=min_side)
+    if factor == 1:
+        return image
+    return cv2.resize(image, (w // factor, h // factor), interpolation=cv2.INTER_AREA)
+
+def detect_face(image, detect_image=None, raise_errors=False):
+    """Run MTCNN and return (box, prob, landmarks) of the largest face in image coordinates.
+
+    box is float (4,), landmarks float (5, 2) (eyes, nose, mouth corners); all three are
+    None if no face passes the 0.9 probability threshold.
+    If detect_image (a downscaled copy of image) is given, MTCNN runs on it and the
+    results are rescaled to image's resolution.
+    Detector errors are printed and reported as "no face" unless raise_errors=True.
+    """
+    if detect_image is None:
+        detect_image = image
+
+    detector = get_detector()
+    try:
+        pil_img = Image.fromarray(detect_image)
+        boxes, probs, points = detector.detect(pil_img, landmarks=True)
     except Exception as e:
+        if raise_errors:
+            raise
         print("Detection error:", e)
-        return None
+        return None, None, None
 
     if boxes is None or len(boxes) == 0 or probs[0] < 0.9:
-        return None
+        return None, None, None
+
+    box, landmarks = boxes[0], points[0]
+    if detect_image is not image:
+        sx = image.shape[1] / detect_image.shape[1]
+        sy = image.shape[0] / detect_image.shape[0]
+        box = box * np.array([sx, sy, sx, sy])
+        landmarks = landmarks * np.array([sx, sy])
+
+    return box, float(probs[0]), landmarks
 
-    x1, y1, x2, y2 = boxes[0].astype(int)
+def _clip_box(box, shape):
+    x1, y1, x2, y2 = np.asarray(box).astype(int)
 
     # bounds check
-    h, w = image.shape[:2]
+    h, w = shape[:2]
     x1, y1 = max(0, x1), max(0, y1)
     x2, y2 = min(w, x2), min(h, y2)
 
-    face = image[y1:y2, x1:x2]
-    return face  # RGB uint8
+    return x1, y1, x2, y2
+
+def detect_face_box(image, detect_image=None):
+    """Detect the largest face in an RGB uint8 image.
+
+    If detect_image (a downscaled copy of image) is given, MTCNN runs on it and the box
+    is rescaled to image's resolution.
+    Returns the bounds-checked integer box (x1, y1, x2, y2), or None.
+    """
+    box, _, _ = detect_face(image, detect_image)
+    if box is None:
+        return None
+    return _clip_box(box, image.shape)
+
+def detect_and_crop_face(image, return_box=False, fast=False):
+    """Detect the largest face and return the cropped region as RGB uint8.
+
+    With return_box=True returns (face, box) instead.
+    With fast=True detection runs on a reduced-resolution copy (see DETECT_MIN_SIDE) and
+    the face is still cropped from the full-resolution image.
+    """
+    detect_image = None
+    if isinstance(image, str):
+        if fast:
+            image, detect_image = load_image_for_detection(image)
+        else:
+            image = load_image(image)
+        if image is None:
+            return (None, None) if return_box else None
+    elif fast:
+        detect_image = reduce_for_detection(image)
+
+    box = detect_face_box(image, detect_image)
+    if box is None:
+        return (None, None) if return_box else None
+
+    x1, y1, x2, y2 = box
+    face = image[y1:y2, x1:x2]  # RGB uint8
+    return (face, box) if return_box else face
 
 def process_dataset(input_dir, output_dir, dim=(224, 224)):
     """Process a flat directory of images and write outputs into output_dir.
@@ -66,33 +187,281 @@ def process_dataset(input_dir, output_dir, dim=(224, 224)):
         print(f"✔ Processed: {fname}")
 
 
-def process_dataset_tree(input_root, output_root, dim=(224, 224)):
+def process_dataset_tree(input_root, output_root, dim=(224, 224), shard_dir=None, fast=False):
     """Walk input_root recursively and process images while preserving
     the relative subdirectory structure under output_root.
 
     - input_root: directory containing class/category subfolders with images
     - output_root: destination root; subfolders will be created to mirror input
     - dim: output image size (w, h)
+    - shard_dir: if given, crops are packed into one memory-mapped shard there
+      (see preprocess/shards.py) instead of written as individual JPEGs
+    - fast: detect on a reduced-resolution decode, crop from full resolution
     """
-    for dirpath, dirnames, filenames in os.walk(input_root):
-        # Compute relative path from the input root to current folder
-        rel = os.path.relpath(dirpath, input_root)
-        # Determine corresponding output directory
-        out_dir = os.path.join(output_root, rel) if rel != "." else output_root
-        os.makedirs(out_dir, exist_ok=True)
-
-        # Process supported image files in this folder
-        for fname in filenames:
-            if not fname.lower().endswith((".jpg", ".jpeg", ".png")):
+    if shard_dir is not None:
+        with ShardWriter(shard_dir, dim) as writer:
+            _crop_into_shard(iter_images(input_root), writer, dim, input_root, fast=fast)
+        return
+
+    # crops are encoded + written on background threads while the next image is detected
+    with AsyncImageWriter() as writer:
+        for dirpath, dirnames, filenames in os.walk(input_root):
+            # Compute relative path from the input root to current folder
+            rel = os.path.relpath(dirpath, input_root)
+            # Determine corresponding output directory
+            out_dir = os.path.join(output_root, rel) if rel != "." else output_root
+            os.makedirs(out_dir, exist_ok=True)
+
+            # Process supported image files in this folder
+            for fname in filenames:
+                if not fname.lower().endswith((".jpg", ".jpeg", ".png")):
+                    continue
+                in_path = os.path.join(dirpath, fname)
+                face = detect_and_crop_face(in_path, fast=fast)
+                if face is None:
+                    print(f"❌ No face detected in {os.path.join(rel, fname)}")
+                    continue
+
+                resized = cv2.resize(face, dim)
+                out_path = os.path.join(out_dir, fname)
+                writer.write(out_path, resized)
+                print(f"✔ Processed: {os.path.join(rel, fname)} -> {os.path.relpath(out_path, output_root)}")
+
+
+def _skip_duplicates(images, dedup_map):
+    """Drop (rel, image) pairs that are near-duplicates of another image (see dedup.py)."""
+    skipped = 0
+    for rel, image in images:
+        if dedup_map and rel in dedup_map:
+            skipped += 1
+            continue
+        yield rel, image
+    if skipped:
+        print(f"[INFO] Skipped {skipped} near-duplicate images")
+
+
+def _crop_into_shard(images, writer, dim, source, fast=False):
+    """Detect + crop (rel, image) pairs and append the resized crops to a ShardWriter. Returns the crop count."""
+    n = 0
+    for rel, image in images:
+        if image is None:
+            print(f"❌ Cannot decode {rel}")
+            continue
+
+        face, box = detect_and_crop_face(image, return_box=True, fast=fast)
+        if face is None:
+            print(f"❌ No face detected in {rel}")
+            continue
+
+        subject_id, emotion = parse_subject_emotion(rel)
+        idx = writer.append(cv2.resize(face, dim), os.path.join(source, rel), box, subject_id, emotion)
+        print(f"✔ Processed: {rel} -> shard[{idx}]")
+        n += 1
+    return n
+
+
+def process_dataset_source(source, output_root, dim=(224, 224), prefix="", workers=4, shard_dir=None, fast=False,
+                           dedup_map=None):
+    """Like process_dataset_tree, but reads from a zip archive or a directory.
+
+    With a zip (e.g. the Kaggle download kept compressed) images are decoded in memory
+    straight from the archive members; the member subdirectory layout is mirrored
+    under output_root (or crops are packed into shard_dir when given).
+    dedup_map ({duplicate rel: representative rel}, see dedup.load_dedup_map) skips
+    near-duplicates so only one image per group is detected, cropped and passed on.
+    Returns the number of crops written.
+    """
+    images = _skip_duplicates(iter_images(source, prefix=prefix, workers=workers), dedup_map)
+
+    if shard_dir is not None:
+        with ShardWriter(shard_dir, dim) as writer:
+            return _crop_into_shard(images, writer, dim, source, fast=fast)
+
+    n = 0
+    with AsyncImageWriter() as writer:
+        for rel, image in images:
+            if image is None:
+                print(f"❌ Cannot decode {rel}")
                 continue
-            in_path = os.path.join(dirpath, fname)
-            face = detect_and_crop_face(in_path)
+
+            face = detect_and_crop_face(image, fast=fast)
             if face is None:
-                print(f"❌ No face detected in {os.path.join(rel, fname)}")
+                print(f"❌ No face detected in {rel}")
                 continue
 
-            resized = cv2.resize(face, dim)
-            out_path = os.path.join(out_dir, fname)
-            cv2.imwrite(out_path, cv2.cvtColor(resized, cv2.COLOR_RGB2BGR))
-            print(f"✔ Processed: {os.path.join(rel, fname)} -> {os.path.relpath(out_path, output_root)}")
+            out_path = os.path.join(output_root, rel)
+            writer.write(out_path, cv2.resize(face, dim))
+            print(f"✔ Processed: {rel} -> {os.path.relpath(out_path, output_root)}")
+            n += 1
+    return n
+
+
+def detector_config(fast=False, min_side=DETECT_MIN_SIDE):
+    """Everything that changes detection results; used to invalidate the detection cache."""
+    return {
+        "detector": "facenet_pytorch.MTCNN",
+        "keep_all": False,
+        "prob_threshold": 0.9,
+        "fast": fast,
+        "min_side": min_side if fast else None,
+    }
+
+
+def crop_from_detection(image, box, landmarks=None, dim=(224, 224), margin=0.0, align=False):
+    """Crop + resize a face from a (cached) detection.
+
+    - margin: fraction of the box size added on every side (0.1 = 10% larger box)
+    - align: rotate around the eye midpoint so the eyes are horizontal before cropping
+      (needs landmarks)
+    """
+    box = np.asarray(box, dtype=np.float64)
+
+    if align and landmarks is not None:
+        left_eye, right_eye = np.asarray(landmarks[0]), np.asarray(landmarks[1])
+        dy, dx = right_eye[1] - left_eye[1], right_eye[0] - left_eye[0]
+        angle = np.degrees(np.arctan2(dy, dx))
+        center = (float((left_eye[0] + right_eye[0]) / 2), float((left_eye[1] + right_eye[1]) / 2))
+        M = cv2.getRotationMatrix2D(center, angle, 1.0)
+        image = cv2.warpAffine(image, M, (image.shape[1], image.shape[0]), flags=cv2.INTER_LINEAR,
+                               borderMode=cv2.BORDER_REPLICATE)
+
+        # the box rotates with the face: keep its size, move it with its center
+        cx, cy = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+        ncx, ncy = M @ np.array([cx, cy, 1.0])
+        box = box + np.array([ncx - cx, ncy - cy, ncx - cx, ncy - cy])
+
+    if margin:
+        bw, bh = box[2] - box[0], box[3] - box[1]
+        box = box + np.array([-bw, -bh, bw, bh]) * margin
+
+    x1, y1, x2, y2 = _clip_box(box, image.shape)
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return cv2.resize(image[y1:y2, x1:x2], dim)
+
+
+def process_dataset_cached(source, output_root, cache_path, dim=(224, 224), margin=0.0, align=False,
+                           fast=False, prefix="", workers=4, shard_dir=None, dedup_map=None):
+    """Crop stage backed by a detection cache.
+
+    MTCNN only runs for images whose file hash (SHA-1 of the encoded bytes) is not in the
+    cache (or after the detector configuration changed); everything else is cropped from the
+    cached box and landmarks, so changing dim / margin / align needs no model run, and cached
+    "no face" images are not even decoded. Detector errors are never cached.
+    dedup_map skips near-duplicates as in process_dataset_source.
+    """
+    cache = DetectionCache(cache_path, detector_config(fast))
+    hits = misses = failures = 0
+
+    def read(data):
+        # reader thread: key from the encoded bytes; decode only if the image is detected or cropped
+        key = source_key(data)
+        record = cache.get(key)
+        no_face = record is not None and record[0] is None
+        return key, record, None if no_face else decode_image_bytes(data)
+
+    entries = ((rel, entry) for rel, entry, _ in map_image_bytes(source, read, prefix=prefix, workers=workers))
+    sink = ShardWriter(shard_dir, dim) if shard_dir is not None else AsyncImageWriter()
+
+    try:
+        with sink as writer:
+            for rel, (key, record, image) in _skip_duplicates(entries, dedup_map):
+                if record is not None and record[0] is None:
+                    hits += 1
+                    print(f"❌ No face detected in {rel}")
+                    continue
+                if image is None:
+                    print(f"❌ Cannot decode {rel}")
+                    continue
+
+                if record is None:
+                    misses += 1
+                    detect_image = reduce_for_detection(image) if fast else None
+                    try:
+                        box, prob, landmarks = detect_face(image, detect_image, raise_errors=True)
+                    except Exception as e:
+                        # not cached: a transient detector failure is retried on the next run
+                        failures += 1
+                        print(f"❌ Detection error in {rel}: {e}")
+                        continue
+                    cache.put(key, box, prob, landmarks)
+                else:
+                    hits += 1
+                    box, prob, landmarks = record
+
+                if box is None:
+                    print(f"❌ No face detected in {rel}")
+                    continue
+
+                crop = crop_from_detection(image, box, landmarks, dim=dim, margin=margin, align=align)
+                if crop is None:
+                    print(f"❌ Empty crop for {rel}")
+                    continue
+
+                if shard_dir is not None:
+                    subject_id, emotion = parse_subject_emotion(rel)
+                    writer.append(crop, os.path.join(source, rel), _clip_box(box, image.shape), subject_id, emotion)
+                else:
+                    writer.write(os.path.join(output_root, rel), crop)
+                print(f"✔ Processed: {rel}")
+    finally:
+        cache.save()
+
+    if failures:
+        print(f"[WARN] {failures} detector errors (not cached, retried on the next run)")
+    print(f"[INFO] Detection cache: {hits} hits, {misses} misses")
+
+
+def _box_iou(a, b):
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def validate_fast_detection(image_paths, min_side=DETECT_MIN_SIDE, iou_threshold=0.8):
+    """Compare reduced-resolution detection against the full-resolution path.
+
+    Returns a dict with mean IoU of the boxes, how many images disagree (face found by
+    only one path, or IoU below iou_threshold) and the time spent in each path.
+    """
+    import time
+
+    ious, disagreements = [], []
+    t_full = t_fast = 0.0
+
+    for path in image_paths:
+        start = time.perf_counter()
+        image = load_image(path)
+        box_full = None if image is None else detect_face_box(image)
+        t_full += time.perf_counter() - start
+
+        start = time.perf_counter()
+        full, reduced = load_image_for_detection(path, min_side=min_side)
+        box_fast = None if full is None else detect_face_box(full, reduced)
+        t_fast += time.perf_counter() - start
+
+        if box_full is None and box_fast is None:
+            continue
+        if box_full is None or box_fast is None:
+            disagreements.append(path)
+            continue
+
+        iou = _box_iou(box_full, box_fast)
+        ious.append(iou)
+        if iou < iou_threshold:
+            disagreements.append(path)
 
+    report = {
+        "images": len(image_paths),
+        "mean_iou": float(np.mean(ious)) if ious else None,
+        "min_iou": float(np.min(ious)) if ious else None,
+        "disagreements": disagreements,
+        "seconds_full": t_full,
+        "seconds_fast": t_fast,
+        "speedup": t_full / t_fast if t_fast > 0 else None,
+    }
+    print(f"[INFO] Fast detection: mean IoU {report['mean_iou']}, "
+          f"{len(disagreements)}/{len(image_paths)} disagreements, speedup {report['speedup']}")
+    return report
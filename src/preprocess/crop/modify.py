@@ -9,11 +9,18 @@ SRC_DIR = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
 if SRC_DIR not in sys.path:
 	sys.path.append(SRC_DIR)
 
-from img_preprocess import process_dataset_tree
+from img_preprocess import process_dataset_tree, process_dataset_source
 
 input_directory = '../dataset/orig_kdef/'
+input_archive = '../dataset/orig_kdef/kdef-database.zip'
 output_directory = '../dataset/processed_kdef/'
+# Set to a directory to pack all crops into one memory-mapped shard instead of per-image JPEGs
+shard_directory = None
 
-# Process entire tree and keep subdirectories organized
-process_dataset_tree(input_directory, output_directory, dim=(224, 224))
+if os.path.exists(input_archive):
+	# Read images straight out of the downloaded archive (no extraction)
+	process_dataset_source(input_archive, output_directory, dim=(224, 224), shard_dir=shard_directory)
+else:
+	# Process entire tree and keep subdirectories organized
+	process_dataset_tree(input_directory, output_directory, dim=(224, 224), shard_dir=shard_directory)
 
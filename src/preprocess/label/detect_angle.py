@@ -1,8 +1,15 @@
 import cv2
 import mediapipe as mp
 import os
+import sys
 from collections import defaultdict
 import numpy as np
+import pandas as pd
+
+# Make preprocess/ importable for the shard reader
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shards import open_shard, update_shard_metadata
+
 mp_face_mesh = mp.solutions.face_mesh
 
 # --- Estimate angle from landmarks ---
@@ -56,6 +63,10 @@ def get_face_angle(image_path, face_mesh):
         raise ValueError(f"Cannot read image: {image_path}")
 
     rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return get_face_angle_rgb(rgb, face_mesh)
+
+def get_face_angle_rgb(rgb, face_mesh):
+    """Same as get_face_angle for an already decoded RGB uint8 image."""
     results = face_mesh.process(rgb)
 
     if not results.multi_face_landmarks:
@@ -85,6 +96,26 @@ def process_image_directory(input_dir):
 
     return angle_results
 
+# --- Label every crop of a packed shard (no per-file reads) ---
+def label_angles_in_shard(shard_dir):
+    """Adds an angle_label column (0/1/2, None if no face) to the shard metadata."""
+    images, meta = open_shard(shard_dir)
+    labels = []
+
+    with mp_face_mesh.FaceMesh(
+        static_image_mode=True,
+        max_num_faces=1,
+        refine_landmarks=True,
+        min_detection_confidence=0.5,
+    ) as face_mesh:
+
+        for i in range(len(images)):
+            labels.append(get_face_angle_rgb(images[i], face_mesh))
+
+    meta = update_shard_metadata(shard_dir, angle_label=pd.array(labels, dtype="Int64"))
+    print(f"Angle labels added to {shard_dir} ({sum(l is not None for l in labels)}/{len(labels)} labelled)")
+    return meta
+
 # --- Save output to CSV with summary ---
 def label_angles_in_directory(input_dir, output_file):
     """Process images, write angle labels, and append summary of subjects missing 0-1-2."""
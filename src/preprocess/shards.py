@@ -0,0 +1,128 @@
+# shards.py
+"""Packed crop shards: all face crops of a run in one memory-mapped uint8 array.
+
+A shard directory holds
+    crops.u8      raw uint8 pixels, N x H x W x 3 (RGB), appended crop by crop
+    meta.parquet  one row per crop: subject_id, emotion, source_path, box (x1, y1, x2, y2), ...
+    shard.json    count + image shape; written last, so its presence marks a complete shard
+
+The crop stage writes shards with ShardWriter instead of one JPEG per crop; later stages call
+open_shard(shard_dir) and read crops zero-copy from the memmap (no per-file syscalls, no JPEG
+decode and no re-encoding loss).
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+DATA_FILE = "crops.u8"
+META_FILE = "meta.parquet"
+HEADER_FILE = "shard.json"
+
+
+def parse_subject_emotion(rel_path):
+    """Repo convention: emotion = parent folder name, subject = numeric filename prefix."""
+    parent = os.path.basename(os.path.dirname(rel_path))
+    fname = os.path.basename(rel_path)
+    try:
+        subject_id = int(fname.split("_")[0])
+    except ValueError:
+        subject_id = None
+    return subject_id, parent
+
+
+class ShardWriter:
+    """Appends fixed-size RGB crops to a shard directory. Use as a context manager."""
+
+    def __init__(self, shard_dir, dim=(224, 224)):
+        self.shard_dir = shard_dir
+        self.width, self.height = dim
+        os.makedirs(shard_dir, exist_ok=True)
+
+        # a new writer always starts a fresh shard
+        header = os.path.join(shard_dir, HEADER_FILE)
+        if os.path.exists(header):
+            os.remove(header)
+
+        self._data = open(os.path.join(shard_dir, DATA_FILE), "wb")
+        self._rows = []
+
+    def append(self, crop, source_path, box, subject_id=None, emotion=None):
+        """crop: RGB uint8 (H, W, 3) already resized to dim. Returns the crop index."""
+        crop = np.ascontiguousarray(crop, dtype=np.uint8)
+        if crop.shape != (self.height, self.width, 3):
+            raise ValueError(f"Crop shape {crop.shape} does not match shard shape {(self.height, self.width, 3)}")
+
+        self._data.write(crop.tobytes())
+        x1, y1, x2, y2 = (int(v) for v in box)
+        self._rows.append({
+            "subject_id": subject_id,
+            "emotion": emotion,
+            "source_path": source_path,
+            "x1": x1, "y1": y1, "x2": x2, "y2": y2,
+        })
+        return len(self._rows) - 1
+
+    def close(self):
+        self._data.close()
+
+        meta = pd.DataFrame(self._rows, columns=["subject_id", "emotion", "source_path", "x1", "y1", "x2", "y2"])
+        meta["subject_id"] = meta["subject_id"].astype("Int64")
+        meta.to_parquet(os.path.join(self.shard_dir, META_FILE), index=False)
+
+        _write_json_atomic(os.path.join(self.shard_dir, HEADER_FILE), {
+            "count": len(self._rows),
+            "height": self.height,
+            "width": self.width,
+            "channels": 3,
+            "dtype": "uint8",
+        })
+        print(f"[INFO] Shard written: {self.shard_dir} ({len(self._rows)} crops)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._data.close()
+
+
+def _write_json_atomic(path, obj):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def is_shard(path):
+    return os.path.isfile(os.path.join(path, HEADER_FILE))
+
+
+def open_shard(shard_dir):
+    """Returns (images, meta): read-only memmap (N, H, W, 3) uint8 and the metadata DataFrame."""
+    with open(os.path.join(shard_dir, HEADER_FILE)) as f:
+        header = json.load(f)
+
+    shape = (header["count"], header["height"], header["width"], header["channels"])
+    if header["count"] == 0:
+        images = np.zeros(shape, dtype=np.uint8)
+    else:
+        images = np.memmap(os.path.join(shard_dir, DATA_FILE), dtype=np.uint8, mode="r", shape=shape)
+
+    meta = pd.read_parquet(os.path.join(shard_dir, META_FILE))
+    return images, meta
+
+
+def update_shard_metadata(shard_dir, **columns):
+    """Adds/replaces per-crop columns (e.g. angle_label) in the shard metadata."""
+    path = os.path.join(shard_dir, META_FILE)
+    meta = pd.read_parquet(path)
+    for name, values in columns.items():
+        meta[name] = values
+    tmp_path = path + ".tmp"
+    meta.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return meta
@@ -0,0 +1,370 @@
+"""Approximate nearest-neighbor index (IVF) over stored face embeddings.
+
+IVFIndex partitions normalized embeddings into n_lists inverted lists around k-means centroids. A query is compared
+with the centroids, then only with the vectors of its nprobe closest lists, instead of with every stored embedding
+(the full E_norm @ E_norm.T used elsewhere).
+
+Supports incremental add(), filtered search by angle and/or emotion, batched queries, and save()/load() to a
+single .npz file. build_index_from_parquets(base_dir, angles) indexes the {angle}_embeddings.parquet files, and
+benchmark(index, Q) reports recall@k and per-query latency against exact search.
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+# Make src importable
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from similarity.kmeans import kmeans
+from similarity.utils import normalize_embeddings
+
+
+class IVFIndex:
+    """
+    Inverted-file index with cosine similarity.
+
+    Every stored vector gets an integer id (insertion order); metadata (angle, emotion,
+    subject_id, image_path) is kept per id and returned by metadata(ids).
+    """
+
+    def __init__(self, centroids):
+        self.centroids = normalize_embeddings(np.asarray(centroids, dtype=np.float32)).astype(np.float32)
+        n_lists = self.centroids.shape[0]
+
+        # per list: chunks appended by add(), consolidated lazily before searching
+        self._chunks = [[] for _ in range(n_lists)]
+        self._lists = [None] * n_lists
+        self._dirty = set(range(n_lists))
+
+        self.angles = []
+        self.emotions = []
+        self.subject_ids = []
+        self.image_paths = []
+        self._angle_codes = {}
+        self._emotion_codes = {}
+
+    # ---------------------------------------------------------
+    # BUILD
+    # ---------------------------------------------------------
+
+    @classmethod
+    def train(cls, E, n_lists=None, seed=0):
+        """
+        Fits the coarse quantizer on a sample of embeddings (N, D).
+        n_lists defaults to ~4 * sqrt(N).
+        """
+        E = normalize_embeddings(np.asarray(E, dtype=np.float32))
+        if n_lists is None:
+            n_lists = max(1, int(4 * np.sqrt(E.shape[0])))
+        centroids, _ = kmeans(E, n_lists, n_iter=15, seed=seed)
+        return cls(centroids)
+
+    @property
+    def size(self):
+        return len(self.angles)
+
+    def _code(self, table, value):
+        if value not in table:
+            table[value] = len(table)
+        return table[value]
+
+    def add(self, E, angles, emotions, subject_ids=None, image_paths=None):
+        """
+        Inserts embeddings (N, D) with their metadata. Returns the assigned ids.
+        """
+        E = normalize_embeddings(np.asarray(E, dtype=np.float32)).astype(np.float32)
+        n = E.shape[0]
+        subject_ids = [None] * n if subject_ids is None else list(subject_ids)
+        image_paths = [""] * n if image_paths is None else list(image_paths)
+
+        ids = np.arange(self.size, self.size + n, dtype=np.int64)
+        angle_codes = np.array([self._code(self._angle_codes, a) for a in angles], dtype=np.int16)
+        emotion_codes = np.array([self._code(self._emotion_codes, e) for e in emotions], dtype=np.int16)
+
+        self.angles.extend(angles)
+        self.emotions.extend(emotions)
+        self.subject_ids.extend(subject_ids)
+        self.image_paths.extend(image_paths)
+
+        lists = (E @ self.centroids.T).argmax(axis=1)
+        for l in np.unique(lists):
+            sel = lists == l
+            self._chunks[l].append((E[sel], ids[sel], angle_codes[sel], emotion_codes[sel]))
+            self._dirty.add(int(l))
+
+        return ids
+
+    def _consolidate(self):
+        for l in self._dirty:
+            chunks = self._chunks[l]
+            if len(chunks) == 0:
+                dim = self.centroids.shape[1]
+                self._lists[l] = (np.zeros((0, dim), np.float32), np.zeros(0, np.int64),
+                                  np.zeros(0, np.int16), np.zeros(0, np.int16))
+            else:
+                merged = tuple(np.concatenate(parts) for parts in zip(*chunks))
+                self._chunks[l] = [merged]
+                self._lists[l] = merged
+        self._dirty = set()
+
+    # ---------------------------------------------------------
+    # SEARCH
+    # ---------------------------------------------------------
+
+    def _filter_codes(self, angle, emotion):
+        # unknown filter values can never match
+        a = None if angle is None else self._angle_codes.get(angle, -1)
+        e = None if emotion is None else self._emotion_codes.get(emotion, -1)
+        return a, e
+
+    def search(self, Q, k=10, nprobe=8, angle=None, emotion=None):
+        """
+        Q: (nQ, D) or (D,) queries
+        Returns:
+            ids  : (nQ, k) int64, -1 where fewer than k candidates matched
+            sims : (nQ, k) float32 cosine similarity, -inf for missing entries
+        """
+        if self._dirty:
+            self._consolidate()
+
+        Q = normalize_embeddings(np.atleast_2d(np.asarray(Q, dtype=np.float32))).astype(np.float32)
+        nprobe = min(nprobe, len(self._lists))
+        a_code, e_code = self._filter_codes(angle, emotion)
+
+        probes = np.argpartition(-(Q @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+
+        out_ids = np.full((Q.shape[0], k), -1, dtype=np.int64)
+        out_sims = np.full((Q.shape[0], k), -np.inf, dtype=np.float32)
+
+        for qi in range(Q.shape[0]):
+            parts = [self._lists[l] for l in probes[qi]]
+            V = np.concatenate([p[0] for p in parts])
+            ids = np.concatenate([p[1] for p in parts])
+
+            if a_code is not None or e_code is not None:
+                mask = np.ones(len(ids), dtype=bool)
+                if a_code is not None:
+                    mask &= np.concatenate([p[2] for p in parts]) == a_code
+                if e_code is not None:
+                    mask &= np.concatenate([p[3] for p in parts]) == e_code
+                V, ids = V[mask], ids[mask]
+
+            if len(ids) == 0:
+                continue
+
+            sims = V @ Q[qi]
+            top = _top_k(sims, k)
+            out_ids[qi, :len(top)] = ids[top]
+            out_sims[qi, :len(top)] = sims[top]
+
+        return out_ids, out_sims
+
+    def exact_search(self, Q, k=10, angle=None, emotion=None):
+        """
+        Brute-force search over every stored vector (reference for recall).
+        """
+        if self._dirty:
+            self._consolidate()
+
+        Q = normalize_embeddings(np.atleast_2d(np.asarray(Q, dtype=np.float32))).astype(np.float32)
+        V, ids, a_codes, e_codes = (np.concatenate(p) for p in zip(*self._lists))
+
+        a_code, e_code = self._filter_codes(angle, emotion)
+        mask = np.ones(len(ids), dtype=bool)
+        if a_code is not None:
+            mask &= a_codes == a_code
+        if e_code is not None:
+            mask &= e_codes == e_code
+        V, ids = V[mask], ids[mask]
+
+        out_ids = np.full((Q.shape[0], k), -1, dtype=np.int64)
+        out_sims = np.full((Q.shape[0], k), -np.inf, dtype=np.float32)
+        if len(ids) == 0:
+            return out_ids, out_sims
+
+        S = Q @ V.T
+        for qi in range(Q.shape[0]):
+            top = _top_k(S[qi], k)
+            out_ids[qi, :len(top)] = ids[top]
+            out_sims[qi, :len(top)] = S[qi, top]
+        return out_ids, out_sims
+
+    def vectors(self):
+        """
+        All stored (normalized) vectors, shape (size, D), in id order.
+        """
+        if self._dirty:
+            self._consolidate()
+
+        V_lists, ids, _, _ = (np.concatenate(p) for p in zip(*self._lists))
+        V = np.empty_like(V_lists)
+        V[ids] = V_lists
+        return V
+
+    def metadata(self, ids):
+        """
+        Returns a list of dicts (angle, emotion, subject_id, image_path) for the given ids; -1 gives None.
+        """
+        return [
+            None if i < 0 else {
+                "angle": self.angles[i],
+                "emotion": self.emotions[i],
+                "subject_id": self.subject_ids[i],
+                "image_path": self.image_paths[i],
+            }
+            for i in np.asarray(ids).ravel()
+        ]
+
+    # ---------------------------------------------------------
+    # PERSISTENCE
+    # ---------------------------------------------------------
+
+    def save(self, path):
+        """
+        Writes the whole index (centroids, lists, metadata) to one .npz file.
+        """
+        if self._dirty:
+            self._consolidate()
+
+        sizes = np.array([len(p[1]) for p in self._lists], dtype=np.int64)
+        V, ids, _, _ = (np.concatenate(p) for p in zip(*self._lists))
+        subjects = np.array([-1 if s is None else int(s) for s in self.subject_ids], dtype=np.int64)
+
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            centroids=self.centroids,
+            list_sizes=sizes,
+            vectors=V,
+            ids=ids,
+            angles=np.array(self.angles, dtype=str),
+            emotions=np.array(self.emotions, dtype=str),
+            subject_ids=subjects,
+            image_paths=np.array(self.image_paths, dtype=str),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            index = cls(data["centroids"])
+            V = np.empty_like(data["vectors"])
+            V[data["ids"]] = data["vectors"]
+
+            subjects = [None if s < 0 else int(s) for s in data["subject_ids"]]
+            index.add(V, data["angles"].tolist(), data["emotions"].tolist(),
+                      subjects, data["image_paths"].tolist())
+        return index
+
+
+def _top_k(sims, k):
+    """
+    Indices of the k largest values, sorted descending.
+    """
+    if len(sims) > k:
+        idx = np.argpartition(-sims, k - 1)[:k]
+    else:
+        idx = np.arange(len(sims))
+    return idx[np.argsort(-sims[idx], kind="stable")]
+
+
+# ---------------------------------------------------------
+# BUILD FROM THE EMBEDDING STORE
+# ---------------------------------------------------------
+
+def build_index_from_parquets(base_dir, angles, n_lists=None, column="embedding", seed=0):
+    """
+    Trains an IVFIndex on all angles and inserts every valid embedding with its metadata.
+    """
+    import pandas as pd
+    from similarity.utils import clean_embedding
+
+    loaded = []
+    for angle in angles:
+        path = os.path.join(base_dir, f"{angle}_embeddings.parquet")
+        df = pd.read_parquet(path, columns=["subject_id", "emotion", "image_path", column])
+
+        rows, keep = [], []
+        for i, vec in enumerate(df[column]):
+            emb = clean_embedding(vec, min_dim=1)
+            if emb is not None:
+                rows.append(emb)
+                keep.append(i)
+        loaded.append((angle, np.vstack(rows), df.iloc[keep]))
+        print(f"[INFO] {angle:>5}: {len(keep)} embeddings")
+
+    index = IVFIndex.train(np.vstack([E for _, E, _ in loaded]), n_lists=n_lists, seed=seed)
+
+    for angle, E, df in loaded:
+        subjects = [None if pd.isna(s) else int(s) for s in df["subject_id"]]
+        index.add(E, [angle] * len(df), df["emotion"].tolist(), subjects, df["image_path"].tolist())
+
+    print(f"[INFO] Built IVF index: {index.size} vectors in {len(index.centroids)} lists")
+    return index
+
+
+# ---------------------------------------------------------
+# RECALL + LATENCY BENCHMARK
+# ---------------------------------------------------------
+
+def benchmark(index, Q, k=10, nprobes=(1, 2, 4, 8, 16), **filters):
+    """
+    Compares IVF search with exact search on queries Q.
+
+    Returns list of dicts: nprobe, recall_at_k, ms_per_query (IVF), exact_ms_per_query
+    """
+    Q = np.atleast_2d(Q)
+
+    start = time.perf_counter()
+    exact_ids, _ = index.exact_search(Q, k, **filters)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(Q)
+
+    results = []
+    for nprobe in nprobes:
+        start = time.perf_counter()
+        ids, _ = index.search(Q, k, nprobe=nprobe, **filters)
+        ms = (time.perf_counter() - start) * 1000 / len(Q)
+
+        hits = 0
+        total = 0
+        for got, want in zip(ids, exact_ids):
+            want = want[want >= 0]
+            hits += len(np.intersect1d(got[got >= 0], want))
+            total += len(want)
+
+        results.append({
+            "nprobe": nprobe,
+            f"recall_at_{k}": hits / total if total > 0 else 1.0,
+            "ms_per_query": ms,
+            "exact_ms_per_query": exact_ms,
+        })
+        print(f"[BENCH] nprobe={nprobe:>3} | recall@{k} = {results[-1][f'recall_at_{k}']:.3f} | "
+              f"{ms:.3f} ms/query (exact {exact_ms:.3f} ms/query)")
+
+    return results
+
+
+# ---------------------------------------------------------
+# MAIN
+# ---------------------------------------------------------
+
+if __name__ == "__main__":
+    BASE_DIR = "/Users/bencarmel/Documents/TAU/LiraMic/src/dataset/kdef_by_angle"
+    ANGLES = ["front", "left", "right"]
+    INDEX_PATH = os.path.join(BASE_DIR, "embeddings_ivf.npz")
+
+    if os.path.exists(INDEX_PATH):
+        index = IVFIndex.load(INDEX_PATH)
+    else:
+        index = build_index_from_parquets(BASE_DIR, ANGLES)
+        index.save(INDEX_PATH)
+
+    # query with a sample of stored vectors
+    rng = np.random.default_rng(0)
+    V = index.vectors()
+    Q = V[rng.choice(len(V), size=min(200, len(V)), replace=False)]
+
+    benchmark(index, Q, k=10)
+    benchmark(index, Q, k=10, angle="front")
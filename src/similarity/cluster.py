@@ -0,0 +1,330 @@
+"""Data-driven expression clusters per angle and how they line up with the KDEF labels.
+
+Works on collections that do not fit in RAM as N x N (or even N x D):
+
+    embeddings_to_memmap(parquets, out_dir)   streams parquet row groups into one normalized float32
+                                              memmap (N, D) + small label arrays
+    minibatch_kmeans(X, k)                    mini-batch k-means over random chunks of X (cosine:
+                                              unit-norm rows, centroids renormalized)
+    knn_graph(X, k)                           exact k-NN graph, computed tile by tile (tile x tile
+                                              similarity blocks, running top-k per row), row tiles
+                                              spread over all cores
+    contingency / purity / nmi / knn_label_agreement
+
+Only tiles of the similarity matrix ever exist; memory is O(tile^2 + N*k).
+
+    python cluster.py   -> per-angle contingency tables and metrics for BASE
+"""
+
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Make src importable
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from similarity.kmeans import assign, cluster_sums, kmeans_plus_plus
+
+
+# ---------------------------------------------------------
+# STREAMED, NORMALIZED EMBEDDING STORE
+# ---------------------------------------------------------
+
+def embeddings_to_memmap(parquet_paths, out_dir, column="embedding", batch_rows=4096):
+    """
+    Streams parquet files (row group batches, never the whole file) into out_dir/embeddings.f32,
+    L2-normalized, plus emotions.npy / subjects.npy / angles.npy. Returns open_memmap_store(out_dir).
+    """
+    import pyarrow.parquet as pq
+
+    os.makedirs(out_dir, exist_ok=True)
+    data_path = os.path.join(out_dir, "embeddings.f32")
+
+    n, dim = 0, None
+    emotions, subjects, angles = [], [], []
+    with open(data_path + ".tmp", "wb") as f:
+        for path in parquet_paths:
+            pf = pq.ParquetFile(path)
+            cols = [c for c in ("emotion", "subject_id", "angle", column) if c in pf.schema_arrow.names]
+            for batch in pf.iter_batches(batch_size=batch_rows, columns=cols):
+                values = batch.column(column)
+                valid = values.is_valid().to_numpy(zero_copy_only=False)
+                rows = int(valid.sum())
+                if rows == 0:
+                    continue
+                # flatten() skips null lists, so E holds exactly the valid rows
+                E = np.asarray(values.flatten().to_numpy(zero_copy_only=False), dtype=np.float32).reshape(rows, -1)
+                dim = dim or E.shape[1]
+                if E.shape[1] != dim:
+                    raise ValueError(f"Embedding dimension {E.shape[1]} != {dim} in {path}")
+
+                E /= np.maximum(np.linalg.norm(E, axis=1, keepdims=True), 1e-12)
+                f.write(np.ascontiguousarray(E).tobytes())
+                n += rows
+
+                for name, out in (("emotion", emotions), ("subject_id", subjects), ("angle", angles)):
+                    vals = batch.column(name).to_pylist() if name in cols else [None] * batch.num_rows
+                    out.extend(v for v, ok in zip(vals, valid) if ok)
+
+    os.replace(data_path + ".tmp", data_path)
+    np.save(os.path.join(out_dir, "emotions.npy"), np.array(emotions, dtype=object), allow_pickle=True)
+    np.save(os.path.join(out_dir, "subjects.npy"), np.array(subjects, dtype=object), allow_pickle=True)
+    np.save(os.path.join(out_dir, "angles.npy"), np.array(angles, dtype=object), allow_pickle=True)
+    with open(os.path.join(out_dir, "store.json"), "w") as f:
+        json.dump({"n": n, "dim": dim, "column": column}, f)
+
+    print(f"[INFO] Streamed {n} embeddings (dim {dim}) into {data_path}")
+    return open_memmap_store(out_dir)
+
+
+def open_memmap_store(out_dir):
+    """(X memmap (N, D) float32, emotions, subjects, angles)"""
+    with open(os.path.join(out_dir, "store.json")) as f:
+        meta = json.load(f)
+    X = np.memmap(os.path.join(out_dir, "embeddings.f32"), dtype=np.float32, mode="r",
+                  shape=(meta["n"], meta["dim"]))
+    labels = [np.load(os.path.join(out_dir, f"{name}.npy"), allow_pickle=True)
+              for name in ("emotions", "subjects", "angles")]
+    return (X, *labels)
+
+
+# ---------------------------------------------------------
+# MINI-BATCH K-MEANS
+# ---------------------------------------------------------
+
+def _parallel_assign(X, C, chunk=8192, workers=None):
+    """assign() over row chunks of X on a thread pool (BLAS releases the GIL)."""
+    starts = range(0, X.shape[0], chunk)
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        parts = list(pool.map(lambda s: assign(np.asarray(X[s:s + chunk]), C), starts))
+    if not parts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+
+def _minibatch_run(X, k, batch_size, n_steps, init_size, rng, spherical):
+    n = X.shape[0]
+
+    # k-means++ on a sample small enough for memory
+    sample = np.sort(rng.choice(n, size=init_size, replace=False))
+    C = kmeans_plus_plus(np.asarray(X[sample], dtype=np.float32), k, rng).astype(np.float64)
+    counts = np.zeros(k, dtype=np.int64)
+
+    for _ in range(n_steps):
+        idx = np.sort(rng.choice(n, size=min(batch_size, n), replace=False))
+        batch = np.asarray(X[idx], dtype=np.float32)
+        labels, _ = assign(batch, C)
+
+        sums, batch_counts = cluster_sums(batch, labels, k)
+        hit = batch_counts > 0
+        counts[hit] += batch_counts[hit]
+        # C <- C + (batch_count / count) * (batch_mean - C), i.e. a running mean per centroid
+        eta = batch_counts[hit] / counts[hit]
+        C[hit] += eta[:, None] * (sums[hit] / batch_counts[hit, None] - C[hit])
+
+        if spherical:
+            C /= np.maximum(np.linalg.norm(C, axis=1, keepdims=True), 1e-12)
+
+    return C.astype(np.float32)
+
+
+def minibatch_kmeans(X, k, batch_size=4096, n_steps=None, n_epochs=3, init_size=None, n_init=3, seed=0,
+                     spherical=True, workers=None):
+    """
+    Mini-batch k-means (per-centroid learning rate 1 / count) over random batches of X, which may
+    be a memmap: each step reads one batch of rows.
+
+    spherical=True keeps centroids on the unit sphere (cosine k-means on normalized embeddings).
+    The best of n_init runs (lowest inertia over all rows) is kept.
+    Returns:
+        C : (k, D) centroids
+        labels : (N,) final assignment of every row (chunked, multi-threaded)
+        inertia : sum of squared distances to the assigned centroid
+    """
+    n = X.shape[0]
+    k = min(k, n)
+    rng = np.random.default_rng(seed)
+    init_size = min(n, init_size or max(3 * k, 10 * batch_size))
+    n_steps = n_steps or max(1, n_epochs * n // batch_size)
+
+    best = None
+    for _ in range(n_init):
+        C = _minibatch_run(X, k, batch_size, n_steps, init_size, rng, spherical)
+        labels, dists = _parallel_assign(X, C, workers=workers)
+        inertia = float(dists.sum())
+        if best is None or inertia < best[2]:
+            best = (C, labels, inertia)
+
+    return best
+
+
+# ---------------------------------------------------------
+# TILED K-NN GRAPH
+# ---------------------------------------------------------
+
+def _merge_top_k(best_s, best_i, sims, cols, k):
+    """Merge a tile's similarities into the running top-k of each row."""
+    all_s = np.concatenate([best_s, sims], axis=1)
+    all_i = np.concatenate([best_i, np.broadcast_to(cols, sims.shape)], axis=1)
+    part = np.argpartition(-all_s, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(all_s, part, axis=1), np.take_along_axis(all_i, part, axis=1)
+
+
+def knn_graph(X, k=10, tile=4096, workers=None, out_dir=None):
+    """
+    Exact k nearest neighbours (cosine; rows of X are unit norm) of every row, self excluded.
+    The similarity matrix is only ever materialized tile x tile; row tiles run in parallel.
+    With out_dir the (N, k) results are memmaps (knn_index.i32, knn_sim.f32) there.
+    Returns:
+        index : (N, k) int32, sorted by decreasing similarity
+        sim   : (N, k) float32
+    """
+    n = X.shape[0]
+    k = min(k, n - 1)
+
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+        index = np.memmap(os.path.join(out_dir, "knn_index.i32"), dtype=np.int32, mode="w+", shape=(n, k))
+        sim = np.memmap(os.path.join(out_dir, "knn_sim.f32"), dtype=np.float32, mode="w+", shape=(n, k))
+    else:
+        index = np.empty((n, k), dtype=np.int32)
+        sim = np.empty((n, k), dtype=np.float32)
+
+    def row_tile(r0):
+        rows = np.asarray(X[r0:r0 + tile], dtype=np.float32)
+        best_s = np.full((len(rows), k), -np.inf, dtype=np.float32)
+        best_i = np.full((len(rows), k), -1, dtype=np.int64)
+
+        for c0 in range(0, n, tile):
+            cols = np.arange(c0, min(c0 + tile, n))
+            S = rows @ np.asarray(X[c0:c0 + tile], dtype=np.float32).T
+            # exclude self-similarity
+            overlap = np.arange(max(r0, c0), min(r0 + len(rows), c0 + len(cols)))
+            S[overlap - r0, overlap - c0] = -np.inf
+            best_s, best_i = _merge_top_k(best_s, best_i, S, cols, k)
+
+        order = np.argsort(-best_s, axis=1)
+        index[r0:r0 + len(rows)] = np.take_along_axis(best_i, order, axis=1)
+        sim[r0:r0 + len(rows)] = np.take_along_axis(best_s, order, axis=1)
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        list(pool.map(row_tile, range(0, n, tile)))
+
+    if out_dir is not None:
+        index.flush()
+        sim.flush()
+    return index, sim
+
+
+# ---------------------------------------------------------
+# CLUSTER / LABEL AGREEMENT
+# ---------------------------------------------------------
+
+def contingency(cluster_labels, class_labels):
+    """
+    Returns:
+        table : (K, C) int counts, rows = clusters, columns = classes
+        classes : list of class names (column order)
+    """
+    classes = sorted(set(class_labels), key=str)
+    lookup = {c: i for i, c in enumerate(classes)}
+    y = np.array([lookup[c] for c in class_labels], dtype=np.int64)
+    k = int(np.max(cluster_labels)) + 1 if len(cluster_labels) else 0
+    table = np.bincount(np.asarray(cluster_labels) * len(classes) + y, minlength=k * len(classes))
+    return table.reshape(k, len(classes)), classes
+
+
+def purity(table):
+    """Share of items in the majority class of their cluster."""
+    return float(table.max(axis=1).sum() / max(table.sum(), 1))
+
+
+def inverse_purity(table):
+    """Share of items in the cluster that holds most of their class."""
+    return float(table.max(axis=0).sum() / max(table.sum(), 1))
+
+
+def nmi(table):
+    """Normalized mutual information (arithmetic mean normalization) from a contingency table."""
+    n = table.sum()
+    if n == 0:
+        return 0.0
+    p = table / n
+    pk, pc = p.sum(axis=1), p.sum(axis=0)
+    nz = p > 0
+    mi = float((p[nz] * np.log(p[nz] / np.outer(pk, pc)[nz])).sum())
+    hk = -float((pk[pk > 0] * np.log(pk[pk > 0])).sum())
+    hc = -float((pc[pc > 0] * np.log(pc[pc > 0])).sum())
+    return mi / ((hk + hc) / 2) if hk + hc > 0 else 1.0
+
+
+def knn_label_agreement(index, class_labels):
+    """Mean share of each item's k nearest neighbours that carry the same label."""
+    y = np.asarray(class_labels, dtype=object)
+    codes = np.unique(y, return_inverse=True)[1].reshape(-1)
+    return float((codes[np.asarray(index)] == codes[:, None]).mean())
+
+
+def print_contingency(table, classes):
+    print("  cluster " + " ".join(f"{c[:9]:>9}" for c in map(str, classes)) + "     size  majority")
+    for i, row in enumerate(table):
+        majority = classes[int(row.argmax())] if row.sum() else "-"
+        print(f"  {i:>7} " + " ".join(f"{v:9d}" for v in row) + f" {row.sum():8d}  {majority}")
+
+
+# ---------------------------------------------------------
+# PER-ANGLE ANALYSIS
+# ---------------------------------------------------------
+
+def cluster_angles(base_dir, angles, k=7, knn_k=10, work_dir=None, column="embedding", seed=0):
+    """
+    For every angle: stream its parquet into a memmap, cluster with mini-batch k-means, build the
+    k-NN graph and report the cluster / emotion contingency and agreement metrics.
+    Returns {angle: {"purity", "inverse_purity", "nmi", "knn_agreement", "table", "classes"}}.
+    """
+    work_dir = work_dir or os.path.join(base_dir, "clusters")
+    results = {}
+    for angle in angles:
+        parquet = os.path.join(base_dir, f"{angle}_embeddings.parquet")
+        if not os.path.exists(parquet):
+            print(f"[WARN] Missing {parquet}")
+            continue
+
+        angle_dir = os.path.join(work_dir, angle)
+        X, emotions, _, _ = embeddings_to_memmap([parquet], angle_dir, column=column)
+
+        _, labels, inertia = minibatch_kmeans(X, k, seed=seed)
+        index, _ = knn_graph(X, knn_k, out_dir=angle_dir)
+        np.save(os.path.join(angle_dir, "cluster_labels.npy"), labels)
+
+        table, classes = contingency(labels, emotions)
+        res = {
+            "purity": purity(table),
+            "inverse_purity": inverse_purity(table),
+            "nmi": nmi(table),
+            "knn_agreement": knn_label_agreement(index, emotions),
+            "inertia": inertia,
+            "table": table,
+            "classes": classes,
+        }
+        results[angle] = res
+
+        print(f"\n[CLUSTERS] {angle}: k={k}, N={X.shape[0]}")
+        print_contingency(table, classes)
+        print(f"  purity {res['purity']:.3f}  inverse purity {res['inverse_purity']:.3f}  "
+              f"NMI {res['nmi']:.3f}  {knn_k}-NN label agreement {res['knn_agreement']:.3f}")
+
+    return results
+
+
+# ---------------------------------------------------------
+# EXECUTABLE SCRIPT
+# ---------------------------------------------------------
+
+if __name__ == "__main__":
+    BASE = "/Users/bencarmel/Documents/TAU/LiraMic/src/dataset/kdef_by_angle"
+    ANGLES = ["front", "left", "right"]
+    cluster_angles(BASE, ANGLES, k=7)
@@ -0,0 +1,123 @@
+"""Small NumPy k-means used by embedding compression and indexing.
+
+kmeans(X, k) runs Lloyd iterations from a k-means++ initialisation and returns (centroids, assignments).
+assign(X, C) maps rows to their nearest centroid in chunks so memory stays bounded for large N.
+"""
+
+import numpy as np
+
+
+# ---------------------------------------------------------
+# NEAREST-CENTROID ASSIGNMENT
+# ---------------------------------------------------------
+
+def assign(X, C, chunk=8192):
+    """
+    X: (N, D), C: (K, D)
+    Returns:
+        labels : (N,) int64 index of the nearest centroid (squared L2)
+        dists  : (N,) float squared distance to it
+    """
+    C_sq = np.einsum("kd,kd->k", C, C)
+    labels = np.empty(X.shape[0], dtype=np.int64)
+    dists = np.empty(X.shape[0], dtype=np.float64)
+
+    for start in range(0, X.shape[0], chunk):
+        x = X[start:start + chunk]
+        # ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2 ; ||x||^2 is constant per row
+        d = C_sq[None, :] - 2.0 * (x @ C.T)
+        lab = d.argmin(axis=1)
+        labels[start:start + chunk] = lab
+        dists[start:start + chunk] = d[np.arange(len(lab)), lab] + np.einsum("nd,nd->n", x, x)
+
+    return labels, np.maximum(dists, 0.0)
+
+
+# ---------------------------------------------------------
+# PER-CLUSTER SUMS
+# ---------------------------------------------------------
+
+def cluster_sums(X, labels, k):
+    """
+    Returns:
+        sums : (k, D) float64 sum of the rows assigned to each cluster
+        counts : (k,) int64
+    """
+    counts = np.bincount(labels, minlength=k)
+    sums = np.zeros((k, X.shape[1]), dtype=np.float64)
+
+    nonempty = np.flatnonzero(counts)
+    if len(nonempty) > 0:
+        order = np.argsort(labels, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts[nonempty])[:-1]])
+        sums[nonempty] = np.add.reduceat(X[order].astype(np.float64), starts, axis=0)
+
+    return sums, counts
+
+
+# ---------------------------------------------------------
+# K-MEANS++ INITIALISATION
+# ---------------------------------------------------------
+
+def kmeans_plus_plus(X, k, rng):
+    """
+    Returns (k, D) initial centroids chosen with D^2 weighting.
+    """
+    n = X.shape[0]
+    centroids = np.empty((k, X.shape[1]), dtype=X.dtype)
+    centroids[0] = X[rng.integers(n)]
+    closest = np.einsum("nd,nd->n", X - centroids[0], X - centroids[0])
+
+    for i in range(1, k):
+        total = closest.sum()
+        if total <= 0:
+            idx = rng.integers(n)
+        else:
+            idx = rng.choice(n, p=closest / total)
+        centroids[i] = X[idx]
+        diff = X - centroids[i]
+        closest = np.minimum(closest, np.einsum("nd,nd->n", diff, diff))
+
+    return centroids
+
+
+# ---------------------------------------------------------
+# LLOYD ITERATIONS
+# ---------------------------------------------------------
+
+def kmeans(X, k, n_iter=25, seed=0, tol=1e-6):
+    """
+    X: (N, D) float
+    k: number of clusters (clipped to N)
+    Returns:
+        C : (k, D) centroids
+        labels : (N,) assignments
+    """
+    X = np.asarray(X, dtype=np.float32)
+    k = min(k, X.shape[0])
+    rng = np.random.default_rng(seed)
+
+    C = kmeans_plus_plus(X, k, rng)
+    prev_inertia = None
+
+    for _ in range(n_iter):
+        labels, dists = assign(X, C)
+
+        sums, counts = cluster_sums(X, labels, k)
+
+        nonempty = counts > 0
+        C[nonempty] = (sums[nonempty] / counts[nonempty, None]).astype(C.dtype)
+
+        # re-seed empty clusters with the points farthest from their centroid
+        empty = np.flatnonzero(~nonempty)
+        if len(empty) > 0:
+            far = np.argsort(dists)[::-1][:len(empty)]
+            C[empty] = X[far]
+
+        inertia = dists.sum()
+        if prev_inertia is not None and abs(prev_inertia - inertia) <= tol * max(prev_inertia, 1e-12):
+            break
+        prev_inertia = inertia
+
+    labels, _ = assign(X, C)
+    return C, labels
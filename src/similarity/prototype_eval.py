@@ -0,0 +1,243 @@
+"""Leave-one-subject-out (LOSO) evaluation of emotion prototype classifiers.
+
+A prototype is the mean normalized embedding of one emotion. For every held-out subject the prototypes are
+rebuilt from all *other* subjects and each of the subject's images is assigned to the most similar prototype.
+Instead of recomputing prototypes per fold, all folds are derived from precomputed group sums:
+
+    proto[s, c] = S[c] - T[s, c]          (S = per-emotion sum, T = per-subject/emotion sum)
+
+and every image is scored against its own fold's prototypes with a single batched matmul. Cosine similarity is
+scale invariant, so the division by the fold count is only needed to detect empty classes.
+
+evaluate_loso(E_train, ...) handles both same-angle (train == test) and cross-angle (train front, test left)
+evaluation. evaluate_all_angles(base_dir, angles) and cross_angle_table(base_dir, angles) run on the
+{angle}_embeddings.parquet files written by store_embeddings; column= / model= select a compressed or
+per-model embedding column.
+"""
+
+import os
+import sys
+import numpy as np
+
+# Make src importable
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from similarity.utils import load_parquet_embeddings, normalize_embeddings
+
+
+# ---------------------------------------------------------
+# GROUP SUMS
+# ---------------------------------------------------------
+
+def _group_sums(E, class_idx, subject_idx, n_classes, n_subjects):
+    """
+    E: normalized embeddings (N, D)
+    Returns:
+        S : (C, D)    per-class sums
+        n : (C,)      per-class counts
+        T : (Sb, C, D) per-subject, per-class sums
+        m : (Sb, C)   per-subject, per-class counts
+    """
+    D = E.shape[1]
+    flat = subject_idx * n_classes + class_idx
+
+    m = np.bincount(flat, minlength=n_subjects * n_classes)
+
+    # segment sums over the rows sorted by group (much faster than np.add.at)
+    order = np.argsort(flat, kind="stable")
+    groups = np.flatnonzero(m)
+    starts = np.concatenate([[0], np.cumsum(m[groups])[:-1]])
+
+    T = np.zeros((n_subjects * n_classes, D), dtype=np.float64)
+    if len(groups) > 0:
+        T[groups] = np.add.reduceat(E[order], starts, axis=0)
+
+    T = T.reshape(n_subjects, n_classes, D)
+    m = m.reshape(n_subjects, n_classes)
+
+    return T.sum(axis=0), m.sum(axis=0), T, m
+
+
+# ---------------------------------------------------------
+# LOSO SCORING
+# ---------------------------------------------------------
+
+def loso_scores(E_train, y_train, s_train, E_test, y_test, s_test, n_classes, n_subjects):
+    """
+    Scores every test image against the prototypes built without its own subject.
+
+    y_*: int class indices, s_*: int subject indices (shared index space for train and test).
+    Returns:
+        scores : (N_test, C) cosine similarity; -inf where the fold has no training image of that class
+    """
+    Etr = normalize_embeddings(np.asarray(E_train, dtype=np.float64))
+    Ete = normalize_embeddings(np.asarray(E_test, dtype=np.float64))
+
+    S, n, T, m = _group_sums(Etr, y_train, s_train, n_classes, n_subjects)
+
+    # <e_i, S_c - T_{s_i,c}> = <e_i, S_c> - <e_i, T_{s_i,c}>
+    dot_S = Ete @ S.T                                             # (N, C)
+    dot_T_all = Ete @ T.reshape(n_subjects * n_classes, -1).T     # (N, Sb*C)
+    cols = s_test[:, None] * n_classes + np.arange(n_classes)[None, :]
+    dot_T = np.take_along_axis(dot_T_all, cols, axis=1)          # (N, C)
+
+    # ||S_c - T_{s,c}||^2 = ||S_c||^2 - 2<S_c, T_{s,c}> + ||T_{s,c}||^2
+    S_sq = np.einsum("cd,cd->c", S, S)
+    ST = np.einsum("cd,scd->sc", S, T)
+    T_sq = np.einsum("scd,scd->sc", T, T)
+    proto_norm = np.sqrt(np.maximum(S_sq[None, :] - 2 * ST + T_sq, 0.0))   # (Sb, C)
+
+    fold_count = n[None, :] - m                                   # (Sb, C)
+
+    norms = proto_norm[s_test]
+    counts = fold_count[s_test]
+
+    scores = np.full((Ete.shape[0], n_classes), -np.inf)
+    valid = (counts > 0) & (norms > 0)
+    scores[valid] = (dot_S - dot_T)[valid] / norms[valid]
+    return scores
+
+
+# ---------------------------------------------------------
+# CONFUSION MATRIX + ACCURACY
+# ---------------------------------------------------------
+
+def confusion_matrix(y_true, y_pred, n_classes):
+    """
+    Rows = true class, columns = predicted class.
+    """
+    cm = np.bincount(y_true * n_classes + y_pred, minlength=n_classes * n_classes)
+    return cm.reshape(n_classes, n_classes)
+
+
+def _encode(values, vocabulary):
+    lookup = {v: i for i, v in enumerate(vocabulary)}
+    return np.array([lookup[v] for v in values], dtype=np.int64)
+
+
+def evaluate_loso(E_train, emotions_train, subjects_train, E_test=None, emotions_test=None, subjects_test=None):
+    """
+    Runs LOSO prototype classification.
+
+    Without test arguments the training set is evaluated against itself (same-angle evaluation).
+    With them, prototypes come from the training set and the test images are classified, still leaving out
+    the test image's subject (cross-angle evaluation).
+
+    Returns dict:
+        confusion : (C, C) int
+        accuracy : float
+        labels : list[str]
+        n_test : int
+    """
+    if E_test is None:
+        E_test, emotions_test, subjects_test = E_train, emotions_train, subjects_train
+
+    labels = sorted(set(emotions_train))
+    subjects = sorted(set(subjects_train) | set(subjects_test), key=str)
+
+    # test emotions unseen in training can never be predicted; keep them out of the label space
+    keep = np.array([e in set(labels) for e in emotions_test])
+    if not keep.all():
+        print(f"[WARN] Dropping {int((~keep).sum())} test images with emotions absent from training")
+    E_test = np.asarray(E_test)[keep]
+    emotions_test = [e for e, k in zip(emotions_test, keep) if k]
+    subjects_test = [s for s, k in zip(subjects_test, keep) if k]
+
+    y_train = _encode(emotions_train, labels)
+    y_test = _encode(emotions_test, labels)
+    s_train = _encode(subjects_train, subjects)
+    s_test = _encode(subjects_test, subjects)
+
+    scores = loso_scores(E_train, y_train, s_train, E_test, y_test, s_test, len(labels), len(subjects))
+    y_pred = scores.argmax(axis=1)
+
+    cm = confusion_matrix(y_test, y_pred, len(labels))
+    accuracy = float(np.trace(cm) / cm.sum()) if cm.sum() > 0 else 0.0
+
+    return {
+        "confusion": cm,
+        "accuracy": accuracy,
+        "labels": labels,
+        "n_test": int(len(y_test)),
+    }
+
+
+# ---------------------------------------------------------
+# PER-ANGLE + CROSS-ANGLE EVALUATION
+# ---------------------------------------------------------
+
+def _load_angle(base_dir, angle, column, model=None):
+    parquet_path = os.path.join(base_dir, f"{angle}_embeddings.parquet")
+    return load_parquet_embeddings(parquet_path, column=column, model=model)
+
+
+def evaluate_all_angles(base_dir, angles, column="embedding", model=None):
+    """
+    Same-angle LOSO evaluation for every angle.
+    Returns: {angle: result dict from evaluate_loso}
+    """
+    results = {}
+    for angle in angles:
+        E, emotions, subjects = _load_angle(base_dir, angle, column, model)
+        results[angle] = evaluate_loso(E, emotions, subjects)
+        print(f"[INFO] {angle:>5}: LOSO accuracy = {results[angle]['accuracy']:.3f} "
+              f"({results[angle]['n_test']} images)")
+    return results
+
+
+def evaluate_cross_angle(base_dir, train_angle, test_angle, column="embedding", model=None):
+    """
+    Prototypes from train_angle, classification of test_angle images (held-out subject excluded).
+    """
+    E_tr, emo_tr, subj_tr = _load_angle(base_dir, train_angle, column, model)
+    E_te, emo_te, subj_te = _load_angle(base_dir, test_angle, column, model)
+    return evaluate_loso(E_tr, emo_tr, subj_tr, E_te, emo_te, subj_te)
+
+
+def cross_angle_table(base_dir, angles, column="embedding", model=None):
+    """
+    Evaluates every (train, test) angle pair, loading each parquet once.
+    Returns:
+        acc : (A, A) accuracy matrix, rows = train angle, columns = test angle
+        results : {(train, test): result dict}
+    """
+    data = {angle: _load_angle(base_dir, angle, column, model) for angle in angles}
+
+    acc = np.zeros((len(angles), len(angles)))
+    results = {}
+    for i, train in enumerate(angles):
+        for j, test in enumerate(angles):
+            res = evaluate_loso(*data[train], *data[test])
+            results[(train, test)] = res
+            acc[i, j] = res["accuracy"]
+
+    return acc, results
+
+
+# ---------------------------------------------------------
+# EXECUTABLE SCRIPT
+# ---------------------------------------------------------
+
+if __name__ == "__main__":
+    import time
+
+    BASE = "/Users/bencarmel/Documents/TAU/LiraMic/src/dataset/kdef_by_angle"
+    ANGLES = ["front", "left", "right"]
+
+    start = time.perf_counter()
+    acc, results = cross_angle_table(BASE, ANGLES)
+    elapsed = time.perf_counter() - start
+
+    print("\n[LOSO PROTOTYPE ACCURACY] rows = train angle, columns = test angle")
+    print("        " + "".join(f"{a:>8}" for a in ANGLES))
+    for i, train in enumerate(ANGLES):
+        print(f"{train:>8}" + "".join(f"{acc[i, j]:8.3f}" for j in range(len(ANGLES))))
+
+    for angle in ANGLES:
+        res = results[(angle, angle)]
+        print(f"\n[CONFUSION] {angle} (rows = true, columns = predicted)")
+        print("          " + " ".join(f"{l[:8]:>8}" for l in res["labels"]))
+        for label, row in zip(res["labels"], res["confusion"]):
+            print(f"{label[:9]:>9} " + " ".join(f"{v:8d}" for v in row))
+
+    print(f"\n[INFO] Evaluation finished in {elapsed:.3f}s", file=sys.stderr)
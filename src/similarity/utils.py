@@ -1,14 +1,14 @@
 import os
 import numpy as np
 from tqdm import tqdm
-from model.hsem import get_embedding
+from model.hsem import get_embedding, find_embedding_column
 
 
 # ---------------------------------------------------------
 # CLEAN ONE EMBEDDING VECTOR
 # ---------------------------------------------------------
 
-def clean_embedding(vec):
+def clean_embedding(vec, min_dim=100):
     """
     Takes a raw embedding and returns a clean 1D float32 vector.
     Handles:
@@ -38,7 +38,7 @@ def clean_embedding(vec):
         return None
 
     # corrupted or wrong dimension
-    if v.size < 100:
+    if v.size < min_dim:
         return None
 
     # zero vector = useless
@@ -184,3 +184,58 @@ def collapse_emotion_matrix(sim_M, emotions):
             mat[i, j] = sub.mean()
 
     return mat, unique
+
+
+# ---------------------------------------------------------
+# LOAD STORED EMBEDDINGS FROM PARQUET
+# ---------------------------------------------------------
+
+def load_parquet_embeddings(parquet_path, column="embedding", model=None):
+    """
+    Loads + cleans the embeddings stored by store_embeddings for one angle.
+
+    column selects the representation: "embedding" (full precision) or a compressed
+    column written by embeddings.compress (e.g. "embedding_pca128", "embedding_pq32x256").
+    Product-quantization codes are decoded with the codebook saved next to the parquet, so the
+    returned vectors are full-dimensional (PQ saves storage here, not compute).
+    model selects the per-model column written by a multi-model run instead
+    (embedding__{model}__{dim}, see model.hsem.embedding_column).
+
+    Returns:
+        E : ndarray (N, D) float32
+        emotions : list[str] length N
+        subject_ids : list length N
+
+    Rows whose embedding fails clean_embedding are dropped.
+    """
+    import pandas as pd
+    import pyarrow.parquet as pq
+
+    if model is not None:
+        column = find_embedding_column(pq.read_schema(parquet_path).names, model)
+
+    df = pd.read_parquet(parquet_path, columns=["subject_id", "emotion", column])
+
+    if column == "embedding":
+        decode, min_dim = None, 100
+    elif column.startswith("embedding__"):
+        decode, min_dim = None, 1
+    else:
+        from embeddings.compress import column_decoder
+        decode, min_dim = column_decoder(parquet_path, column), 1
+
+    rows, emotions, subjects = [], [], []
+    for vec, emotion, subject_id in zip(df[column], df["emotion"], df["subject_id"]):
+        if decode is not None and vec is not None:
+            vec = decode(vec)
+        emb = clean_embedding(vec, min_dim=min_dim)
+        if emb is None:
+            continue
+        rows.append(emb)
+        emotions.append(emotion)
+        subjects.append(subject_id)
+
+    if len(rows) == 0:
+        raise ValueError(f"No valid embeddings found in {parquet_path}")
+
+    return np.vstack(rows), emotions, subjects
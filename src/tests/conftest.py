@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Make src (and the bare-import crop/label helpers) importable
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (SRC_DIR, os.path.join(SRC_DIR, "preprocess"), os.path.join(SRC_DIR, "preprocess", "crop")):
+    if path not in sys.path:
+        sys.path.append(path)
@@ -0,0 +1,79 @@
+"""The zip reader must yield exactly what the directory reader yields for the same tree."""
+import os
+import zipfile
+
+import cv2
+import numpy as np
+
+from archive_reader import iter_images, map_image_bytes
+
+
+def _make_tree(root):
+    rng = np.random.default_rng(0)
+    rels = ["AF01/AF01ANS.png", "AF01/AF01HAS.png", "AM02/AM02SAS.png"]
+    for rel in rels:
+        path = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        cv2.imwrite(path, rng.integers(0, 256, (12, 10, 3), dtype=np.uint8))
+    with open(os.path.join(root, "AF01", "notes.txt"), "w") as f:
+        f.write("not an image")
+    return rels
+
+
+def _zip_tree(root, zip_path, prefix=""):
+    with zipfile.ZipFile(zip_path, "w") as zf:
+        for dirpath, _, filenames in os.walk(root):
+            for fname in filenames:
+                path = os.path.join(dirpath, fname)
+                zf.write(path, prefix + os.path.relpath(path, root).replace(os.sep, "/"))
+        zf.writestr("__MACOSX/AF01/._AF01ANS.png", b"resource fork")
+
+
+def test_zip_matches_directory(tmp_path):
+    tree = tmp_path / "tree"
+    rels = _make_tree(str(tree))
+    zip_path = str(tmp_path / "kdef.zip")
+    _zip_tree(str(tree), zip_path)
+
+    from_dir = list(iter_images(str(tree)))
+    from_zip = list(iter_images(zip_path, workers=2))
+
+    assert [rel for rel, _ in from_dir] == rels
+    assert [rel for rel, _ in from_zip] == rels
+    for (_, a), (_, b) in zip(from_dir, from_zip):
+        assert a.dtype == np.uint8 and a.shape == (12, 10, 3)
+        np.testing.assert_array_equal(a, b)
+
+
+def test_zip_prefix_is_stripped(tmp_path):
+    tree = tmp_path / "tree"
+    rels = _make_tree(str(tree))
+    zip_path = str(tmp_path / "kdef.zip")
+    _zip_tree(str(tree), zip_path, prefix="KDEF/")
+
+    assert [rel for rel, _ in iter_images(zip_path, prefix="KDEF/")] == rels
+    assert [rel for rel, _ in iter_images(zip_path, prefix="KDEF/AF01")] == [r[len("AF01/"):] for r in rels[:2]]
+
+
+def test_map_image_bytes_matches_between_sources(tmp_path):
+    tree = tmp_path / "tree"
+    _make_tree(str(tree))
+    zip_path = str(tmp_path / "kdef.zip")
+    _zip_tree(str(tree), zip_path)
+
+    from_dir = list(map_image_bytes(str(tree), len, workers=2))
+    from_zip = list(map_image_bytes(zip_path, len, workers=2))
+    assert from_dir == from_zip
+    assert all(result == size for _, result, size in from_dir)
+
+
+def test_directory_holding_only_the_zip_reads_the_zip(tmp_path):
+    # orig_kdef/ after kaggle/download.py (unzip=False) contains nothing but the archive
+    tree = tmp_path / "tree"
+    rels = _make_tree(str(tree))
+    orig = tmp_path / "orig_kdef"
+    orig.mkdir()
+    _zip_tree(str(tree), str(orig / "kdef-database.zip"))
+
+    assert [rel for rel, _ in iter_images(str(orig))] == rels
+    assert [rel for rel, _, _ in map_image_bytes(str(orig), len)] == rels
@@ -0,0 +1,33 @@
+"""Compressed columns must keep cosine similarities close to full precision."""
+import numpy as np
+
+from embeddings.compress import fit_pca, fit_random_projection, project, _cosine
+
+
+def _embeddings(n=300, d=512, seed=0):
+    # HSEmotion-like features: non-negative with a large shared mean and a low-rank signal
+    rng = np.random.default_rng(seed)
+    signal = rng.standard_normal((n, 16)) @ rng.standard_normal((16, d)) * 0.3
+    return np.maximum(2.0 + signal + 0.05 * rng.standard_normal((n, d)), 0.0)
+
+
+def _pair_error(E, compressed):
+    return np.abs(_cosine(E) - _cosine(compressed))
+
+
+def test_pca_preserves_cosine():
+    E = _embeddings()
+    err = _pair_error(E, project(fit_pca(E, 128), E))
+    assert err.mean() < 1e-3 and err.max() < 1e-2
+
+
+def test_pca_full_rank_is_exact():
+    E = _embeddings(n=100, d=64)
+    err = _pair_error(E, project(fit_pca(E, 64), E))
+    assert err.max() < 1e-4
+
+
+def test_random_projection_error_is_bounded():
+    E = _embeddings()
+    err = _pair_error(E, project(fit_random_projection(E.shape[1], 256), E))
+    assert err.mean() < 0.05
@@ -0,0 +1,40 @@
+"""CLI start-up must stay cheap and must not pull in the heavy ML stack (see cli.py selfcheck)."""
+import json
+import os
+import subprocess
+import sys
+
+from cli import HEAVY_MODULES, SRC_DIR, check_import_budget
+
+# generous for CI machines; override with LIRAMIC_IMPORT_BUDGET_MS
+BUDGET_MS = float(os.environ.get("LIRAMIC_IMPORT_BUDGET_MS", 500))
+
+
+def _modules_loaded_by(code):
+    script = code + "\nimport json, sys\nsys.stderr.write(json.dumps(sorted(sys.modules)))\n"
+    proc = subprocess.run([sys.executable, "-c", script], cwd=SRC_DIR, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    return {m.split(".")[0] for m in json.loads(proc.stderr.strip().splitlines()[-1])}
+
+
+def test_light_modules_within_import_budget():
+    problems = check_import_budget(budget_ms=BUDGET_MS)
+    assert problems == []
+
+
+def test_import_cli_loads_no_heavy_modules():
+    loaded = _modules_loaded_by("import cli")
+    assert not loaded & {"torch", "facenet_pytorch", "mediapipe", "timm"}
+    assert not loaded & set(HEAVY_MODULES)
+
+
+def test_cli_help_loads_no_heavy_modules():
+    loaded = _modules_loaded_by(
+        "import runpy, sys\n"
+        "sys.argv = ['cli.py', '--help']\n"
+        "try:\n"
+        "    runpy.run_path('cli.py', run_name='__main__')\n"
+        "except SystemExit:\n"
+        "    pass\n"
+    )
+    assert not loaded & set(HEAVY_MODULES)
@@ -0,0 +1,24 @@
+"""A failing stage blocks its whole downstream chain instead of aborting the run."""
+from pipelines.orchestrator import Stage, run_pipeline
+
+
+def _fail():
+    raise RuntimeError("stage failed")
+
+
+def test_failure_blocks_chain_not_in_name_order(tmp_path):
+    ran = []
+    stages = [
+        Stage("z", _fail),
+        Stage("y", lambda: ran.append("y"), deps=["z"]),
+        Stage("x", lambda: ran.append("x"), deps=["y"]),
+        Stage("w", lambda: ran.append("w"), deps=["x"]),
+        Stage("a", lambda: ran.append("a")),
+    ]
+
+    summary = run_pipeline(stages, str(tmp_path / "state.json"), workers=2)
+
+    assert summary["z"][0] == "failed"
+    assert {name: summary[name][0] for name in ("y", "x", "w")} == {"y": "blocked", "x": "blocked", "w": "blocked"}
+    assert summary["a"][0] == "ran"
+    assert ran == ["a"]
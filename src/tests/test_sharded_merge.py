@@ -0,0 +1,88 @@
+"""merge_shards must validate the whole manifest before replacing any per-angle file."""
+import os
+import shutil
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from embeddings.checkpoint import EMBEDDING_SCHEMA
+from embeddings.sharded import merge_shards, shard_of, shard_paths, _write_status
+
+NUM_SHARDS = 2
+
+
+def _make_base(base_dir):
+    """kdef_by_angle-style tree of empty image files; returns [(angle, image path), ...]."""
+    items = []
+    for angle in ("front", "left"):
+        for emotion in ("happy", "sad"):
+            emotion_dir = os.path.join(base_dir, angle, emotion)
+            os.makedirs(emotion_dir)
+            for subject in (1, 2):
+                path = os.path.join(emotion_dir, f"{subject}_{emotion}.jpg")
+                open(path, "wb").close()
+                items.append((angle, path))
+    return items
+
+
+def _write_shards(base_dir, out_dir, items):
+    os.makedirs(out_dir, exist_ok=True)
+    for i in range(NUM_SHARDS):
+        rows = [{"subject_id": 1, "emotion": "happy", "angle": angle, "image_path": path, "embedding": [0.5, 0.5]}
+                for angle, path in items if shard_of(base_dir, path, NUM_SHARDS) == i]
+        parquet_path, status_path = shard_paths(out_dir, i, NUM_SHARDS)
+        pq.write_table(pa.Table.from_pylist(rows, schema=EMBEDDING_SCHEMA), parquet_path)
+        _write_status(status_path, state="done", done=len(rows), total=len(rows), base_dir=os.path.abspath(base_dir))
+
+
+def _previous_outputs(base_dir):
+    contents = {}
+    for angle in ("front", "left"):
+        path = os.path.join(base_dir, f"{angle}_embeddings.parquet")
+        pq.write_table(pa.table({"previous": [angle]}), path)
+        with open(path, "rb") as f:
+            contents[path] = f.read()
+    return contents
+
+
+def test_merge_with_missing_item_keeps_previous_outputs(tmp_path):
+    base_dir, out_dir = str(tmp_path / "base"), str(tmp_path / "shards")
+    items = _make_base(base_dir)
+    previous = _previous_outputs(base_dir)
+
+    # the last "left" image never made it into any shard; "front" is complete
+    _write_shards(base_dir, out_dir, items[:-1])
+
+    with pytest.raises(RuntimeError, match="1 manifest images missing"):
+        merge_shards(base_dir, out_dir, NUM_SHARDS, angles=["front", "left"])
+
+    for path, content in previous.items():
+        with open(path, "rb") as f:
+            assert f.read() == content
+        assert not os.path.exists(path + ".tmp")
+
+
+def test_merge_drops_duplicates(tmp_path):
+    base_dir, out_dir = str(tmp_path / "base"), str(tmp_path / "shards")
+    items = _make_base(base_dir)
+    _write_shards(base_dir, out_dir, items + items[:2])
+
+    counts = merge_shards(base_dir, out_dir, NUM_SHARDS, angles=["front", "left"])
+
+    assert counts == {"front": 4, "left": 4}
+    front = pq.read_table(os.path.join(base_dir, "front_embeddings.parquet"))
+    assert sorted(front["image_path"].to_pylist()) == sorted(p for a, p in items if a == "front")
+
+
+def test_merge_after_dataset_root_moved(tmp_path):
+    base_dir, out_dir = str(tmp_path / "base"), str(tmp_path / "shards")
+    items = _make_base(base_dir)
+    _write_shards(base_dir, out_dir, items)
+
+    # the workers ran against base/; the merge sees the same dataset mounted at moved/
+    moved = str(tmp_path / "moved")
+    shutil.move(base_dir, moved)
+
+    counts = merge_shards(moved, out_dir, NUM_SHARDS, angles=["front", "left"])
+    assert counts == {"front": 4, "left": 4}
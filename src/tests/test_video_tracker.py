@@ -0,0 +1,49 @@
+"""The face tracker must follow a face that is partly outside the frame without drifting."""
+import cv2
+import numpy as np
+
+from embeddings import video_embeddings
+from embeddings.video_embeddings import FaceTracker
+
+H, W, FACE = 240, 320, 80
+
+
+def _face_texture(seed=0):
+    rng = np.random.default_rng(seed)
+    noise = cv2.GaussianBlur(rng.standard_normal((FACE, FACE)).astype(np.float32), (0, 0), 3)
+    noise = (noise - noise.min()) / (noise.max() - noise.min())
+    return (40 + 200 * noise).astype(np.uint8)
+
+
+def _frame(face, fx, fy):
+    """Flat background with the face pasted at (fx, fy); parts outside the frame are cut off."""
+    frame = np.full((H, W), 128, dtype=np.uint8)
+    x1, y1 = max(fx, 0), max(fy, 0)
+    x2, y2 = min(fx + FACE, W), min(fy + FACE, H)
+    frame[y1:y2, x1:x2] = face[y1 - fy:y2 - fy, x1 - fx:x2 - fx]
+    return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+
+
+def test_tracking_face_at_left_edge_does_not_drift(monkeypatch):
+    face = _face_texture()
+    fy, fx0, step = 60, -30, 3
+    calls = []
+
+    def fake_detect_face(image, detect_image=None):
+        calls.append(1)
+        return np.array([fx0, fy, fx0 + FACE, fy + FACE], dtype=np.float32), 0.99, None
+
+    monkeypatch.setattr(video_embeddings, "detect_face", fake_detect_face)
+    tracker = FaceTracker(keyframe_every=1000, min_score=0.5)
+
+    box, detected, _ = tracker.update(_frame(face, fx0, fy))
+    assert detected and tuple(box) == (0, fy, fx0 + FACE, fy + FACE)
+
+    for k in range(1, 10):
+        fx = fx0 + k * step
+        box, detected, score = tracker.update(_frame(face, fx, fy))
+        assert not detected and score > 0.9
+        # the template is the part that was visible at detection (FACE + fx0 wide), now at fx - fx0
+        expected = (fx - fx0, fy, fx + FACE, fy + FACE)
+        assert np.abs(np.array(box) - expected).max() <= 1, (box, expected)
+    assert len(calls) == 1